@@ -69,7 +69,7 @@ sub uimm {
 sub imm {
   sub {
     my $x = shift;
-    legal_int_p $x || legal_uint_p $x or die "bad integer \@ $line_count";
+    legal_int_p($x) || legal_uint_p($x) or die "bad integer \@ $line_count";
     print pack("Q<", $x >= 0 ? +$x : $x + 2**64);
   }
 }
@@ -130,6 +130,34 @@ defop "IDIV", 30, ureg, ureg;
 defop "FDIV", 31, freg, freg;
 defop "CALL", 32, ureg, ureg;
 defop "STOP", 33, ureg;
+# superinstructions
+defop "UADDI", 34, ureg, ureg,  imm;
+defop  "ULDO", 35, ureg, ureg,  imm;
+defop  "FLDO", 36, freg, ureg,  imm;
+defop  "USTO", 37, ureg,  imm, ureg;
+defop  "FSTO", 38, ureg,  imm, freg;
+defop  "ULDA", 39, ureg,  imm;
+defop  "FLDA", 40, freg,  imm;
+defop  "USTA", 41,  imm, ureg;
+defop  "FSTA", 42,  imm, freg;
+defop "UEQBT", 43, ureg, ureg, iimm;
+defop "UEQBF", 44, ureg, ureg, iimm;
+defop "FEQBT", 45, freg, freg, iimm;
+defop "FEQBF", 46, freg, freg, iimm;
+defop "UGTBT", 47, ureg, ureg, iimm;
+defop "UGTBF", 48, ureg, ureg, iimm;
+defop "IGTBT", 49, ureg, ureg, iimm;
+defop "IGTBF", 50, ureg, ureg, iimm;
+defop "FGTBT", 51, freg, freg, iimm;
+defop "FGTBF", 52, freg, freg, iimm;
+defop "ULTBT", 53, ureg, ureg, iimm;
+defop "ULTBF", 54, ureg, ureg, iimm;
+defop "ILTBT", 55, ureg, ureg, iimm;
+defop "ILTBF", 56, ureg, ureg, iimm;
+defop "FLTBT", 57, freg, freg, iimm;
+defop "FLTBF", 58, freg, freg, iimm;
+# a data word of the image, not an instruction
+defop "WORD", undef, imm;
 
 sub trans_a_line {
   my $line = @_ ? $_[0] : $_;
@@ -157,7 +185,7 @@ sub trans_a_line {
 
   my @rands = ($rand1, grep { length } split(/\s*,\s*|\s+/, $rands));
 
-  print pack("Q<", $operations{$op}->{id});
+  print pack("Q<", $operations{$op}->{id}) if defined $operations{$op}->{id};
 
   my $i = 0;
   foreach my $f (@{ $operations{$op}->{operands} }) {
@@ -0,0 +1,1994 @@
+#! /usr/bin/env python
+
+# code generator, the syntax tree is lowered to three address code over frame
+# slots and image words, then opcode.h instructions are selected for it
+
+from __future__ import annotations
+import struct
+from dataclasses import dataclass, field
+from typing import Any, List
+from complr import *
+from opt import Resolver, labels_of, arg_names, type_of, functions, units_in, \
+    descendants, written, root_of, unescaped
+
+IMAGE_BASE = 1024;
+STACK_GAP = 1024;
+STACK_SIZE = 1048576;
+C_CALLS = {
+    'printf': 1, 'fopen': 2, 'fclose': 3, 'fseek': 4, 'writetxt': 5,
+    'writebytes': 6, 'readtxt': 7, 'readbytes': 8, 'bytes': 9, 'imgsiz': 10
+};
+C_INT_ARGS = 4;
+INT_ARGS = ('r3', 'r4', 'r5', 'r6');
+REAL_ARGS = ('x0', 'x1', 'x2', 'x3', 'x4', 'x5', 'x6', 'x7');
+UNROLL_COPY = 16;
+SWITCH_CASES = 4;       # IF chains on one variable from this many arms
+SWITCH_DENSITY = 3;     # a jump table when it is at most this times the arms
+SWITCH_LINEAR = 3;      # decision tree leaves compare one by one
+
+def read_opcodes():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'opcode.h');
+    with open(path) as f:
+        names = re.findall(r'^OPCODE\((\w+)\)', f.read(), re.M);
+    return {name: n for n, name in enumerate(names)}
+
+OPCODES = read_opcodes();
+SHORT_OPS = ('BT', 'BF', 'STOP');
+NOCODE = ('label', 'comment', 'line');  # Select pseudo instructions
+
+@dataclass(eq=False)
+class CType:
+    kind: str           # int, uint, real, bool, proc, ptr, array, record or vector
+    size: int = 1
+    elem: Any = None    # the element type, or a thunk of the pointed type
+    dims: List[int] = None
+    fields: dict = None # name -> (offset, CType)
+
+    def scalarp(self):
+        return self.kind not in ('array', 'record', 'vector');
+
+    def realp(self):
+        return self.kind == 'real';
+
+    def target(self):
+        if callable(self.elem):
+            self.elem = self.elem();
+        return self.elem
+
+INT = CType('int');
+UINT = CType('uint');
+REAL = CType('real');
+BOOL = CType('bool');
+PROC = CType('proc');
+SCALARS = {
+    'INTEGER': INT, 'UNSIGNED': UINT, 'REAL': REAL, 'CHAR': UINT,
+    'BOOLEAN': BOOL, 'PROCEDURE': PROC, 'FUNCTION': PROC
+};
+
+def pointer(t):
+    return CType('ptr', 1, t);
+
+@dataclass(eq=False)
+class Slot:
+    name: str
+    type: CType
+    owner: Any              # the Frame, None for image data
+    parent: Slot = None     # a word range of parent, disp words in
+    disp: int = 0
+    temp: bool = False
+    offset: int = 0         # words below the frame pointer, for frame slots
+    label: str = None       # for image data
+
+    def root(self):
+        x = self; disp = 0;
+        while x.parent is not None:
+            disp += x.disp; x = x.parent;
+        return x, disp
+
+@dataclass
+class Imm:
+    val: int | float
+    type: CType
+
+@dataclass
+class Mem:
+    addr: Slot
+    type: CType
+
+@dataclass
+class Ref:
+    label: str
+    addend: int = 0
+    rel: bool = False
+
+@dataclass(eq=False)
+class Frame:
+    name: str
+    label: str
+    decl: Any
+    scope: Any
+    depth: int
+    params: List[Slot] = field(default_factory=list)
+    result: Slot = None
+    resptr: Slot = None
+    slots: List[Slot] = field(default_factory=list)
+    code: list = field(default_factory=list)
+    size: int = 0
+    unit: str = None        # the name of the PROGRAM or LIBRARY file
+
+def overlapp(a, b):
+    ra, da = a.root(); rb, db = b.root();
+    return ra is rb and da < db + b.type.size and db < da + a.type.size;
+
+def unwrap(x):
+    while isinstance(x, (Expr, LValue, Statement)):
+        x = getattr(x, 'statement', None) or x.expr;
+    return x
+
+def name_of(x):
+    return x.id if isinstance(x, ID) else '.'.join(x.ids);
+
+INT_FOLDS = {
+    'UADD': lambda a, b: a + b, 'USUB': lambda a, b: a - b,
+    'UMUL': lambda a, b: a * b, 'IMUL': lambda a, b: a * b,
+    'UDIV': lambda a, b: a // b, 'IDIV': lambda a, b: abs(a) // abs(b) * (1 if (a < 0) == (b < 0) else -1),
+};
+REAL_FOLDS = {
+    'FADD': lambda a, b: a + b, 'FSUB': lambda a, b: a - b,
+    'FMUL': lambda a, b: a * b, 'FDIV': lambda a, b: a / b
+};
+ARITH = {SumExpr: 'ADD', DiffExpr: 'SUB', ProductExpr: 'MUL', QuotientExpr: 'DIV'};
+COMPARE = {
+    EqualExpr: 'EQ', NotEqualExpr: 'NE', LessExpr: 'LT',
+    LessEqualExpr: 'LE', GreatExpr: 'GT', GreatEqualExpr: 'GE'
+};
+NEGATE = {'EQ': 'NE', 'NE': 'EQ', 'LT': 'GE', 'GE': 'LT', 'GT': 'LE', 'LE': 'GT'};
+SWAP = {'EQ': 'EQ', 'NE': 'NE', 'LT': 'GT', 'GE': 'LE', 'GT': 'LT', 'LE': 'GE'};
+INF = float('inf');
+
+# instructions defining their first operand
+DEFS = ('mov', 'sym', 'addr', 'load', 'bin', 'divc', 'cmp', 'conv', 'call', 'icall', 'ccall');
+
+def arith_op(op, t):
+    if t.realp():
+        return 'F' + op;
+    if op in ('MUL', 'DIV') and t.kind == 'int':
+        return 'I' + op;
+    return 'U' + op;
+
+def common_type(a, b):
+    if a.realp() or b.realp():
+        return REAL;
+    if a.kind == 'ptr' or b.kind == 'ptr':
+        return a if a.kind == 'ptr' else b;
+    if a.kind == 'int' and b.kind == 'int':
+        return INT;
+    return UINT;
+
+# n / d for unsigned n < 2**64 is mulhi(n, m) >> s, or with add, the 65 bit
+# multiplier 2**64 + m, (t + ((n - t) >> 1)) >> (s - 1) for t = mulhi(n, m)
+def umagic(d):
+    l = (d - 1).bit_length();
+    for s in range(l + 1):
+        m = -(-(1 << 64 + s) // d);
+        if m < 1 << 64 and m * d - (1 << 64 + s) <= 1 << s:
+            return m, s, False;
+    return -(-(1 << 64 + l) // d) - (1 << 64), l, True
+
+# n / d truncated for signed n, t = mulhs(n, m), plus n if d > 0 > m, minus n
+# if d < 0 < m, then q = t >> s arithmetic, plus 1 if q < 0, see Hacker's
+# Delight 10-1
+def smagic(d):
+    ad = abs(d); t = (1 << 63) + (d < 0);
+    anc = t - 1 - t % ad; p = 63;
+    q1, r1 = divmod(1 << 63, anc); q2, r2 = divmod(1 << 63, ad);
+    while True:
+        p += 1;
+        q1, r1 = 2 * q1, 2 * r1;
+        if r1 >= anc:
+            q1 += 1; r1 -= anc;
+        q2, r2 = 2 * q2, 2 * r2;
+        if r2 >= ad:
+            q2 += 1; r2 -= ad;
+        delta = ad - r2;
+        if not (q1 < delta or q1 == delta and r1 == 0):
+            break;
+    m = (q2 + 1) & (1 << 64) - 1;
+    m = m - (1 << 64) if m >> 63 else m;
+    return -m if d < 0 else m, p - 64
+
+# the names whose address @ takes in the nodes
+def taken(nodes):
+    return {name_of(r).split('.')[-1] for node in nodes for x in descendants(node)
+            if isinstance(x, RefExpr) and (r := root_of(x.expr)) is not None}
+
+# lowers a program and the libraries it uses to three address code, a
+# frame per function and the program body, variables of units are image data
+class Gen:
+    def __init__(self, program, units, checked=False):
+        self.res = Resolver(units);
+        self.checked = checked; self.ranges = {}; self.writes = {};
+        self.trap = None; self.bounds = [];
+        self.frames = {}; self.slots = {}; self.types = {}; self.consts = {};
+        self.data = []; self.strings = {}; self.literals = 0; self.nlabels = 0;
+        self.f = None; self.scope = None; self.loops = []; self.jumps = {};
+        scopes = [];
+        for unit in [u for u in units.values() if u is not None] + [program]:
+            units_in(unit, self.res.scope(unit), self.res, scopes);
+        for unit, scope in scopes:
+            for decl in unit.decls:
+                if isinstance(decl, VarDecl):
+                    for x in decl.names:
+                        self.global_slot((id(decl), x.id), x.id, decl.type, scope);
+            for decl, inner in functions(unit, scope, self.res, []):
+                if id(decl) not in self.frames:
+                    self.frame(decl, inner);
+        self.main = Frame(program.name.id, self.new_label(), program,
+                          self.res.scope(program), 0, unit=program.name.id);
+        for unit in [u for u in units.values() if u is not None] + [program]:
+            for decl, _ in functions(unit, self.res.scope(unit), self.res, []):
+                self.frames[id(decl)].unit = self.frames[id(decl)].unit or unit.name.id;
+        self.units = scopes;
+        self.taken = taken(unit for unit, _ in scopes);
+        self.unescaped = set();
+
+    def new_label(self):
+        self.nlabels += 1;
+        return f"L{self.nlabels}";
+
+    def global_slot(self, key, name, type, scope):
+        label = self.new_label();
+        slot = Slot(name, self.ctype(type, scope), None, label=label);
+        self.data.append((label, [0] * slot.type.size));
+        self.slots[key] = slot;
+
+    def frame(self, decl, scope):
+        depth = 0; s = scope.outer;
+        while s is not None:
+            depth += isinstance(s.owner, (FuncDecl, ProcDecl));
+            s = s.outer;
+        f = Frame(decl.name.id, self.new_label(), decl, scope, depth);
+        self.frames[id(decl)] = f;
+        for name in arg_names(decl):
+            b = scope.names[name];
+            f.params.append(self.local(f, b.key(), name, self.ctype(type_of(b), scope)));
+        if isinstance(decl, FuncDecl):
+            b = scope.names[decl.resvar.id];
+            f.result = self.local(f, b.key(), b.name, self.ctype(decl.resvartype, scope));
+            if not f.result.type.scalarp():
+                f.resptr = self.local(f, None, '.result', pointer(f.result.type));
+        for d in decl.decls:
+            if isinstance(d, VarDecl):
+                for x in d.names:
+                    self.local(f, (id(d), x.id), x.id, self.ctype(d.type, scope));
+
+    def local(self, f, key, name, type, temp=False):
+        slot = Slot(name, type, f, temp=temp);
+        f.slots.append(slot);
+        if key is not None:
+            self.slots[key] = slot;
+        return slot
+
+    def ctype(self, type, scope):
+        if id(type) in self.types:
+            return self.types[id(type)];
+        t = type.type;
+        if isinstance(t, Array):
+            elem = self.ctype(t.type, scope); dims = [d.val for d in t.dims];
+            c = CType('array', reduce(lambda n, d: n * d, dims, 1) * elem.size, elem, dims);
+        elif isinstance(t, Vector):
+            c = CType('vector', 2, lambda: self.ctype(t.type, scope));
+        elif isinstance(t, Pointer):
+            c = CType('ptr', 1, lambda: self.ctype(t.type, scope));
+        elif isinstance(t, Record):
+            fields = {}; off = 0;
+            for d in t.types:
+                ft = self.ctype(d.type, scope);
+                for x in d.names:
+                    fields[x.id] = (off, ft); off += ft.size;
+            c = CType('record', off, fields=fields);
+        else:
+            b = self.res.resolve(t, scope);
+            if b is not None and b.kind == 'type':
+                c = self.ctype(next(y for x, y in b.decl.types if x.id == b.name), b.scope);
+            elif isinstance(t, ID) and t.id in SCALARS:
+                c = SCALARS[t.id];
+            else:
+                die(f"Unknown type {name_of(t)} @ {t.line}");
+        self.types[id(type)] = c;
+        return c
+
+    def emit(self, *insn):
+        self.f.code.append(insn);
+
+    def temp(self, type):
+        return self.local(self.f, None, f"t{len(self.f.slots)}", type, True);
+
+    # a label per distinct string, the pool is laid out by pool()
+    def string(self, s):
+        self.literals += len(s) + 1;
+        if s not in self.strings:
+            self.strings[s] = self.new_label();
+        return self.strings[s]
+
+    # generation
+
+    def generate(self):
+        for f in list(self.frames.values()):
+            self.function(f, f.decl.body);
+        self.function(self.main, self.main.decl.body);
+        return self
+
+    def function(self, f, body):
+        self.f = f; self.scope = f.scope; self.loops = [];
+        self.jumps = {x: self.new_label() for x in labels_of(body)};
+        self.ranges = {}; self.trap = None; self.checks = [0, 0];
+        exit = self.new_label();
+        self.emit('enter', f);
+        self.sttmt(body);
+        self.emit('label', exit);
+        self.emit('leave', f);
+        if self.checks[1] > 0:
+            self.bounds.append((f.name, *self.checks));
+        if self.trap is not None:
+            self.emit('label', self.trap);
+            msg = self.sym(self.string(f"{f.name}: index out of range\n"), pointer(UINT));
+            self.emit('ccall', self.temp(INT), C_CALLS['printf'], [(msg, pointer(UINT))]);
+            self.emit('stop', Imm(1, INT));
+
+    # constants
+
+    def constant(self, e, scope):
+        x = unwrap(e);
+        if isinstance(x, IntLit):
+            return Imm(x.val, INT);
+        if isinstance(x, RealLit):
+            return Imm(x.val, REAL);
+        if isinstance(x, StrLit):
+            return x.val;
+        if isinstance(x, (ID, IDInLib)):
+            b = self.res.resolve(x, scope);
+            if b is not None and b.kind == 'const':
+                return self.const(b);
+        if isinstance(x, OppoExpr):
+            v = self.constant(x.expr, scope);
+            if isinstance(v, Imm):
+                return Imm(-v.val, v.type);
+        if type(x) in ARITH:
+            a = self.constant(x.x, scope); b = self.constant(x.y, scope);
+            if isinstance(a, Imm) and isinstance(b, Imm):
+                t = common_type(a.type, b.type);
+                return self.fold(arith_op(ARITH[type(x)], t), self.convert(a, t), self.convert(b, t));
+        return None
+
+    def const(self, b):
+        if b.key() not in self.consts:
+            val = next(v for x, v in b.decl.binds if x.id == b.name);
+            self.consts[b.key()] = None;
+            c = self.constant(val, b.scope);
+            if c is None:
+                die(f"CONST {b.name} is not a constant @ {b.decl.line}");
+            self.consts[b.key()] = c;
+        c = self.consts[b.key()];
+        if c is None:
+            die(f"CONST {b.name} is defined by itself @ {b.decl.line}");
+        return c
+
+    def fold(self, op, a, b):
+        if op in REAL_FOLDS:
+            return Imm(REAL_FOLDS[op](float(a.val), float(b.val)), REAL);
+        if op in ('UDIV', 'IDIV') and b.val == 0:
+            return None;
+        return Imm(INT_FOLDS[op](a.val, b.val), a.type);
+
+    # expressions
+
+    def binding(self, x):
+        b = self.res.resolve(x, self.scope);
+        if b is None:
+            die(f"Unknown name {name_of(x)} @ {x.line}");
+        return b
+
+    def slot(self, b, x):
+        if b.kind not in ('var', 'arg', 'res') or b.key() not in self.slots:
+            die(f"{name_of(x)} is not a variable @ {x.line}");
+        return self.slots[b.key()];
+
+    def value(self, e):
+        x = unwrap(e);
+        if isinstance(x, (IntLit, RealLit)):
+            return self.constant(x, self.scope);
+        if isinstance(x, StrLit):
+            return self.sym(self.string(x.val), pointer(UINT));
+        if isinstance(x, (ID, IDInLib)):
+            b = self.binding(x);
+            if b.kind == 'const':
+                c = self.const(b);
+                return c if isinstance(c, Imm) else self.sym(self.string(c), pointer(UINT));
+            if b.kind == 'func':
+                return self.sym(self.callee(b, x).label, PROC);
+            return self.read(self.slot(b, x));
+        if isinstance(x, (ArrAccessExpr, RecordAccessExpr, DerefExpr)):
+            return self.read(self.place(x));
+        if isinstance(x, RefExpr):
+            y = unwrap(x.expr);
+            if isinstance(y, (ID, IDInLib)) and self.binding(y).kind == 'func':
+                return self.sym(self.callee(self.binding(y), y).label, PROC);
+            p = self.place(y);
+            return self.address(p);
+        if isinstance(x, CallExpr):
+            v = self.call(x);
+            if v is None:
+                die(f"A procedure has no value @ {x.line}");
+            return v;
+        if isinstance(x, OppoExpr):
+            v = self.scalar(self.value(x.expr), x);
+            return self.arith('SUB', Imm(0, v.type), v);
+        if isinstance(x, NotExpr):
+            v = self.truth(self.value(x.expr), x);
+            return self.compare('EQ', v, Imm(0, BOOL));
+        if type(x) in ARITH:
+            a = self.scalar(self.value(x.x), x); b = self.scalar(self.value(x.y), x);
+            return self.arith(ARITH[type(x)], a, b);
+        if type(x) in COMPARE:
+            a = self.scalar(self.value(x.x), x); b = self.scalar(self.value(x.y), x);
+            return self.compare(COMPARE[type(x)], a, b);
+        if isinstance(x, IntersecExpr):
+            a = self.truth(self.value(x.x), x); b = self.truth(self.value(x.y), x);
+            return self.arith('MUL', a, b);
+        if isinstance(x, UnionExpr):
+            a = self.truth(self.value(x.x), x); b = self.truth(self.value(x.y), x);
+            return self.compare('NE', self.arith('ADD', a, b), Imm(0, BOOL));
+        if isinstance(x, IfExpr):
+            return self.if_expr(x);
+        if isinstance(x, PowerExpr):
+            return self.power(self.scalar(self.value(x.x), x), x.y, x);
+        die(f"Bad expression @ {x.line}");
+
+    def scalar(self, v, x):
+        if not v.type.scalarp():
+            die(f"A scalar is needed @ {x.line}");
+        return v
+
+    def truth(self, v, x):
+        v = self.scalar(v, x);
+        if v.type is BOOL:
+            return v;
+        return self.compare('NE', v, Imm(0.0 if v.type.realp() else 0, v.type));
+
+    def sym(self, label, type):
+        t = self.temp(type);
+        self.emit('sym', t, Ref(label));
+        return t
+
+    def convert(self, v, t):
+        if not t.scalarp() or v.type.realp() == t.realp():
+            return v;
+        if isinstance(v, Imm):
+            return Imm(float(v.val) if t.realp() else int(v.val), t);
+        d = self.temp(t);
+        if t.realp():
+            self.emit('conv', d, 'I2F' if v.type.kind == 'int' else 'U2F', v);
+        else:
+            self.emit('conv', d, 'F2I' if t.kind == 'int' else 'F2U', v);
+        return d
+
+    def arith(self, op, a, b):
+        t = common_type(a.type, b.type);
+        a = self.convert(a, t); b = self.convert(b, t);
+        op = arith_op(op, t);
+        if isinstance(a, Imm) and isinstance(b, Imm) and (v := self.fold(op, a, b)):
+            return v;
+        d = self.temp(t);
+        if op in ('UDIV', 'IDIV') and isinstance(b, Imm) and b.val:
+            c = int(b.val) & (1 << 64) - 1;
+            c = c - (1 << 64) if op == 'IDIV' and c >> 63 else c;
+            if c == 1:
+                return a;
+            self.emit('divc', d, a, c);
+            return d;
+        self.emit('bin', d, op, a, b);
+        return d
+
+    # square and multiply, unrolled for a constant exponent, a loop over the
+    # exponent bits otherwise, a negative exponent divides 1 by the result
+    def power(self, a, e, x):
+        t = a.type if a.type.kind != 'bool' else INT;
+        one = Imm(1.0 if t.realp() else 1, t);
+        n = self.constant(e, self.scope);
+        if isinstance(n, Imm) and float(n.val).is_integer():
+            k = abs(int(n.val)); r = None;
+            while k:
+                if k & 1:
+                    r = a if r is None else self.arith('MUL', r, a);
+                k >>= 1;
+                if k:
+                    a = self.arith('MUL', a, a);
+            r = one if r is None else self.convert(r, t);
+            return self.arith('DIV', one, r) if n.val < 0 else r;
+        v = self.scalar(self.value(e), unwrap(e));
+        if v.type.realp():
+            die(f"^ with a REAL exponent needs a math library the VM doesn't have @ {x.line}");
+        r = self.temp(t); b = self.temp(t); k = self.temp(UINT); h = self.temp(UINT);
+        odd = self.temp(UINT);
+        top = self.new_label(); even = self.new_label(); end = self.new_label();
+        pos = self.new_label(); done = self.new_label(); mul = arith_op('MUL', t);
+        self.emit('mov', r, one);
+        self.emit('mov', b, self.convert(a, t));
+        self.emit('mov', k, v);
+        if v.type.kind == 'int':
+            self.emit('bcmp', False, 'LT', 'I', v, Imm(0, INT), pos);
+            self.emit('bin', k, 'USUB', Imm(0, UINT), v);
+            self.emit('label', pos);
+        self.emit('bcmp', True, 'EQ', 'U', k, Imm(0, UINT), end);
+        self.emit('label', top);
+        self.emit('divc', h, k, 2);
+        self.emit('bin', odd, 'UADD', h, h);
+        self.emit('bin', odd, 'USUB', k, odd);
+        self.emit('bcmp', True, 'EQ', 'U', odd, Imm(0, UINT), even);
+        self.emit('bin', r, mul, r, b);
+        self.emit('label', even);
+        self.emit('mov', k, h);
+        self.emit('bin', b, mul, b, b);
+        self.emit('bcmp', False, 'EQ', 'U', k, Imm(0, UINT), top);
+        self.emit('label', end);
+        if v.type.kind == 'int':
+            self.emit('bcmp', False, 'LT', 'I', v, Imm(0, INT), done);
+            self.emit('bin', r, arith_op('DIV', t), one, r);
+            self.emit('label', done);
+        return r
+
+    def compare(self, op, a, b):
+        d = self.temp(BOOL);
+        self.emit('cmp', d, op, *self.operands(a, b));
+        return d
+
+    def operands(self, a, b):
+        t = common_type(a.type, b.type);
+        kind = 'F' if t.realp() else 'I' if t.kind == 'int' else 'U';
+        return kind, self.convert(a, t), self.convert(b, t)
+
+    def if_expr(self, x):
+        if (c := self.cases(x)) is not None:
+            d = None;
+            def arm(e):
+                nonlocal d;
+                a = self.scalar(self.value(e), unwrap(e));
+                if d is None:
+                    d = self.temp(a.type);
+                self.emit('mov', d, self.convert(a, d.type));
+            self.switch(*c, arm);
+            return d;
+        els = self.new_label(); end = self.new_label();
+        self.branch(x.cond, False, els);
+        a = self.scalar(self.value(x.then), x);
+        d = self.temp(a.type);
+        self.emit('mov', d, a);
+        self.emit('jmp', end);
+        self.emit('label', els);
+        b = self.convert(self.scalar(self.value(x.els), x), d.type);
+        self.emit('mov', d, b);
+        self.emit('label', end);
+        return d
+
+    def read(self, p):
+        if not p.type.scalarp() or isinstance(p, Slot):
+            return p;
+        d = self.temp(p.type);
+        self.emit('load', d, p.addr);
+        return d
+
+    def address(self, p):
+        if isinstance(p, Mem):
+            return p.addr;
+        d = self.temp(pointer(p.type));
+        self.emit('addr', d, p);
+        return d
+
+    # the place an lvalue names, a Slot or memory at an address
+    def place(self, e):
+        x = unwrap(e);
+        if isinstance(x, (ID, IDInLib)):
+            return self.slot(self.binding(x), x);
+        if isinstance(x, DerefExpr):
+            p = self.value(x.expr);
+            if p.type.kind != 'ptr':
+                die(f"! needs a POINTER @ {x.line}");
+            return Mem(self.local_value(p), p.type.target());
+        if isinstance(x, RecordAccessExpr):
+            p = self.aggregate(x.rcd, x);
+            if p.type.kind != 'record' or x.id.id not in p.type.fields:
+                die(f"No field {x.id.id} @ {x.line}");
+            return self.offset(p, *p.type.fields[x.id.id]);
+        if isinstance(x, ArrAccessExpr):
+            return self.element(self.aggregate(x.base, x), x);
+        die(f"Not an lvalue @ {x.line}");
+
+    # the place of a RECORD or ARRAY, through a POINTER if needed
+    def aggregate(self, e, x):
+        v = self.value(e);
+        if v.type.kind == 'ptr' and v.type.target().kind in ('record', 'array'):
+            return Mem(self.local_value(v), v.type.target());
+        if v.type.kind == 'ptr':
+            return Mem(self.local_value(v), v.type);
+        if v.type.scalarp():
+            die(f"Not a RECORD or an ARRAY @ {x.line}");
+        return v
+
+    def local_value(self, v):
+        if isinstance(v, Slot) and v.temp:
+            return v;
+        d = self.temp(v.type);
+        self.emit('mov', d, v);
+        return d
+
+    def offset(self, p, disp, t):
+        if isinstance(p, Slot):
+            return Slot(f"{p.name}+{disp}", t, p.owner, p, disp);
+        if disp == 0:
+            return Mem(p.addr, t);
+        return Mem(self.arith('ADD', p.addr, Imm(disp, UINT)), t)
+
+    def element(self, p, x):
+        if p.type.kind == 'ptr':
+            if len(x.idx) != 1:
+                die(f"A POINTER takes one index @ {x.line}");
+            t = p.type.target();
+            i = self.scalar(self.value(x.idx[0]), x);
+            return Mem(self.arith('ADD', p.addr, self.arith('MUL', i, Imm(t.size, UINT))), t);
+        if p.type.kind != 'array':
+            die(f"Not an ARRAY @ {x.line}");
+        dims = p.type.dims; t = p.type.elem;
+        if len(x.idx) > len(dims):
+            die(f"Too many indexes @ {x.line}");
+        stride = t.size * reduce(lambda n, d: n * d, dims[len(x.idx):], 1);
+        if len(x.idx) < len(dims):
+            t = CType('array', stride, t, dims[len(x.idx):]);
+        i = Imm(0, INT);
+        for n, e in enumerate(x.idx):
+            v = self.convert(self.scalar(self.value(e), x), INT);
+            if self.checked:
+                self.check(e, v, dims[n]);
+            i = self.arith('ADD', self.arith('MUL', i, Imm(dims[n], INT)), v);
+        i = self.arith('MUL', i, Imm(stride, INT));
+        if isinstance(i, Imm):
+            return self.offset(p, i.val, t);
+        return Mem(self.arith('ADD', self.address(p), i), t)
+
+    # bounds checks, an index is checked unless the ranges of the variables
+    # that stay put in the statement being lowered, from FOR clauses, IF
+    # guards and WHILE conditions, prove it in range
+
+    def check(self, e, v, n):
+        lo, hi = (v.val, v.val) if isinstance(v, Imm) else self.interval(e);
+        self.checks[1] += 1;
+        if 0 <= lo and hi < n:
+            self.checks[0] += 1;
+            return;
+        if self.trap is None:
+            self.trap = self.new_label();
+        self.emit('bcmp', True, 'GE', 'U', v, Imm(n, INT), self.trap);
+
+    # an INTEGER or UNSIGNED variable whose address is never taken
+    def tracked(self, e):
+        x = unwrap(e);
+        if not isinstance(x, (ID, IDInLib)):
+            return None;
+        b = self.res.resolve(x, self.scope);
+        if b is None or b.kind not in ('var', 'arg', 'res') or b.name in self.taken:
+            return None;
+        s = self.slots.get(b.key());
+        return b if s is not None and s.type.kind in ('int', 'uint') else None
+
+    # the variables a region assigns, and whether it calls a function of the
+    # program, which may assign any global
+    def assigned(self, region):
+        if id(region) not in self.writes:
+            keys = set(); calls = False;
+            for x in descendants(region):
+                for lv in written(x):
+                    if (r := root_of(lv)) is not None and (b := self.res.resolve(r, self.scope)):
+                        keys.add(b.key());
+                if isinstance(x, CallExpr):
+                    fx = unwrap(x.func);
+                    calls = calls or not isinstance(fx, ID) or fx.id not in C_CALLS and fx.id != 'sizeof' or \
+                        self.res.resolve(fx, self.scope) is not None;
+            self.writes[id(region)] = (region, keys, calls, bool(labels_of(region)));
+        return self.writes[id(region)][1:]
+
+    def stable(self, b, region):
+        keys, calls, labels = self.assigned(region);
+        local = self.slots[b.key()].owner is self.f and \
+            not any(isinstance(d, (FuncDecl, ProcDecl)) for d in self.f.decl.decls);
+        return not labels and b.key() not in keys and (local or not calls)
+
+    def range_of(self, b):
+        s = self.slots[b.key()];
+        return self.ranges.get(b.key(), (0 if s.type.kind == 'uint' else -INF, INF))
+
+    def static_type(self, e):
+        x = unwrap(e);
+        v = self.constant(x, self.scope);
+        if isinstance(v, Imm):
+            return v.type;
+        if (b := self.tracked(x)) is not None:
+            return self.slots[b.key()].type;
+        if isinstance(x, (SumExpr, DiffExpr, ProductExpr)):
+            a = self.static_type(x.x); c = self.static_type(x.y);
+            return a and c and common_type(a, c);
+        return None
+
+    # the values an integer expression may take, (-INF, INF) if unknown
+    def interval(self, e):
+        x = unwrap(e);
+        v = self.constant(x, self.scope);
+        if isinstance(v, Imm):
+            return (v.val, v.val) if not v.type.realp() else (-INF, INF);
+        if (b := self.tracked(x)) is not None:
+            return self.range_of(b);
+        if isinstance(x, (SumExpr, DiffExpr)):
+            a = self.interval(x.x); c = self.interval(x.y);
+            if isinstance(x, SumExpr):
+                return (a[0] + c[0], a[1] + c[1]);
+            return (a[0] - c[1], a[1] - c[0]);
+        if isinstance(x, ProductExpr):
+            for y, k in ((x.x, x.y), (x.y, x.x)):
+                k = self.constant(k, self.scope);
+                if isinstance(k, Imm) and not k.type.realp():
+                    a = self.interval(y);
+                    if k.val == 0:
+                        return (0, 0);
+                    return tuple(sorted((a[0] * k.val, a[1] * k.val)));
+        return (-INF, INF)
+
+    # x + k or x - k for a constant k, as (x, k)
+    def offset_of(self, e):
+        x = unwrap(e);
+        if isinstance(x, (SumExpr, DiffExpr)):
+            k = self.constant(x.y, self.scope);
+            if isinstance(k, Imm) and not k.type.realp():
+                return x.x, k.val if isinstance(x, SumExpr) else -k.val;
+        return x, 0
+
+    # makes the ranges of a region from the current ones and a condition that
+    # holds all through it, returns the current ones to put back after it
+    def narrow(self, e, sense, region):
+        old = self.ranges;
+        if self.checked:
+            self.ranges = dict(old);
+            self.refine(e, sense, region);
+        return old
+
+    def refine(self, e, sense, region):
+        x = unwrap(e);
+        if isinstance(x, NotExpr):
+            return self.refine(x.expr, not sense, region);
+        if isinstance(x, IntersecExpr) and sense or isinstance(x, UnionExpr) and not sense:
+            self.refine(x.x, sense, region);
+            self.refine(x.y, sense, region);
+            return;
+        if type(x) not in COMPARE:
+            return;
+        op = COMPARE[type(x)] if sense else NEGATE[COMPARE[type(x)]];
+        for a, c, op in ((x.x, x.y, op), (x.y, x.x, SWAP[op])):
+            a, k = self.offset_of(a);
+            b = self.tracked(a); t = self.static_type(c);
+            if b is None or t is None or t.realp() or not self.stable(b, region):
+                continue;
+            s = self.slots[b.key()].type;
+            lo, hi = self.range_of(b); clo, chi = self.interval(c);
+            clo, chi = clo - k, chi - k;
+            if s.kind == 'int' and t.kind == 'int':
+                bounds = {'EQ': (clo, chi), 'LT': (-INF, chi - 1), 'LE': (-INF, chi),
+                          'GT': (clo + 1, INF), 'GE': (clo, INF)};
+            elif clo >= 0 and k == 0:
+                # unsigned, a lower bound holds only for an UNSIGNED variable
+                bounds = {'EQ': (clo, chi), 'LT': (0, chi - 1), 'LE': (0, chi)};
+                if s.kind == 'uint':
+                    bounds.update({'GT': (clo + 1, INF), 'GE': (clo, INF)});
+            else:
+                continue;
+            if op in bounds:
+                self.ranges[b.key()] = (max(lo, bounds[op][0]), min(hi, bounds[op][1]));
+
+    # the range of the variable of a FOR with a single TO clause, in its body
+    def induction(self, x):
+        old = self.ranges;
+        if not self.checked or len(x.clauses) != 1:
+            return old;
+        c = x.clauses[0];
+        if not isinstance(c, (ToForClause, StepToForClause)) or len(c.assign.names) != 1:
+            return old;
+        b = self.tracked(c.assign.names[0]);
+        step = self.constant(c.steps[0], self.scope) if isinstance(c, StepToForClause) else Imm(1, INT);
+        if b is None or not isinstance(step, Imm) or step.type.realp() or not self.stable(b, x.body):
+            return old;
+        start = self.interval(c.assign.vals[0]); limit = self.interval(c.tos[0]);
+        if self.slots[b.key()].type.kind == 'uint' and (start[0] < 0 or limit[0] < 0):
+            return old;
+        self.ranges = dict(old);
+        lo, hi = self.range_of(b);
+        if step.val > 0:
+            self.ranges[b.key()] = (max(lo, start[0]), min(hi, limit[1]));
+        elif step.val < 0:
+            self.ranges[b.key()] = (max(lo, limit[0]), min(hi, start[1]));
+        return old
+
+    # calls
+
+    def callee(self, b, x):
+        f = self.frames.get(id(b.decl));
+        if f is None:
+            die(f"{name_of(x)} is not a function @ {x.line}");
+        return f
+
+    # sizeof(T) of a type or variable name is its size in words, for heap.new
+    def size_of(self, x):
+        y = unwrap(x.args[0]) if len(x.args) == 1 else None;
+        b = self.res.resolve(y, self.scope) if isinstance(y, (ID, IDInLib)) else None;
+        if b is not None and b.kind == 'type':
+            t = self.ctype(next(t for n, t in b.decl.types if n.id == b.name), b.scope);
+        elif b is not None and b.kind in ('var', 'arg', 'res'):
+            t = self.slot(b, y).type;
+        else:
+            die(f"sizeof takes a type or variable name @ {x.line}");
+        return Imm(t.size, INT)
+
+    def call(self, x, used=True):
+        fx = unwrap(x.func);
+        b = self.res.resolve(fx, self.scope) if isinstance(fx, (ID, IDInLib)) else None;
+        if b is None and isinstance(fx, ID) and fx.id == 'sizeof':
+            return self.size_of(x);
+        if b is None and isinstance(fx, ID) and fx.id in C_CALLS:
+            fmt = self.constant(x.args[0], self.scope) if fx.id == 'printf' and x.args else None;
+            if isinstance(fmt, str):
+                args = [self.argument(a, None, x) for a in x.args[1:]];
+                parts = self.format(fmt, args, x);
+                if not used:
+                    return self.printf(parts, args);
+                args = [(self.sym(self.string(fmt), pointer(UINT)), pointer(UINT))] + args;
+            else:
+                args = [self.argument(a, None, x) for a in x.args];
+            if sum(not t.realp() for _, t in args) > C_INT_ARGS or \
+               sum(t.realp() for _, t in args) > len(REAL_ARGS):
+                die(f"Too many arguments to {fx.id} @ {x.line}");
+            d = self.temp(INT);
+            self.emit('ccall', d, C_CALLS[fx.id], args);
+            return d;
+        if b is not None and b.kind == 'func':
+            g = self.callee(b, fx);
+            if len(x.args) != len(g.params):
+                die(f"{g.name} takes {len(g.params)} arguments, {len(x.args)} given @ {x.line}");
+            args = [self.argument(a, p.type, x) for a, p in zip(x.args, g.params)];
+            d = res = None;
+            if g.result is not None:
+                d = self.temp(g.result.type);
+                if not d.type.scalarp():
+                    res = self.address(d);
+            self.emit('call', d, g, args, res);
+            return d;
+        target = self.arith('SUB', self.scalar(self.value(x.func), x), Imm(3, UINT));
+        args = [self.argument(a, None, x) for a in x.args];
+        d = self.temp(INT);
+        self.emit('icall', d, target, args);
+        return d
+
+    # the literal runs and conversions of a printf format, as printf.c reads
+    # it, checked against the arguments
+    def format(self, fmt, args, x):
+        parts = []; i = 0;
+        while i < len(fmt):
+            c = fmt[i];
+            if c == '%':
+                i += 1;
+                if i == len(fmt):
+                    break;
+                c = fmt[i];
+                if c in 'sdcufx':
+                    parts.append(('%', c));
+                    i += 1;
+                    continue;
+            if parts and isinstance(parts[-1], str):
+                parts[-1] += c;
+            else:
+                parts.append(c);
+            i += 1;
+        convs = [p[1] for p in parts if isinstance(p, tuple)];
+        if len(convs) != len(args):
+            die(f"printf: {len(convs)} conversions in the format, {len(args)} arguments given @ {x.line}");
+        for c, (_, t) in zip(convs, args):
+            if t.realp() != (c == 'f') or not t.scalarp() and c != 's':
+                die(f"printf: %{c} can't print {'a REAL' if t.realp() else 'an aggregate' if not t.scalarp() else 'an integer'} @ {x.line}");
+        return parts
+
+    # a format without conversions is written by writetxt, a format with
+    # more arguments than registers is split into several printf calls
+    def printf(self, parts, args):
+        chunks = [[]]; n = [0, 0];
+        for p in parts:
+            if isinstance(p, tuple):
+                k = p[1] == 'f';
+                if n[k] == (len(REAL_ARGS) if k else C_INT_ARGS - 1):
+                    chunks.append([]); n = [0, 0];
+                n[k] += 1;
+            chunks[-1].append(p);
+        args = iter(args);
+        for chunk in chunks:
+            convs = [p for p in chunk if isinstance(p, tuple)];
+            if convs == []:
+                text = ''.join(chunk);
+                if text:
+                    self.emit('ccall', self.temp(INT), C_CALLS['writetxt'],
+                              [(Imm(1, INT), INT), (self.sym(self.string(text), pointer(UINT)), pointer(UINT)),
+                               (Imm(len(text), INT), INT)]);
+                continue;
+            fmt = ''.join(''.join(p) if isinstance(p, tuple) else p.replace('%', '%%') for p in chunk);
+            self.emit('ccall', self.temp(INT), C_CALLS['printf'],
+                      [(self.sym(self.string(fmt), pointer(UINT)), pointer(UINT))] + [next(args) for _ in convs]);
+
+    def argument(self, e, t, x):
+        v = self.value(e);
+        if v.type.scalarp():
+            if t is not None and not t.scalarp():
+                die(f"An aggregate argument is needed @ {x.line}");
+            return self.convert(v, t or v.type), t or v.type;
+        if t is not None and (t.scalarp() or t.size != v.type.size):
+            die(f"Argument type mismatch @ {x.line}");
+        return self.address(v), v.type
+
+    # statements
+
+    # jumps to label when e is sense, & and | skip their right operand once
+    # the left one decides, comparisons branch on r4 right away
+    def branch(self, e, sense, label):
+        x = unwrap(e);
+        if isinstance(x, NotExpr):
+            return self.branch(x.expr, not sense, label);
+        if isinstance(x, (IntersecExpr, UnionExpr)):
+            if isinstance(x, IntersecExpr) != sense:
+                self.branch(x.x, sense, label);
+                self.branch(x.y, sense, label);
+            else:
+                skip = self.new_label();
+                self.branch(x.x, not sense, skip);
+                self.branch(x.y, sense, label);
+                self.emit('label', skip);
+            return;
+        if type(x) in COMPARE:
+            a = self.scalar(self.value(x.x), x); b = self.scalar(self.value(x.y), x);
+            self.emit('bcmp', sense, COMPARE[type(x)], *self.operands(a, b), label);
+            return;
+        v = self.scalar(self.value(e), x);
+        if isinstance(v, Imm):
+            if bool(v.val) == sense:
+                self.emit('jmp', label);
+        elif v.type is BOOL:
+            self.emit('bt' if sense else 'bf', v, label);
+        else:
+            self.emit('bcmp', sense, 'NE', *self.operands(v, Imm(0.0 if v.type.realp() else 0, v.type)), label);
+
+    # an IF that leaves the block guards the statements after it
+    def sttmts(self, xs):
+        old = self.ranges;
+        for n, x in enumerate(xs):
+            self.sttmt(x);
+            y = unwrap(x);
+            if isinstance(y, IfSttmt) and \
+               isinstance(unwrap(y.Then), (GoToSttmt, BreakSttmt, ContinueSttmt)):
+                rest = BeginSttmt(y.line, xs[n + 1:]);
+                self.narrow(y.cond, False, rest);
+        self.ranges = old;
+
+    def sttmt(self, s):
+        self.emit('line', s.line);
+        x = unwrap(s);
+        if isinstance(x, AssignmentSttmt):
+            self.assign(x.expr.names, x.expr.vals);
+        elif isinstance(x, Assignment):
+            self.assign(x.names, x.vals);
+        elif isinstance(x, ExprSttmt):
+            self.effect(x.expr);
+        elif isinstance(x, BeginSttmt):
+            self.sttmts(x.sttmts);
+        elif isinstance(x, IfSttmt):
+            end = self.new_label();
+            self.branch(x.cond, False, end);
+            old = self.narrow(x.cond, True, x.Then);
+            self.sttmt(x.Then);
+            self.ranges = old;
+            self.emit('label', end);
+        elif isinstance(x, IfElseSttmt) and (c := self.cases(x)) is not None:
+            self.switch(*c, self.sttmt);
+        elif isinstance(x, IfElseSttmt):
+            els = self.new_label(); end = self.new_label();
+            self.branch(x.cond, False, els);
+            old = self.narrow(x.cond, True, x.Then);
+            self.sttmt(x.Then);
+            self.ranges = old;
+            self.emit('jmp', end);
+            self.emit('label', els);
+            old = self.narrow(x.cond, False, x.els);
+            self.sttmt(x.els);
+            self.ranges = old;
+            self.emit('label', end);
+        elif isinstance(x, (WhileSttmt, UntilSttmt)):
+            # rotated, a guard on entry and the test at the bottom
+            top = self.new_label(); cont = self.new_label(); end = self.new_label();
+            until = isinstance(x, UntilSttmt);
+            self.branch(x.cond, until, end);
+            self.emit('label', top);
+            old = self.narrow(x.cond, not until, x.body);
+            self.loop(x.body, cont, end);
+            self.ranges = old;
+            self.emit('label', cont);
+            self.emit('line', x.line);
+            self.branch(x.cond, not until, top);
+            self.emit('label', end);
+        elif isinstance(x, (BeginWhileSttmt, BeginUntilSttmt)):
+            top = self.new_label(); cont = self.new_label(); end = self.new_label();
+            self.emit('label', top);
+            self.loop(BeginSttmt(x.line, x.sttmts), cont, end);
+            self.emit('label', cont);
+            self.emit('line', x.line);
+            self.branch(x.cond, isinstance(x, BeginWhileSttmt), top);
+            self.emit('label', end);
+        elif isinstance(x, ForSttmt):
+            self.for_sttmt(x);
+        elif isinstance(x, LabelSttmt):
+            self.emit('label', self.jumps[x.label]);
+            self.sttmt(x.sttmt);
+        elif isinstance(x, GoToSttmt):
+            target = self.res.label(x.id, self.scope);
+            if target is None:
+                die(f"Unknown label {name_of(x.id)} @ {x.line}");
+            if target is not self.scope:
+                die(f"GOTO out of {self.f.name} is not supported @ {x.line}");
+            self.emit('jmp', self.jumps[x.id.id]);
+        elif isinstance(x, (BreakSttmt, ContinueSttmt)):
+            if self.loops == []:
+                die(f"BREAK or CONTINUE out of a loop @ {x.line}");
+            cont, end = self.loops[-1];
+            self.emit('jmp', end if isinstance(x, BreakSttmt) else cont);
+        elif not isinstance(x, VoidSttmt):
+            die(f"Bad statement @ {x.line}");
+
+    # IF chains
+
+    def case(self, e):
+        c = unwrap(e);
+        if not isinstance(c, EqualExpr):
+            return None;
+        for a, k in ((c.x, c.y), (c.y, c.x)):
+            a = unwrap(a); k = self.constant(k, self.scope);
+            if not isinstance(a, (ID, IDInLib)) or not isinstance(k, Imm) or k.type.realp():
+                continue;
+            b = self.res.resolve(a, self.scope);
+            if b is None or b.kind not in ('var', 'arg', 'res') or b.key() not in self.slots:
+                continue;
+            v = self.slots[b.key()];
+            if v.type.kind == 'int':
+                return v, (int(k.val) + (1 << 63) & (1 << 64) - 1) - (1 << 63);
+            if v.type.kind == 'uint':
+                return v, int(k.val) & (1 << 64) - 1;
+        return None
+
+    # the arms of an IF chain comparing one variable with constants, the
+    # first arm of a value wins, the rest of the chain is the default
+    def cases(self, x):
+        v = None; arms = []; seen = set();
+        while isinstance(x, (IfSttmt, IfElseSttmt, IfExpr)):
+            c = self.case(x.cond);
+            if c is None or v is not None and c[0] is not v:
+                break;
+            v = c[0];
+            if c[1] not in seen:
+                seen.add(c[1]);
+                arms.append((c[1], x.then if isinstance(x, IfExpr) else x.Then));
+            x = None if isinstance(x, IfSttmt) else unwrap(x.els);
+        if len(arms) < SWITCH_CASES:
+            return None;
+        return v, arms, x
+
+    def switch(self, v, arms, default, arm):
+        labels = [self.new_label() for _ in arms];
+        els = self.new_label(); end = self.new_label();
+        vals = sorted((val, label) for (val, _), label in zip(arms, labels));
+        lo = vals[0][0]; n = vals[-1][0] - lo + 1;
+        if n <= SWITCH_DENSITY * len(vals):
+            table = self.new_label(); targets = dict(vals);
+            self.data.append((table, [Ref(targets.get(lo + i, els), -3) for i in range(n)]));
+            i = self.arith('SUB', v, Imm(lo, v.type)) if lo else v;
+            self.emit('jtab', i, table, n, els);
+        else:
+            self.decide(v, vals, els);
+        for (_, body), label in zip(arms, labels):
+            self.emit('label', label);
+            arm(body);
+            self.emit('jmp', end);
+        self.emit('label', els);
+        if default is not None:
+            arm(default);
+        self.emit('label', end);
+
+    # binary search on the sorted values
+    def decide(self, v, vals, els):
+        if len(vals) <= SWITCH_LINEAR:
+            for val, label in vals:
+                self.emit('bcmp', True, 'EQ', *self.operands(v, Imm(val, v.type)), label);
+            self.emit('jmp', els);
+            return;
+        mid = len(vals) // 2; low = self.new_label();
+        self.emit('bcmp', True, 'LT', *self.operands(v, Imm(vals[mid][0], v.type)), low);
+        self.decide(v, vals[mid:], els);
+        self.emit('label', low);
+        self.decide(v, vals[:mid], els);
+
+    def effect(self, e):
+        x = unwrap(e);
+        if isinstance(x, CallExpr):
+            self.call(x, False);
+        else:
+            self.value(x);
+
+    def loop(self, body, cont, end):
+        self.loops.append((cont, end));
+        self.sttmt(body);
+        self.loops.pop();
+
+    def assign(self, names, vals):
+        if len(names) == 1:
+            p = self.place(names[0]); v = self.value(vals[0]);
+            if not p.type.scalarp():
+                if v.type.scalarp() or v.type.size != p.type.size:
+                    die(f"Assignment type mismatch @ {names[0].line}");
+                self.emit('copy', self.address(p), self.address(v), p.type.size);
+            else:
+                self.store(p, self.convert(self.scalar(v, names[0]), p.type));
+            return;
+        places = [self.place(n) for n in names];
+        moves = []; copies = [];
+        for p, e in zip(places, vals):
+            v = self.value(e);
+            if not p.type.scalarp():
+                if v.type.scalarp() or v.type.size != p.type.size:
+                    die(f"Assignment type mismatch @ {e.line}");
+                t = self.temp(p.type);
+                self.emit('copy', self.address(t), self.address(v), p.type.size);
+                copies.append((p, t));
+            else:
+                moves.append((p, self.convert(self.scalar(v, e), p.type)));
+        # a store through a pointer may hit any variable, only temporaries
+        # are safe to read after it
+        if any(isinstance(p, Mem) for p, _ in moves):
+            moves = [(p, self.local_value(v) if isinstance(v, Slot) else v) for p, v in moves];
+        self.emit('pmove', moves);
+        for p, t in copies:
+            self.emit('copy', self.address(p), self.address(t), p.type.size);
+
+    # a value just computed into a temporary is computed into p instead
+    def store(self, p, v):
+        code = self.f.code;
+        if isinstance(p, Mem):
+            self.emit('store', p.addr, v);
+        elif isinstance(v, Slot) and v.temp and code and code[-1][0] in DEFS and code[-1][1] is v:
+            code[-1] = (code[-1][0], p) + code[-1][2:];
+        else:
+            self.emit('mov', p, v);
+
+    # FOR clauses run in order before the first iteration and after each
+    # one, a clause with THEN, STEP or TO assigns its first values only once
+    def for_sttmt(self, x):
+        top = self.new_label(); cont = self.new_label(); end = self.new_label();
+        self.clauses(x.clauses, end);
+        self.emit('label', top);
+        old = self.induction(x);
+        self.loop(x.body, cont, end);
+        self.ranges = old;
+        self.emit('label', cont);
+        self.emit('line', x.line);
+        self.clauses(x.clauses, end, top);
+        self.emit('label', end);
+
+    # the first pass without top, the others jump back to top on their last
+    # exit test when it ends the clauses
+    def clauses(self, clauses, end, top=None):
+        last = None;
+        def test(cond, sense):
+            nonlocal last;
+            if last is not None:
+                self.branch(*last, end);
+            last = (cond, sense) if cond is not None else None;
+        for c in clauses:
+            if isinstance(c, AssignForClause):
+                test(None, None);
+                self.assign(c.assign.names, c.assign.vals);
+            elif isinstance(c, ThenForClause):
+                test(None, None);
+                self.assign(c.assign.names, c.thens if top else c.assign.vals);
+            elif isinstance(c, (StepForClause, StepToForClause, ToForClause)):
+                test(None, None);
+                names = c.assign.names;
+                steps = getattr(c, 'steps', None) or [Expr(c.line, IntLit(c.line, 1))] * len(names);
+                if top is None:
+                    self.assign(names, c.assign.vals);
+                else:
+                    self.assign(names, [Expr(c.line, SumExpr(c.line, n.expr, s))
+                                        for n, s in zip(names, steps)]);
+                for n, to, s in zip(names, getattr(c, 'tos', []), steps):
+                    down = (v := self.constant(s, self.scope)) is not None and \
+                        isinstance(v, Imm) and v.val < 0;
+                    test((GreatEqualExpr if down else LessEqualExpr)(c.line, n.expr, to), False);
+            elif isinstance(c, WhileForClause):
+                test(c.cond, False);
+            elif isinstance(c, UntilForClause):
+                test(c.cond, True);
+            else:
+                die(f"ITERATE is not supported by the code generator @ {c.line}");
+        if top is None:
+            test(None, None);
+        elif last is not None:
+            self.branch(last[0], not last[1], top);
+        else:
+            self.emit('jmp', top);
+
+# orders the moves of a parallel assignment, (destination, source) pairs: a
+# move runs once no pending move reads its destination, and a cycle is broken
+# by holding a source in the scratch register, a hold is a (register, source)
+# step, and the held move reads the register
+def sequence(moves, conflictp, scratch):
+    pending = list(moves); out = [];
+    while pending:
+        for m in pending:
+            if not any(conflictp(m[0], n[1]) for n in pending if n is not m):
+                out.append(m); pending.remove(m);
+                break;
+        else:
+            i = next(i for i, (_, s) in enumerate(pending)
+                     if any(conflictp(n[0], s) for n in pending if n is not pending[i]));
+            d, s = pending[i]; r = scratch(s);
+            out.append((r, s)); pending[i] = (d, r);
+    return out
+
+# the argument places of a call, a register or a stack offset, and how the
+# argument is passed: by value, by pointer, or as two words on the stack
+def classify(types, resultp=False):
+    n = len(types); places = [None] * (n + resultp);
+    ints = [i for i, t in enumerate(types) if t.size == 1 and not t.realp()] + \
+        [i for i, t in enumerate(types) if t.size > 2] + ([n] if resultp else []);
+    for k, i in enumerate(ints):
+        mode = 'ptr' if i < n and types[i].size > 2 else 'value';
+        places[i] = (INT_ARGS[k] if k < len(INT_ARGS) else None, mode);
+    reals = [i for i, t in enumerate(types) if t.realp()];
+    for k, i in enumerate(reals):
+        places[i] = (REAL_ARGS[k] if k < len(REAL_ARGS) else None, 'value');
+    for i, t in enumerate(types):
+        if t.size == 2:
+            places[i] = (None, 'words');
+    words = 0;
+    for i, (where, mode) in enumerate(places):
+        if where is None:
+            places[i] = (words, mode);
+            words += 2 if mode == 'words' else 1;
+    return places, words
+
+def reg_of(t):
+    return 'x0' if t.realp() else 'r5';
+
+# instruction selection, every slot lives in memory, r5 and r3 (x0 and x1)
+# hold operands, r6 and r7 form addresses, and r4 is the condition; a frame
+# is the static chain at r2, the caller's r2 at r2+1, the return address at
+# r2+2 and the stack arguments from r2+3, r1 is the next free stack word
+# with fuse, the superinstructions of opcode.h are selected for the sequences
+# of base instructions they replace
+class Select:
+    def __init__(self, gen, fuse=True):
+        self.gen = gen; self.fuse = fuse; self.code = []; self.f = None;
+
+    def emit(self, *insn):
+        self.code.append(insn);
+
+    def run(self):
+        self.entry();
+        for f in list(self.gen.frames.values()) + [self.gen.main]:
+            self.function(f);
+        return self.code
+
+    # the code at IMAGE_BASE, it calls the program body and stops
+    def entry(self):
+        gen = self.gen;
+        self.emit('comment', 'entry');
+        self.emit('line', gen.main.unit, gen.main.decl.line, 'entry');
+        self.emit('UIMM', 'r1', Ref('stack'));
+        self.emit('UMOV', 'r2', 'r1');
+        self.call_seq([], None, gen.main, None);
+        self.emit('UIMM', 'r3', 0);
+        self.emit('STOP', 'r3');
+        return self.code
+
+    def function(self, f):
+        self.f = f;
+        kind = 'FUNCTION' if isinstance(f.decl, FuncDecl) else \
+            'PROCEDURE' if isinstance(f.decl, ProcDecl) else 'PROGRAM';
+        self.emit('comment', f"{kind} {f.name}");
+        self.emit('line', f.unit, f.decl.line, f.name);
+        for insn in f.code:
+            getattr(self, 'i_' + insn[0])(*insn[1:]);
+
+    # operands
+
+    # the register holding the frame of v and its offset there, or None and
+    # the address of a global, the static chain is followed in r
+    def base(self, v, r):
+        base, disp = v.root();
+        if base.owner is None:
+            return None, Ref(base.label, disp)
+        if base.owner is self.f:
+            return 'r2', disp - base.offset
+        self.emit('ULD', r, 'r2');
+        for _ in range(self.f.depth - base.owner.depth - 1):
+            self.emit('ULD', r, r);
+        return r, disp - base.offset
+
+    def addr(self, v, r):
+        b, k = self.base(v, r);
+        if b is None:
+            self.emit('UIMM', r, k);
+        elif b == r and not self.fuse:
+            self.emit('UIMM', 'r7', k);
+            self.emit('UADD', r, 'r7');
+        else:
+            self.lea(r, b, k);
+
+    # d := s + k, for d other than s
+    def lea(self, d, s, k):
+        if self.fuse:
+            self.emit('UADDI', d, s, k);
+            return;
+        self.emit('UIMM', d, k);
+        self.emit('UADD', d, s);
+
+    def load(self, r, v):
+        t = 'F' if r[0] == 'x' else 'U';
+        if isinstance(v, Imm):
+            if r[0] == 'x':
+                self.emit('FIMM', r, float(v.val));
+            else:
+                self.emit('UIMM', r, int(v.val));
+        elif self.fuse:
+            b, k = self.base(v, 'r6' if r[0] == 'x' else r);
+            if b is None:
+                self.emit(t + 'LDA', r, k);
+            else:
+                self.emit(t + 'LDO', r, b, k);
+        elif r[0] == 'x':
+            self.addr(v, 'r6');
+            self.emit('FLD', r, 'r6');
+        else:
+            self.addr(v, r);
+            self.emit('ULD', r, r);
+
+    def store(self, v, r):
+        t = 'F' if r[0] == 'x' else 'U';
+        if isinstance(v, Mem):
+            self.load('r6', v.addr);
+        elif self.fuse:
+            b, k = self.base(v, 'r6');
+            if b is None:
+                self.emit(t + 'STA', k, r);
+            else:
+                self.emit(t + 'STO', b, k, r);
+            return;
+        else:
+            self.addr(v, 'r6');
+        self.emit(t + 'ST', 'r6', r);
+
+    def push(self, r):
+        self.emit('FST' if r[0] == 'x' else 'UST', 'r1', r);
+        if self.fuse:
+            self.emit('UADDI', 'r1', 'r1', -1);
+            return;
+        self.emit('UIMM', 'r7', 1);
+        self.emit('USUB', 'r1', 'r7');
+
+    def copy(self, dst, src, n):
+        if self.fuse and n <= UNROLL_COPY:
+            for i in range(n):
+                self.emit('ULDO', 'r6', src, i);
+                self.emit('USTO', dst, i, 'r6');
+            return;
+        if n <= UNROLL_COPY:
+            for i in range(n):
+                self.emit('ULD', 'r6', src);
+                self.emit('UST', dst, 'r6');
+                if i < n - 1:
+                    self.emit('UIMM', 'r7', 1);
+                    self.emit('UADD', src, 'r7');
+                    self.emit('UADD', dst, 'r7');
+            return;
+        # the count lives in x7, no integer register is left
+        loop = self.gen.new_label();
+        self.emit('FIMM', 'x7', float(n));
+        self.emit('label', loop);
+        self.emit('ULD', 'r6', src);
+        self.emit('UST', dst, 'r6');
+        if self.fuse:
+            self.emit('UADDI', src, src, 1);
+            self.emit('UADDI', dst, dst, 1);
+        else:
+            self.emit('UIMM', 'r7', 1);
+            self.emit('UADD', src, 'r7');
+            self.emit('UADD', dst, 'r7');
+        self.emit('FIMM', 'x6', 1.0);
+        self.emit('FSUB', 'x7', 'x6');
+        self.emit('FIMM', 'x6', 0.0);
+        if self.fuse:
+            self.emit('FGTBT', 'x7', 'x6', Ref(loop, rel=True));
+            return;
+        self.emit('FGT', 'x7', 'x6');
+        self.emit('BT', Ref(loop, rel=True));
+
+    # frames and calls
+
+    def i_enter(self, f):
+        self.emit('label', f.label);
+        if self.fuse:
+            self.emit('UADDI', 'r2', 'r1', 1);
+        else:
+            self.emit('UIMM', 'r7', 1);
+            self.emit('UMOV', 'r2', 'r1');
+            self.emit('UADD', 'r2', 'r7');
+        params = f.params + ([f.resptr] if f.resptr is not None else []);
+        places, _ = classify([p.type for p in f.params], f.resptr is not None);
+        later = [];
+        for p, (where, mode) in zip(params, places):
+            if isinstance(where, str) and self.fuse:
+                self.store(p, where);
+            elif isinstance(where, str):
+                self.emit('UIMM', 'r1', -p.offset);
+                self.emit('UADD', 'r1', 'r2');
+                self.emit('FST' if where[0] == 'x' else 'UST', 'r1', where);
+            if isinstance(where, int) or mode == 'ptr':
+                later.append((p, where, mode));
+        for p, where, mode in later:
+            if isinstance(where, int) and mode == 'value' and self.fuse:
+                self.emit('FLDO' if p.type.realp() else 'ULDO', reg_of(p.type), 'r2', 3 + where);
+                self.store(p, reg_of(p.type));
+                continue;
+            if isinstance(where, int):
+                self.lea('r3', 'r2', 3 + where);
+            else:
+                self.addr(p, 'r3');
+            if mode == 'value':
+                self.emit('FLD' if p.type.realp() else 'ULD', reg_of(p.type), 'r3');
+                self.store(p, reg_of(p.type));
+                continue;
+            if mode == 'ptr':
+                self.emit('ULD', 'r3', 'r3');
+            self.addr(p, 'r5');
+            self.copy('r5', 'r3', p.type.size);
+        self.lea('r1', 'r2', -f.size - 1);
+
+    def i_leave(self, f):
+        if f.resptr is not None:
+            self.load('r5', f.resptr);
+            self.addr(f.result, 'r3');
+            self.copy('r5', 'r3', f.result.type.size);
+        elif f.result is not None:
+            self.load('x0' if f.result.type.realp() else 'r3', f.result);
+        if self.fuse:
+            self.emit('UADDI', 'r1', 'r2', 2);
+            self.emit('ULD', 'r6', 'r1');
+            self.emit('ULDO', 'r2', 'r2', 1);
+            self.emit('UMOV', 'r0', 'r6');
+            return;
+        self.emit('UIMM', 'r7', 2);
+        self.emit('UMOV', 'r1', 'r2');
+        self.emit('UADD', 'r1', 'r7');
+        self.emit('ULD', 'r6', 'r1');
+        self.emit('UIMM', 'r7', 1);
+        self.emit('UMOV', 'r5', 'r2');
+        self.emit('UADD', 'r5', 'r7');
+        self.emit('ULD', 'r2', 'r5');
+        self.emit('UMOV', 'r0', 'r6');
+
+    def chain(self, g, r):
+        if g.depth == 0:
+            self.emit('UIMM', r, 0);
+            return;
+        n = self.f.depth - g.depth + 1;
+        if n == 0:
+            self.emit('UMOV', r, 'r2');
+            return;
+        self.emit('ULD', r, 'r2');
+        for _ in range(n - 1):
+            self.emit('ULD', r, r);
+
+    # pushes the stack arguments, the return address, the frame pointer and
+    # the static chain, then loads the argument registers and jumps
+    def call_seq(self, args, res, g, target):
+        ops = [v for v, _ in args] + ([res] if res is not None else []);
+        types = [t for _, t in args] + ([res.type] if res is not None else []);
+        places, words = classify([t for _, t in args], res is not None);
+        for i in reversed(range(len(ops))):
+            where, mode = places[i];
+            if not isinstance(where, int):
+                continue;
+            if mode == 'words' and self.fuse:
+                self.load('r3', ops[i]);
+                self.emit('ULDO', 'r5', 'r3', 1);
+                self.push('r5');
+                self.emit('ULD', 'r5', 'r3');
+                self.push('r5');
+            elif mode == 'words':
+                self.load('r3', ops[i]);
+                self.emit('UIMM', 'r7', 1);
+                self.emit('UADD', 'r3', 'r7');
+                self.emit('ULD', 'r5', 'r3');
+                self.push('r5');
+                self.emit('USUB', 'r3', 'r7');
+                self.emit('ULD', 'r5', 'r3');
+                self.push('r5');
+            elif mode == 'value' and not types[i].scalarp():
+                self.load('r5', ops[i]);
+                self.emit('ULD', 'r5', 'r5');
+                self.push('r5');
+            else:
+                r = 'r5' if mode == 'ptr' else reg_of(types[i]);
+                self.load(r, ops[i]);
+                self.push(r);
+        back = self.gen.new_label();
+        self.emit('UIMM', 'r5', Ref(back, -3));
+        self.push('r5');
+        self.push('r2');
+        if g is None:
+            self.emit('UIMM', 'r5', 0);
+        else:
+            self.chain(g, 'r5');
+        self.push('r5');
+        regs = [(where, i) for i, (where, _) in enumerate(places) if isinstance(where, str)];
+        for where, i in sorted(regs, key=lambda x: (x[0][0] == 'r', x[0])):
+            self.load(where, ops[i]);
+            if where[0] == 'r' and not types[i].scalarp() and types[i].size == 1:
+                self.emit('ULD', where, where);
+        if g is None:
+            self.load('r7', target);
+            self.emit('UMOV', 'r0', 'r7');
+        else:
+            self.chain(g, 'r7');
+            self.emit('UIMM', 'r0', Ref(g.label, -3));
+        self.emit('label', back);
+        if words and self.fuse:
+            self.emit('UADDI', 'r1', 'r1', words);
+        elif words:
+            self.emit('UIMM', 'r7', words);
+            self.emit('UADD', 'r1', 'r7');
+
+    def result(self, d):
+        if d is not None and d.type.scalarp():
+            self.store(d, 'x0' if d.type.realp() else 'r3');
+
+    def i_call(self, d, g, args, res):
+        self.call_seq(args, res, g, None);
+        self.result(d);
+
+    def i_icall(self, d, target, args):
+        self.call_seq(args, None, None, target);
+        self.result(d);
+
+    def i_ccall(self, d, n, args):
+        ints = iter(INT_ARGS); reals = iter(REAL_ARGS);
+        for v, t in args:
+            if t.realp():
+                self.load(next(reals), v);
+        for v, t in args:
+            if not t.realp():
+                self.load(next(ints), v);
+        if self.fuse:
+            self.emit('ULDA', 'r7', n);
+        else:
+            self.emit('UIMM', 'r7', n);
+            self.emit('ULD', 'r7', 'r7');
+        self.emit('CALL', 'r3', 'r7');
+        self.result(d);
+
+    # three address code
+
+    def i_label(self, label):
+        self.emit('label', label);
+
+    def i_line(self, line):
+        self.emit('line', self.f.unit, line, self.f.name);
+
+    def i_jmp(self, label):
+        self.emit('UIMM', 'r0', Ref(label, -3));
+
+    def i_bt(self, v, label):
+        self.load('r4', v);
+        self.emit('BT', Ref(label, rel=True));
+
+    def i_bf(self, v, label):
+        self.load('r4', v);
+        self.emit('BF', Ref(label, rel=True));
+
+    # n words of targets minus 3 at table, out of range goes to default
+    def i_jtab(self, v, table, n, default):
+        self.load('r5', v);
+        self.emit('UIMM', 'r3', n);
+        if self.fuse:
+            self.emit('ULTBF', 'r5', 'r3', Ref(default, rel=True));
+            self.emit('ULDO', 'r5', 'r5', Ref(table));
+            self.emit('UMOV', 'r0', 'r5');
+            return;
+        self.emit('ULT', 'r5', 'r3');
+        self.emit('BF', Ref(default, rel=True));
+        self.emit('UIMM', 'r3', Ref(table));
+        self.emit('UADD', 'r5', 'r3');
+        self.emit('ULD', 'r5', 'r5');
+        self.emit('UMOV', 'r0', 'r5');
+
+    def i_mov(self, d, v):
+        r = reg_of(d.type);
+        self.load(r, v);
+        self.store(d, r);
+
+    def i_sym(self, d, ref):
+        self.emit('UIMM', 'r5', ref);
+        self.store(d, 'r5');
+
+    def i_addr(self, d, p):
+        self.addr(p, 'r5');
+        self.store(d, 'r5');
+
+    def i_load(self, d, a):
+        self.load('r5', a);
+        self.emit('FLD' if d.type.realp() else 'ULD', reg_of(d.type), 'r5');
+        self.store(d, reg_of(d.type));
+
+    def i_store(self, a, v):
+        r = reg_of(v.type);
+        self.load(r, v);
+        self.store(Mem(a, v.type), r);
+
+    def i_bin(self, d, op, a, b):
+        if op[0] == 'F':
+            self.load('x0', a); self.load('x1', b);
+            self.emit(op, 'x0', 'x1');
+            self.store(d, 'x0');
+        elif self.fuse and op in ('UADD', 'USUB') and isinstance(b, Imm):
+            self.load('r5', a);
+            self.emit('UADDI', 'r5', 'r5', int(b.val) if op == 'UADD' else -int(b.val));
+            self.store(d, 'r5');
+        else:
+            self.load('r5', a); self.load('r3', b);
+            self.emit(op, 'r5', 'r3');
+            self.store(d, 'r5');
+
+    # division by a constant, multiplying by its inverse, the high word of a
+    # product is in r3, and mulhi(x, 2**(64 - s)) shifts x right by s
+    def i_divc(self, d, a, c):
+        if d.type.kind != 'int':
+            self.udivc(a, c);
+        elif c == -1:
+            self.load('r5', a);
+            self.emit('UIMM', 'r3', 0);
+            self.emit('USUB', 'r3', 'r5');
+        elif abs(c) & abs(c) - 1 == 0:
+            k = abs(c).bit_length() - 1;
+            # n + (2**k - 1 if n < 0), then floor division by 2**k
+            self.load('r6', a);
+            self.emit('UIMM', 'r5', 0);
+            self.emit('ILT', 'r6', 'r5');
+            self.emit('UIMM', 'r5', (1 << k) - 1);
+            self.emit('UMUL', 'r5', 'r4');
+            self.emit('UADD', 'r5', 'r6');
+            self.emit('UMOV', 'r3', 'r5');
+            self.asr(k);
+            if c < 0:
+                self.emit('UIMM', 'r5', 0);
+                self.emit('USUB', 'r5', 'r3');
+                self.emit('UMOV', 'r3', 'r5');
+        else:
+            m, s = smagic(c);
+            self.load('r6', a);
+            self.emit('UMOV', 'r5', 'r6');
+            self.emit('UIMM', 'r3', m & (1 << 64) - 1);
+            self.emit('IMUL', 'r5', 'r3');
+            if c > 0 > m:
+                self.emit('UADD', 'r3', 'r6');
+            elif c < 0 < m:
+                self.emit('USUB', 'r3', 'r6');
+            self.asr(s);
+            self.emit('UIMM', 'r5', 0);
+            self.emit('ILT', 'r3', 'r5');
+            self.emit('UADD', 'r3', 'r4');
+        self.store(d, 'r3');
+
+    def udivc(self, a, c):
+        if c >> 63:
+            self.load('r5', a);
+            self.emit('UIMM', 'r3', c);
+            self.emit('ULT', 'r5', 'r3');
+            self.emit('UIMM', 'r3', 1);
+            self.emit('USUB', 'r3', 'r4');
+            return;
+        if c & c - 1 == 0:
+            self.load('r5', a);
+            self.emit('UIMM', 'r3', 1 << 65 - c.bit_length());
+            self.emit('UMUL', 'r5', 'r3');
+            return;
+        m, s, add = umagic(c);
+        if add:
+            self.load('r6', a);
+            self.emit('UMOV', 'r5', 'r6');
+            self.emit('UIMM', 'r3', m);
+            self.emit('UMUL', 'r5', 'r3');
+            self.emit('UMOV', 'r4', 'r3');
+            self.emit('USUB', 'r6', 'r4');
+            self.emit('UIMM', 'r5', 1 << 63);
+            self.emit('UMUL', 'r5', 'r6');
+            self.emit('UADD', 'r3', 'r4');
+            s -= 1;
+        else:
+            self.load('r5', a);
+            self.emit('UIMM', 'r3', m);
+            self.emit('UMUL', 'r5', 'r3');
+        if s:
+            self.emit('UIMM', 'r5', 1 << 64 - s);
+            self.emit('UMUL', 'r5', 'r3');
+
+    # r3 >> s arithmetic, one bit is the logical shift with the sign put back
+    def asr(self, s):
+        if s >= 2:
+            self.emit('UIMM', 'r5', 1 << 64 - s);
+            self.emit('IMUL', 'r5', 'r3');
+        elif s == 1:
+            self.emit('UMOV', 'r6', 'r3');
+            self.emit('UIMM', 'r5', 0);
+            self.emit('ILT', 'r6', 'r5');
+            self.emit('UIMM', 'r5', 1 << 63);
+            self.emit('UMUL', 'r5', 'r4');
+            self.emit('UIMM', 'r4', 1 << 63);
+            self.emit('UMUL', 'r4', 'r6');
+            self.emit('UADD', 'r3', 'r5');
+
+    # loads the operands of a comparison, its instruction sets r4 to the
+    # comparison, or to its negation if negate is True
+    def compare(self, op, kind, a, b):
+        x, y = ('x0', 'x1') if kind == 'F' else ('r5', 'r3');
+        self.load(x, a); self.load(y, b);
+        signed = 'U' if kind == 'I' and op in ('EQ', 'NE') else kind;
+        insn, negate = {
+            'EQ': ('EQ', False), 'NE': ('EQ', True), 'LT': ('LT', False),
+            'GE': ('LT', True), 'GT': ('GT', False), 'LE': ('GT', True)
+        }[op];
+        return signed + insn, x, y, negate
+
+    def test(self, op, kind, a, b):
+        insn, x, y, negate = self.compare(op, kind, a, b);
+        self.emit(insn, x, y);
+        return negate
+
+    def i_cmp(self, d, op, kind, a, b):
+        if self.test(op, kind, a, b):
+            self.emit('UIMM', 'r5', 0);
+            self.emit('UEQ', 'r4', 'r5');
+        self.store(d, 'r4');
+
+    def i_stop(self, v):
+        self.load('r3', v);
+        self.emit('STOP', 'r3');
+
+    def i_bcmp(self, sense, op, kind, a, b, label):
+        if self.fuse:
+            insn, x, y, negate = self.compare(op, kind, a, b);
+            self.emit(insn + ('BT' if sense != negate else 'BF'), x, y, Ref(label, rel=True));
+            return;
+        negate = self.test(op, kind, a, b);
+        self.emit('BT' if sense != negate else 'BF', Ref(label, rel=True));
+
+    def i_conv(self, d, op, a):
+        if op[0] == 'F':
+            self.load('x0', a);
+            self.emit(op, 'r5', 'x0');
+            self.store(d, 'r5');
+        else:
+            self.load('r5', a);
+            self.emit(op, 'x0', 'r5');
+            self.store(d, 'x0');
+
+    def i_copy(self, dst, src, n):
+        self.load('r5', dst); self.load('r3', src);
+        self.copy('r5', 'r3', n);
+
+    # a parallel assignment, the scratch registers are r3 and x1
+    def i_pmove(self, moves):
+        def conflictp(d, s):
+            if not isinstance(s, Slot):
+                return False;
+            return not s.temp if isinstance(d, Mem) else overlapp(d, s);
+        for d, s in sequence(moves, conflictp, lambda s: 'x1' if s.type.realp() else 'r3'):
+            if isinstance(d, str):
+                self.load(d, s);
+            elif isinstance(s, str):
+                self.store(d, s);
+            else:
+                self.load(reg_of(d.type), s);
+                self.store(d, reg_of(d.type));
+
+# a frame slot per root slot, below the frame pointer in order
+def layout(f):
+    f.size = 0;
+    for s in f.slots:
+        if s.parent is None:
+            f.size += s.type.size; s.offset = f.size;
+
+def align(n, k):
+    return (n + k - 1) // k * k;
+
+@dataclass
+class Image:
+    code: list
+    data: list
+    addrs: dict
+    end: int
+    blocks: list = field(default_factory=list)  # see pgo.order
+
+    def operand(self, x, pc):
+        if isinstance(x, str):
+            return int(x[1:]);
+        if isinstance(x, Ref):
+            return self.addrs[x.label] + x.addend - (pc if x.rel else 0);
+        if isinstance(x, float):
+            return struct.unpack('<Q', struct.pack('<d', x))[0];
+        return x
+
+    def words(self):
+        pc = IMAGE_BASE; words = [];
+        for insn in self.code:
+            if insn[0] in NOCODE:
+                continue;
+            words.append(OPCODES[insn[0]]);
+            words.extend(self.operand(x, pc) for x in insn[1:]);
+            pc += len(insn);
+        for label, data in self.data:
+            words.extend(self.operand(x, pc) for x in data);
+        return [w & 0xffffffffffffffff for w in words]
+
+    def bytes(self):
+        return struct.pack(f"<{self.end - IMAGE_BASE}Q", *self.words());
+
+    # asm.pl input, labels and functions are comments
+    def text(self):
+        pc = IMAGE_BASE; lines = [];
+        for insn in self.code:
+            if insn[0] == 'comment':
+                lines.append(f"; {insn[1]}");
+                continue;
+            if insn[0] == 'label':
+                lines.append(f"; {insn[1]}:");
+                continue;
+            if insn[0] == 'line':
+                continue;
+            ops = [x if isinstance(x, str) else repr(x) if isinstance(x, float)
+                   else str(self.operand(x, pc)) for x in insn[1:]];
+            lines.append(f"{insn[0]} {', '.join(ops)}");
+            pc += len(insn);
+        for label, data in self.data:
+            lines.append(f"; {label}:");
+            lines.extend(f"WORD {self.operand(x, pc)}" for x in data);
+        return '\n'.join(lines) + '\n'
+
+    # the line table, a row per pc where the file, line or function changes,
+    # see LINE TABLES in README
+    def lines(self, files={}):
+        pc = IMAGE_BASE; rows = [];
+        for insn in self.code:
+            if insn[0] == 'line':
+                row = (pc, files.get(insn[1], insn[1] or ''), insn[2], insn[3]);
+                if rows and rows[-1][0] == pc:
+                    rows.pop();
+                if not rows or rows[-1][1:] != row[1:]:
+                    rows.append(row);
+            elif insn[0] not in NOCODE:
+                pc += len(insn);
+        names = {}; funcs = {};
+        for _, name, _, func in rows:
+            names.setdefault(name, len(names)); funcs.setdefault(func, len(funcs));
+        out = bytearray(b'SLL1');
+        for table in (names, funcs):
+            out += uleb(len(table));
+            for x in table:
+                out += uleb(len(x.encode())) + x.encode();
+        pc, name, line, func = IMAGE_BASE, 0, 0, 0;
+        for at, n, l, f in rows:
+            if names[n] != name:
+                name = names[n]; out += b'\x01' + uleb(name);
+            if funcs[f] != func:
+                func = funcs[f]; out += b'\x02' + uleb(func);
+            out += b'\x03' + uleb(at - pc) + sleb(l - line);
+            pc, line = at, l;
+        return bytes(out + b'\x00')
+
+    # the pc of every line and block the counts of a profile are kept for,
+    # a probe per line, `pc kind unit function digest n', see PROFILES in README
+    def probes(self, profile):
+        pc = IMAGE_BASE; lines = [];
+        for insn in self.code:
+            if insn[0] == 'line' and (k := profile.key(insn[1], insn[2])) is not None:
+                lines.append(' '.join(map(str, (pc,) + k)));
+            elif insn[0] not in NOCODE:
+                pc += len(insn);
+        for unit, name, digest, labels in self.blocks:
+            for n, label in enumerate(labels):
+                lines.append(f"{self.addrs[label]} block {unit} {name} {digest} {n}");
+        return '\n'.join(lines) + '\n'
+
+def uleb(n):
+    out = bytearray();
+    while True:
+        b = n & 127; n >>= 7;
+        out.append(b | 128 if n else b);
+        if not n:
+            return out
+
+def sleb(n):
+    out = bytearray();
+    while True:
+        b = n & 127; n >>= 7;
+        done = n == 0 and not b & 64 or n == -1 and b & 64;
+        out.append(b if done else b | 128);
+        if done:
+            return out
+
+# strings sorted by their reversal put every string right before the ones it
+# is a suffix of, so it is an alias into the longest one, with its zero
+def pool(strings):
+    data = []; aliases = {}; owner = None;
+    for s in sorted(strings, key=lambda s: s[::-1], reverse=True):
+        if owner is not None and owner.endswith(s):
+            aliases[strings[s]] = (strings[owner], len(owner) - len(s));
+            continue;
+        owner = s;
+        data.append((strings[s], [ord(c) for c in s] + [0]));
+    return data, aliases
+
+def assemble(code, data, aliases={}):
+    addrs = {}; pc = IMAGE_BASE;
+    for insn in code:
+        if insn[0] == 'label':
+            addrs[insn[1]] = pc;
+        elif insn[0] not in NOCODE:
+            pc += len(insn);
+    for label, words in data:
+        addrs[label] = pc; pc += len(words);
+    for label, (base, off) in aliases.items():
+        addrs[label] = addrs[base] + off;
+    addrs['stack'] = align(pc + STACK_GAP, 1024) + STACK_SIZE - 1;
+    return Image(code, data, addrs, pc)
+
+def generate(program, units, report=None, checked=False, level=1, fuse=True, profile=None):
+    gen = Gen(program, units, checked);
+    if level > 0:
+        gen.unescaped = {gen.slots[k] for k in unescaped(program, units, gen.res) if k in gen.slots};
+    gen.generate();
+    blocks = [];
+    if level > 0:
+        import ssa
+        ssa.optimize(gen, report);
+    if level > 0 and profile is not None:
+        import pgo
+        blocks = pgo.order(gen, profile, report);
+    for f in list(gen.frames.values()) + [gen.main]:
+        layout(f);
+    if level > 0:
+        import coloring
+        coloring.color(gen, report);
+    strings, aliases = pool(gen.strings);
+    if report is not None and gen.strings:
+        words = sum(len(x) for _, x in strings);
+        report(f"strings: {gen.literals - words} of {gen.literals} words saved");
+    for name, removed, checks in gen.bounds if report is not None else []:
+        report(f"bounds: {name}: {removed} of {checks} checks removed");
+    image = assemble(Select(gen, fuse).run(), gen.data + strings, aliases);
+    image.blocks = blocks;
+    return image
@@ -0,0 +1,205 @@
+#! /usr/bin/env python
+
+# stack slot coloring, the slots of a frame whose live ranges don't overlap
+# share its words, over the three address code of backend.Gen
+
+from __future__ import annotations
+from backend import Slot, Mem, DEFS
+from ssa import ENDS, BRANCHES, frame_slots, slots_in
+
+# the slots insn writes, the slots it reads, and the slots it takes the
+# address of, a call writes its result through res
+def operands(insn):
+    op = insn[0];
+    if op == 'enter':
+        return frame_slots(insn), [], []
+    if op == 'leave':
+        return [], frame_slots(insn), []
+    if op == 'addr':
+        if isinstance(insn[2], Slot):
+            return [insn[1]], [], [insn[2]]
+        return [insn[1]], list(slots_in(insn[2])), []
+    if op == 'pmove':
+        return [d for d, _ in insn[1] if isinstance(d, Slot)], \
+            list(slots_in([(d.addr if isinstance(d, Mem) else None, v) for d, v in insn[1]])), []
+    defs = [insn[1]] if op in DEFS and insn[1] is not None else [];
+    rest = insn[2:] if op in DEFS else insn[1:];
+    if op == 'call':
+        rest = insn[2:4];
+        if insn[4] is not None:
+            defs.append(insn[4]);
+    return defs, list(slots_in(rest)), []
+
+# the slots each frame's code uses from another frame
+def foreign(frames):
+    xs = set();
+    for f in frames:
+        for insn in f.code:
+            for s in slots_in(insn[1:]):
+                if s.root()[0].owner not in (f, None):
+                    xs.add(s.root()[0]);
+    return xs
+
+# a root slot of the frame is fixed, sharing no word, when another frame
+# uses it, its name is taken by @ and the address may outlive the call it is
+# passed to, or its address leaves the frame
+class Frame:
+    def __init__(self, f, targets, foreign, taken, unescaped=()):
+        self.f = f; self.code = f.code;
+        self.roots = [s for s in f.slots if s.parent is None];
+        self.index = {id(s): n for n, s in enumerate(self.roots)};
+        self.ops = [operands(insn) for insn in self.code];
+        self.fixed = self.escapes() | \
+            self.mask(s for s in self.roots if s in foreign or
+                      not s.temp and s.name in taken and s not in unescaped);
+        self.succ = self.edges(targets);
+
+    def bit(self, s):
+        r = s.root()[0];
+        return 1 << self.index[id(r)] if id(r) in self.index else 0
+
+    def mask(self, xs):
+        m = 0;
+        for s in xs:
+            m |= self.bit(s);
+        return m
+
+    # the roots each slot may point into, from the addresses taken and the
+    # moves and arithmetic on them, and the roots whose address is stored in
+    # memory or outside the frame, calls only use the pointers they get
+    def escapes(self):
+        self.points = {};
+        for (defs, _, taken) in self.ops:
+            for d in defs if taken else []:
+                self.points[id(d)] = self.points.get(id(d), 0) | self.mask(taken);
+        changed = True;
+        while changed:
+            changed = False;
+            for insn, (defs, uses, _) in zip(self.code, self.ops):
+                if insn[0] not in ('mov', 'bin', 'pmove'):
+                    continue;
+                m = 0;
+                for s in uses:
+                    m |= self.points.get(id(s), 0);
+                for d in defs:
+                    if m & ~self.points.get(id(d), 0):
+                        self.points[id(d)] = self.points.get(id(d), 0) | m; changed = True;
+        out = 0;
+        for insn, (defs, uses, _) in zip(self.code, self.ops):
+            if insn[0] == 'store':
+                out |= self.points.get(id(insn[2]), 0);
+            elif insn[0] == 'pmove':
+                for d, v in insn[1]:
+                    if isinstance(d, Mem):
+                        out |= self.points.get(id(v), 0);
+            for d in defs:
+                if not self.bit(d):
+                    out |= self.points.get(id(d), 0);
+        return out
+
+    def edges(self, targets):
+        labels = {insn[1]: n for n, insn in enumerate(self.code) if insn[0] == 'label'};
+        succ = [];
+        for n, insn in enumerate(self.code):
+            op = insn[0];
+            xs = [] if op in ENDS else [n + 1] if n + 1 < len(self.code) else [];
+            if op == 'jmp':
+                xs = [labels[insn[1]]];
+            elif op in BRANCHES:
+                xs.append(labels[insn[-1]]);
+            elif op == 'jtab':
+                xs = [labels[insn[4]]] + [labels[x] for x in targets[insn[2]]];
+            succ.append(xs);
+        return succ
+
+    # the roots live after each instruction that some definition reaches,
+    # through a pointer into a root, the root is live where the pointer is
+    def live(self):
+        n = len(self.code);
+        uses = []; defs = []; kills = [];
+        for defd, used, taken in self.ops:
+            u = self.mask(used);
+            for s in used:
+                u |= self.points.get(id(s), 0);
+            uses.append(u);
+            defs.append(self.mask(defd) | self.mask(taken));
+            kills.append(self.mask(s for s in defd if s.parent is None) & ~u);
+        live_in = [0] * n; live_out = [0] * n;
+        changed = True;
+        while changed:
+            changed = False;
+            for i in reversed(range(n)):
+                out = 0;
+                for s in self.succ[i]:
+                    out |= live_in[s];
+                x = uses[i] | out & ~kills[i];
+                if x != live_in[i] or out != live_out[i]:
+                    live_in[i] = x; live_out[i] = out; changed = True;
+        pred = [[] for _ in range(n)];
+        for i, xs in enumerate(self.succ):
+            for s in xs:
+                pred[s].append(i);
+        reach_in = [0] * n; reach_out = [0] * n;
+        changed = True;
+        while changed:
+            changed = False;
+            for i in range(n):
+                x = 0;
+                for p in pred[i]:
+                    x |= reach_out[p];
+                reach_in[i] = x;
+                if x | defs[i] != reach_out[i]:
+                    reach_out[i] = x | defs[i]; changed = True;
+        return [(live_in[i] & reach_in[i], live_out[i] & reach_out[i], defs[i])
+                for i in range(n)]
+
+    # roots interfere when both are live at an instruction, or one is
+    # defined while the other is live after it, the moves of a pmove may
+    # write before they read
+    def interference(self):
+        edges = [0] * len(self.roots);
+        def clique(m):
+            k = m;
+            while k:
+                b = k & -k; k ^= b;
+                edges[b.bit_length() - 1] |= m;
+        for insn, (live_in, live_out, defs) in zip(self.code, self.live()):
+            clique(live_out | defs);
+            clique(live_in | (defs if insn[0] == 'pmove' else 0));
+        everything = (1 << len(self.roots)) - 1;
+        for k in range(len(self.roots)):
+            if self.fixed >> k & 1:
+                edges[k] = everything;
+            else:
+                edges[k] |= self.fixed;
+            edges[k] &= ~(1 << k);
+        return edges
+
+    # first fit, largest slots first, a slot's offset is its last word
+    def color(self):
+        edges = self.interference();
+        at = {};
+        for k in sorted(range(len(self.roots)), key=lambda k: -self.roots[k].type.size):
+            size = self.roots[k].type.size;
+            busy = sorted((at[j], at[j] + self.roots[j].type.size) for j in at if edges[k] >> j & 1);
+            p = 0;
+            for lo, hi in busy:
+                if p + size <= lo:
+                    break;
+                p = max(p, hi);
+            at[k] = p;
+        self.f.size = 0;
+        for k, s in enumerate(self.roots):
+            s.offset = at[k] + s.type.size;
+            self.f.size = max(self.f.size, s.offset);
+
+def color(gen, report=None, frames=None):
+    frames = frames or list(gen.frames.values()) + [gen.main];
+    targets = {label: [r.label for r in words] for label, words in gen.data
+               if words and all(hasattr(r, 'label') for r in words)};
+    outside = foreign(frames);
+    for f in frames:
+        words = sum(s.type.size for s in f.slots if s.parent is None);
+        Frame(f, targets, outside, gen.taken, gen.unescaped).color();
+        if report is not None and words:
+            report(f"frame: {f.name}: {f.size} of {words} words");
@@ -1,6 +1,7 @@
 #! /usr/bin/env python
 
 from __future__ import annotations
+import io
 import string
 import sys
 import os
@@ -8,10 +9,14 @@ import re
 from dataclasses import dataclass
 from typing import List, Any, Tuple
 from functools import reduce
+from getopt import getopt, GetoptError
+import hashlib
+
+class CompileError(Exception):
+    pass
 
 def die(x):
-    print(x, file=sys.stderr)
-    sys.exit(1)
+    raise CompileError(x)
 
 def remove_comment(text):
     i = 0; f = append1; res = ""
@@ -61,6 +66,8 @@ def remove_comment(text):
     return res;
 
 SPACES = tuple(string.whitespace)
+PARSE_AHEAD = 1024;  # the text kept ahead of the parser, see parse_toplevel
+PARSE_CHUNK = 8192;
 
 @dataclass
 class Syntax:
@@ -429,12 +436,25 @@ class Library(Syntax):
     decls: List[Any]
     body: Statement
 
-def parse_toplevel(s):
-    s += ' .';
-    line_count = 0;
-    idx = 0;
+# the text is read PARSE_CHUNK letters at a time, so the parser slices a
+# short string, and with each, every top level declaration of the unit is
+# passed to it as soon as it is parsed, instead of being kept in the tree
+def parse_toplevel(read, each=None):
+    s = '';
+    line_count = 1;  # lines count from 1, as editors number them
+    top = True;
+    def fill(n=PARSE_AHEAD):
+        nonlocal s, read
+        while read is not None and len(s) < n:
+            x = read(PARSE_CHUNK);
+            if x == '':
+                s += ' .'; read = None;
+            else:
+                s += x;
     def check_empty():
         nonlocal s, line_count
+        if len(s) < PARSE_AHEAD:
+            fill();
         if s == "":
             die(f"Bad End Of File @ {line_count}")
     def spacep():
@@ -447,9 +467,9 @@ def parse_toplevel(s):
         global SPACES;
         check_empty()
         while s[0] in SPACES:
-            if s.startswith("\n"):
-                line_count += 1
-            s = s[1:];
+            rest = s.lstrip(string.whitespace);
+            line_count += s.count("\n", 0, len(s) - len(rest));
+            s = rest;
             check_empty()
     def eat_word(ss):
         nonlocal s, line_count
@@ -471,11 +491,7 @@ def parse_toplevel(s):
         check_empty();
         if not s.startswith(tuple(xs)):
             die(f"{name}: No Space @ {line_count}")
-        while s[0] in xs:
-            if s.startswith("\n"):
-                line_count += 1;
-            s = s[1:];
-            check_empty();
+        eat_spaces_and_check_empty();
     def idp():
         nonlocal s;
         return bool(re.match(r'([a-zA-Z_][a-zA-Z0-9_]*)', s));
@@ -689,18 +705,19 @@ def parse_toplevel(s):
         return parse_simple_loop('UNTIL', UntilSttmt);
     def parse_expr():
         nonlocal s, line_count;
+        # the longest operator wins, `<>' and `<=' are not `<'
+        operators = ('<>', '>=', '<=', '|', '&', '=', '>', '<', '+', '-', '*', '/', '^');
         def parse_binop(x, parse_next_level, ops):
             nonlocal s, line_count;
             lc = line_count;
-            if not s.startswith(tuple(lit for lit, _ in ops)):
+            lit = next((op for op in operators if s.startswith(op)), None);
+            build = dict(ops).get(lit);
+            if build is None:
                 return x;
-            for lit, build in ops:
-                if s[0] == lit:
-                    eat_word(lit);
-                    eat_spaces_and_check_empty();
-                    y = parse_next_level();
-                    res = build(lc, x, y);
-                    break;
+            eat_word(lit);
+            eat_spaces_and_check_empty();
+            y = parse_next_level();
+            res = build(lc, x, y);
             eat_spaces_and_check_empty();
             return parse_binop(Expr(lc, res), parse_next_level, ops);
         def parse_level_0():
@@ -711,11 +728,11 @@ def parse_toplevel(s):
             eat_word("IF");
             expect_eat_spaces_and_check_empty("IF expression");
             cond = parse_level_0();
-            expect_eat_spaces_and_check_empty("IF expression");
+            eat_spaces_and_check_empty();
             eat_word("THEN");
             expect_eat_spaces_and_check_empty("IF expression");
             then = parse_level_0();
-            expect_eat_spaces_and_check_empty("IF expression");
+            eat_spaces_and_check_empty();
             eat_word("ELSE");
             expect_eat_spaces_and_check_empty("IF expression");
             els  = parse_level_0();
@@ -845,9 +862,12 @@ def parse_toplevel(s):
             return False;
         def match_str():
             nonlocal s;
-            if res := re.match(r'"((?:[^"]|\\.)*)"', s):
-                return res.group(1);
-            return False;
+            while True:
+                if res := re.match(r'"((?:[^"]|\\.)*)"', s):
+                    return res.group(1);
+                if read is None or not s.startswith('"'):
+                    return False;
+                fill(len(s) + PARSE_CHUNK);
         def parse_level_10():
             nonlocal s, line_count;
             lc = line_count;
@@ -958,7 +978,7 @@ def parse_toplevel(s):
             def parse_step_to(lc, assign, steps):
                 nonlocal s, clauses;
                 tos = parse_expr_list(assign, "STEP TO", "TO");
-                clauses.append(StepToForClause(lc, assign, tos, steps));
+                clauses.append(StepToForClause(lc, assign, steps, tos));
                 eat_spaces_and_check_empty()
                 return parse_toplevel();
             def parse_to(lc, assign):
@@ -1015,7 +1035,8 @@ def parse_toplevel(s):
         eat_word('FOR');
         expect_eat_spaces_and_check_empty('FOR');
         parse_clause();
-        eat_spaces_and_check_empty();
+        eat_word('DO');
+        expect_eat_spaces_and_check_empty('FOR');
         body = parse_statement();
         return ForSttmt(lc, clauses, body);
     def parse_if():
@@ -1045,7 +1066,7 @@ def parse_toplevel(s):
         nonlocal line_count;
         lc = line_count;
         eat_word("GOTO");
-        expect_eat_spaces_and_check_empty();
+        expect_eat_spaces_and_check_empty("GOTO");
         if id_in_lib_p():
             id = parse_id_in_lib();
         elif idp():
@@ -1153,9 +1174,9 @@ def parse_toplevel(s):
         eat_word(';');
         return TypeDecl(lc, typedecls);
     def parse_decls():
-        nonlocal s;
+        nonlocal s, top;
         eat_spaces_and_check_empty();
-        decls = []
+        decls = []; keep = each if top else None; top = False;
         while s.startswith(('VAR', 'CONST', 'FUNCTION', 'PROCEDURE', 'TYPE', 'LIBRARY')):
             if s.startswith('VAR'):
                 decls.append(parse_var_decl())
@@ -1169,6 +1190,8 @@ def parse_toplevel(s):
                 decls.append(parse_type_decl())
             elif s.startswith('LIBRARY'):
                 decls.append(parse_library())
+            if keep is not None:
+                keep(decls.pop());
             eat_spaces_and_check_empty();
         return decls
     def parse_lib_program(which, build):
@@ -1192,36 +1215,256 @@ def parse_toplevel(s):
         return parse_library();
     die(f"Bad Toplevel @ {line_count}");
 
-x = parse_toplevel('''
-PROGRAM test;
-  FUNCTION blahblah(
-  VAR x, y :
-      ARRAY 2, 3 OF
-      POINTER TO
-      RECORD(VAR re, vi : REAL;);
-  VAR a, b, c :
-      INTEGER;
-  ) res : INTEGER;
-  TYPE blahtype = PROCEDURE;
-  CONST blahconst1 = 2, blahconst2 = 3;
-  BEGIN
-    IF x > 0 THEN
-      a[b#c](x)#a[@abc, 1+2] := (a * b + c * d + c*d^e > 0 < 1 = 0)(abc)
-    ELSE
-      x := x + 1;
-    FOR x, y := 1, 2 STEP 3, 4 TO 10, 20
-    AS a ITERATE BY update
-    AS b ITERATE AS a + 5
-    AS c := 20 THEN c + 1 DO
-      print(x+ y + a +b +c)
-    a()
-    b()
-    BEGIN
-      print(a)
-      a := a + 1
-    END WHILE a < 100
-  END;
-VOID
-''')
-
-print(x)
+
+SCALAR_TYPES = ('INTEGER', 'UNSIGNED', 'REAL', 'CHAR', 'BOOLEAN',
+                'PROCEDURE', 'FUNCTION');
+
+@dataclass
+class Interface:
+    name: str
+    unit: Program | Library
+    consts: dict
+    vars: dict
+    types: dict
+    layouts: dict
+    funcs: dict
+    libs: dict
+
+def type_lookup(layouts, libs, outer=None):
+    def lookup(t):
+        if isinstance(t, IDInLib):
+            iface = libs.get(t.ids[0]);
+            for name in t.ids[1:-1]:
+                iface = iface and iface.libs.get(name);
+            if iface is None or t.ids[-1] not in iface.layouts:
+                die(f"Unknown type {'.'.join(t.ids)} @ {t.line}");
+            return iface.layouts[t.ids[-1]];
+        if t.id in layouts:
+            return layouts[t.id];
+        if outer is not None:
+            return outer(t);
+        if t.id in SCALAR_TYPES:
+            return 1;
+        die(f"Unknown type {t.id} @ {t.line}");
+    return lookup
+
+# sizes are in virtual machine bytes, a VECTOR is a pointer and a length
+def type_size(type, lookup):
+    t = type.type;
+    if isinstance(t, Array):
+        return reduce(lambda n, d: n * d.val, t.dims, 1) * type_size(t.type, lookup);
+    if isinstance(t, Vector):
+        return 2;
+    if isinstance(t, Pointer):
+        return 1;
+    if isinstance(t, Record):
+        return sum(len(d.names) * type_size(d.type, lookup) for d in t.types);
+    return lookup(t);
+
+def interface(unit, libs={}, outer=None):
+    iface = Interface(unit.name.id, unit, {}, {}, {}, {}, {}, {});
+    visible = dict(libs);
+    lookup = type_lookup(iface.layouts, visible, outer);
+    for decl in unit.decls:
+        if isinstance(decl, VarDecl):
+            type_size(decl.type, lookup);
+            for id in decl.names:
+                iface.vars[id.id] = decl.type;
+        elif isinstance(decl, ConstDecl):
+            for id, val in decl.binds:
+                iface.consts[id.id] = val;
+        elif isinstance(decl, TypeDecl):
+            for id, type in decl.types:
+                iface.types[id.id] = type;
+                iface.layouts[id.id] = type_size(type, lookup);
+        elif isinstance(decl, (FuncDecl, ProcDecl)):
+            iface.funcs[decl.name.id] = decl;
+        elif isinstance(decl, Library):
+            lib = interface(decl, visible, lookup);
+            iface.libs[lib.name] = visible[lib.name] = lib;
+    return iface
+
+@dataclass
+class Source:
+    path: str
+    stamp: Tuple[int, int]
+    digest: str
+    tree: Program | Library
+    ifaces: dict
+
+# cache maps a path to its Source, a Source is reused while its mtime and
+# size are unchanged, or while its content hash is unchanged
+def load_source(path, cache=None):
+    st = os.stat(path);
+    stamp = (st.st_mtime_ns, st.st_size);
+    old = cache.get(path) if cache is not None else None;
+    if old is not None and old.stamp == stamp:
+        return old;
+    with open(path, 'rb') as f:
+        data = f.read();
+    digest = hashlib.sha256(data).hexdigest();
+    if old is not None and old.digest == digest:
+        old.stamp = stamp;
+        return old;
+    try:
+        tree = parse_toplevel(io.StringIO(data.decode()).read);
+    except CompileError as e:
+        die(f"{path}: {e}");
+    src = Source(path, stamp, digest, tree, {});
+    if cache is not None:
+        cache[path] = src;
+    return src
+
+# an interface depends on the libraries before it, so it is cached per
+# the digests of those libraries
+def compile_sources(paths, cache=None):
+    libs = {}; deps = (); program = None;
+    for path in paths:
+        src = load_source(path, cache);
+        if isinstance(src.tree, Program):
+            if program is not None:
+                die(f"{path}: more than one PROGRAM");
+            program = src;
+            continue;
+        iface = src.ifaces.get(deps);
+        if iface is None:
+            iface = src.ifaces[deps] = interface(src.tree, libs);
+        libs[iface.name] = iface;
+        deps += (src.digest,);
+    if program is None:
+        return libs.pop(iface.name), libs;
+    if deps not in program.ifaces:
+        program.ifaces[deps] = interface(program.tree, libs);
+    return program.ifaces[deps], libs
+
+# the syntax trees of the sources after the optimizations of opt.py, and
+# the profile of counts, or for the probes of an image with probes
+def optimize(paths, cache=None, report=None, level=1, limit=None, probes=False, counts=None):
+    import opt
+    unit, libs = compile_sources(paths, cache);
+    tree = unit.unit; units = {name: iface.unit for name, iface in libs.items()};
+    profile = None;
+    if probes or counts is not None:
+        import pgo
+        trees = {x.name.id: x for x in [tree] + list(units.values())};
+        profile = pgo.Profile(trees, pgo.read(counts) if counts is not None else {});
+    if level > 0 and isinstance(tree, Program):
+        limit = opt.INLINE_LIMIT if limit is None else limit;
+        unit, libs = opt.inline(unit, libs, limit, report, profile);
+        unit, libs = opt.lift(unit, libs, report);
+        unit, libs = opt.escape(unit, libs, report);
+        tree, units = opt.shake(unit, libs, report);
+    return tree, units, profile
+
+USAGE = """\
+Usage:\t{0} [-r] [-c] [-b] [-g] [-P profile] [-S | -p | -t] [-O level] [-i limit] [-o output] file...
+\t{0} serve [-s socket]
+-r\treport what the optimizations did to stderr
+-c\tcheck ARRAY indexes, an index out of range stops the program
+-b\tselect only the base instructions of opcode.h, no superinstructions
+-g\twrite the line table of the image to output.lines, and its probes
+\tto output.probes, for prof.py
+-P\tlay out blocks and inline hot calls by the counts of profile, see prof.py -P
+-S\twrite assembly for asm.pl instead of the image
+-p\twrite the syntax tree instead of the image
+-t\twrite the image a top level declaration at a time, without opt.py, see
+\tstreaming.py
+-O\toptimization level, 0 disables optimizations, the default is 1
+-i\tinline calls to functions up to limit bytes, the default is {1}
+-o\twrite the result to output instead of stdout
+-s\tlisten on socket instead of $STRUCTLANG_SOCKET
+file\ta PROGRAM and the LIBRARY files it uses, libraries in dependency order"""
+
+# text, or image bytes through the binary buffer of out
+def write(x, output, out):
+    if output is not None:
+        with open(output, 'w' if isinstance(x, str) else 'wb') as f:
+            f.write(x);
+    elif isinstance(x, str):
+        out.write(x);
+    else:
+        out.flush();
+        out.buffer.write(x);
+        out.buffer.flush();
+
+def run(argv, cwd='.', out=None, err=None, cache=None):
+    import opt
+    out = out or sys.stdout;
+    err = err or sys.stderr;
+    try:
+        opts, args = getopt(argv[1:], 'hrcbgP:SptO:i:o:');
+    except GetoptError as e:
+        print(f"{argv[0]}: {e}", file=err);
+        return 1;
+    output = None; report = None; checked = False; fuse = True; lines = False; counts = None; level = 1; limit = opt.INLINE_LIMIT; form = 'image';
+    for opt_, arg in opts:
+        if opt_ == '-h':
+            print(USAGE.format(argv[0], opt.INLINE_LIMIT), file=err);
+            return 0;
+        if opt_ == '-r':
+            report = lambda x: print(x, file=err);
+        if opt_ == '-c':
+            checked = True;
+        if opt_ == '-b':
+            fuse = False;
+        if opt_ == '-g':
+            lines = True;
+        if opt_ == '-P':
+            counts = os.path.join(cwd, arg);
+        if opt_ in ('-S', '-p', '-t'):
+            form = {'-S': 'asm', '-p': 'tree', '-t': 'stream'}[opt_];
+        if opt_ == '-O':
+            if not arg.isdigit():
+                print(f"{argv[0]}: bad optimization level {arg}", file=err);
+                return 1;
+            level = int(arg);
+        if opt_ == '-i':
+            if not arg.isdigit():
+                print(f"{argv[0]}: bad inline limit {arg}", file=err);
+                return 1;
+            limit = int(arg);
+        if opt_ == '-o':
+            output = os.path.join(cwd, arg);
+    if lines and (output is None or form != 'image'):
+        print(f"{argv[0]}: -g needs -o and an image", file=err);
+        return 1;
+    if form == 'stream' and (output is None or lines or counts is not None):
+        print(f"{argv[0]}: -t needs -o, without -g or -P", file=err);
+        return 1;
+    if args == []:
+        print(USAGE.format(argv[0], opt.INLINE_LIMIT), file=err);
+        return 1;
+    try:
+        paths = [os.path.join(cwd, x) for x in args];
+        if form == 'stream':
+            import streaming
+            streaming.compile(paths, output, report, checked, level, fuse, cache);
+            return 0;
+        tree, units, profile = optimize(paths, cache, report, level, limit, lines, counts);
+        if form == 'tree':
+            write(str(tree) + '\n', output, out);
+            return 0;
+        if not isinstance(tree, Program):
+            die(f"{args[-1]}: no PROGRAM to compile");
+        import backend
+        image = backend.generate(tree, units, report, checked, level, fuse, profile);
+        write(image.text() if form == 'asm' else image.bytes(), output, out);
+        if lines:
+            files = {load_source(os.path.join(cwd, x), cache).tree.name.id: x for x in args};
+            write(image.lines(files), output + '.lines', out);
+            write(image.probes(profile), output + '.probes', out);
+    except (CompileError, OSError, UnicodeDecodeError) as e:
+        print(f"{argv[0]}: {e}", file=err);
+        return 1;
+    return 0
+
+def main(argv):
+    if argv[1:2] == ['serve']:
+        import server
+        return server.main(argv);
+    return run(argv);
+
+# run as the complr module, so other modules share its syntax classes
+if __name__ == '__main__':
+    import complr
+    sys.exit(complr.main(sys.argv))
@@ -0,0 +1,40 @@
+#! /usr/bin/env python
+
+# thin client of `complr.py serve', it takes the same command line as
+# complr.py, and falls back to compile in process if no server is running or
+# it closes without a reply
+
+import json
+import os
+import socket
+import sys
+
+def socket_path():
+    if path := os.environ.get('STRUCTLANG_SOCKET'):
+        return path;
+    rundir = os.environ.get('XDG_RUNTIME_DIR', '/tmp');
+    return os.path.join(rundir, f"structlang-{os.getuid()}.sock");
+
+def request(path, argv):
+    req = {'argv': argv, 'cwd': os.getcwd()};
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path);
+        sock.sendall(json.dumps(req).encode() + b'\n');
+        return json.loads(sock.makefile('rb').readline());
+
+def main(argv):
+    if argv[1:2] != ['serve']:
+        try:
+            res = request(socket_path(), argv);
+        except (OSError, ValueError):
+            res = None;
+        if res is not None:
+            sys.stdout.buffer.write(res['stdout'].encode('latin-1'));
+            sys.stdout.flush();
+            sys.stderr.write(res['stderr']);
+            return res['status'];
+    import complr
+    return complr.main(argv);
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
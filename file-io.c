@@ -10,9 +10,10 @@
 #include "utf64.h"
 #include "thread_local.h"
 
-const size_t FD_COUNT = 2048;
+#define FD_COUNT 2048
 
 FILE *fds[FD_COUNT];
+FILE *vm_out;
 
 int vm_file_io_init() {
   int i;
@@ -22,13 +23,51 @@ int vm_file_io_init() {
     fds[i++] = NULL;
   }
 
+  if (vm_out == NULL)
+    vm_out = stdout;
   fds[0] = stdin;
-  fds[1] = stdout;
+  fds[1] = vm_out;
   fds[2] = stderr;
 
   return 0;
 }
 
+// closes the files a program left open, for the next program of vmlib.py
+void vm_file_io_close(void) {
+  for (int i = 3; i < FD_COUNT; i++) {
+    if (fds[i] != NULL) {
+      fclose(fds[i]);
+      fds[i] = NULL;
+    }
+  }
+}
+
+static char  *captured;
+static size_t captured_len;
+
+// stdout of the c calls to memory, until vm_uncapture
+int vm_capture(void) {
+  FILE *f = open_memstream(&captured, &captured_len);
+  if (f == NULL)
+    return -1;
+  vm_out = fds[1] = f;
+  return 0;
+}
+
+const char *vm_captured(size_t *len) {
+  fflush(vm_out);
+  *len = captured_len;
+  return captured;
+}
+
+void vm_uncapture(void) {
+  fclose(vm_out);
+  free(captured);
+  captured = NULL;
+  captured_len = 0;
+  vm_out = fds[1] = stdout;
+}
+
 struct vmcharplist {
   struct vmcharplist *next;
   size_t cnt;
@@ -56,8 +95,8 @@ static char *collmb(uint64_t *str, char *maybe_buf, size_t maybe_buf_len) {
     if (ret < 0)
       goto error;
     str += ret;
-    cur->cnt = bufcnt;
-    cnt += bufcnt;
+    cur->cnt = sizeof(cur->buf) - bufcnt;
+    cnt += cur->cnt;
     if (*str == '\0')
       break;
     if ((cur->next = malloc(sizeof(struct vmcharplist))) == NULL)
@@ -105,8 +144,8 @@ uint64_t vm_fopen(struct machine *vm) {
   char _cname[BUFSIZ], *cname, _cmode[16], *cmode;
   FILE *f;
 
-  name = (uint64_t *)vm->uregs[3];
-  mode = (uint64_t *)vm->uregs[4];
+  name = &vm->mem[vm->uregs[3]];
+  mode = &vm->mem[vm->uregs[4]];
 
   fd = -1;
 
@@ -186,7 +225,7 @@ uint64_t vm_writetxt(struct machine *vm) {
   size_t bufcnt;
 
   fd = rc_u2i(vm->uregs[3]);
-  data = (uint64_t *)vm->uregs[4];
+  data = &vm->mem[vm->uregs[4]];
   len = vm->uregs[5];
 
   if (fd >= FD_COUNT)
@@ -202,6 +241,7 @@ uint64_t vm_writetxt(struct machine *vm) {
     transcnt = vm_mc64tomb(buf, &bufcnt, &data[wrtcnt], len - wrtcnt);
     if (transcnt < 0)
       return -1;
+    bufcnt = BUFSIZ - bufcnt;
     ret = fwrite(buf, sizeof(char), bufcnt, f);
     if (ret != bufcnt) {
       /* ignore truncated tail utf-8 bytes, count length */
@@ -219,7 +259,7 @@ uint64_t vm_writebytes(struct machine *vm) {
   uint64_t *data, len;
 
   fd = rc_u2i(vm->uregs[3]);
-  data = (uint64_t *)vm->uregs[4];
+  data = &vm->mem[vm->uregs[4]];
   len = vm->uregs[5];
 
   if (fd >= FD_COUNT)
@@ -252,7 +292,7 @@ uint64_t vm_readtxt(struct machine *vm) {
   FILE *f;
 
   fd = rc_u2i(vm->uregs[3]);
-  dst = (uint64_t *)vm->uregs[4];
+  dst = &vm->mem[vm->uregs[4]];
   len = vm->uregs[5];
 
   if (fd >= FD_COUNT)
@@ -298,7 +338,7 @@ uint64_t vm_readbytes(struct machine *vm) {
   uint64_t *dst, len;
 
   fd = rc_u2i(vm->uregs[3]);
-  dst = (uint64_t *)vm->uregs[4];
+  dst = &vm->mem[vm->uregs[4]];
   len = vm->uregs[5];
 
   if (fd >= FD_COUNT)
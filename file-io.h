@@ -4,7 +4,14 @@
 #include <stdint.h>
 #include "vm.h"
 
+// where the c calls write stdout, see vm_capture
+extern FILE *vm_out;
+
 int vm_file_io_init();
+void vm_file_io_close(void);
+int vm_capture(void);
+const char *vm_captured(size_t *len);
+void vm_uncapture(void);
 
 uint64_t vm_fopen(struct machine *vm);
 uint64_t vm_fclose(struct machine *vm);
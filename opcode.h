@@ -34,3 +34,29 @@ OPCODE(FDIV) // div(freg_t, freg_t) regs[$1] /= regs[$2]
 OPCODE(CALL) // call(ureg_t, ureg_t) regs[$1] = regs[$2](current_machine)
              // well, this is actually system call
 OPCODE(STOP) // STOP(ureg_t) stop the machine, return regs[$1]
+// superinstructions, each one does the work of a sequence of the above
+OPCODE(UADDI) // addi(ureg_t, ureg_t, iimm_t) regs[$1] = regs[$2] + $3
+OPCODE(ULDO) // ldo(reg_t, ureg_t, iimm_t) regs[$1] = mem[regs[$2] + $3]
+OPCODE(FLDO)
+OPCODE(USTO) // sto(ureg_t, iimm_t, reg_t) mem[regs[$1] + $2] = regs[$3]
+OPCODE(FSTO)
+OPCODE(ULDA) // lda(reg_t, uimm_t) regs[$1] = mem[$2]
+OPCODE(FLDA)
+OPCODE(USTA) // sta(uimm_t, reg_t) mem[$1] = regs[$2]
+OPCODE(FSTA)
+OPCODE(UEQBT) // xxbt(reg_t, reg_t, ptrdiff_t) compare as xx, then bt($3)
+OPCODE(UEQBF) // xxbf(reg_t, reg_t, ptrdiff_t) compare as xx, then bf($3)
+OPCODE(FEQBT)
+OPCODE(FEQBF)
+OPCODE(UGTBT)
+OPCODE(UGTBF)
+OPCODE(IGTBT)
+OPCODE(IGTBF)
+OPCODE(FGTBT)
+OPCODE(FGTBF)
+OPCODE(ULTBT)
+OPCODE(ULTBF)
+OPCODE(ILTBT)
+OPCODE(ILTBF)
+OPCODE(FLTBT)
+OPCODE(FLTBF)
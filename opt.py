@@ -0,0 +1,989 @@
+#! /usr/bin/env python
+
+# syntax tree level optimizations, they run after compile_sources and before
+# code generation
+
+from __future__ import annotations
+from dataclasses import dataclass, fields, replace
+from typing import Any
+from complr import *
+
+def children(node):
+    for f in fields(node):
+        yield from syntax_in(getattr(node, f.name));
+
+def syntax_in(x):
+    if isinstance(x, Syntax):
+        yield x;
+    elif isinstance(x, (list, tuple)):
+        for y in x:
+            yield from syntax_in(y);
+
+# rebuilds x bottom up, fn returns a replacement for a node or None to descend
+def transform(x, fn):
+    if isinstance(x, list):
+        return [transform(y, fn) for y in x];
+    if isinstance(x, tuple):
+        return tuple(transform(y, fn) for y in x);
+    if not isinstance(x, Syntax):
+        return x;
+    y = fn(x);
+    if y is not None:
+        return y;
+    return replace(x, **{f.name: transform(getattr(x, f.name), fn) for f in fields(x)});
+
+def descendants(x):
+    yield x;
+    for y in children(x):
+        yield from descendants(y);
+
+def labels_of(sttmt):
+    return {x.label for x in descendants(sttmt) if isinstance(x, LabelSttmt)};
+
+def arg_names(decl):
+    if decl.arglist is None:
+        return [];
+    return [x.id for d in decl.arglist.arglist for x in d.names];
+
+@dataclass
+class Binding:
+    kind: str   # var, const, func, type, arg or res
+    name: str
+    decl: Any
+    scope: Scope
+
+    def key(self):
+        return (id(self.decl), self.name);
+
+@dataclass
+class Scope:
+    owner: Program | Library | FuncDecl | ProcDecl | None
+    outer: Scope | None
+    names: dict
+    libs: dict
+    labels: set
+
+    def unitp(self):
+        return isinstance(self.owner, (Program, Library));
+
+    def depth(self):
+        return 0 if self.outer is None else self.outer.depth() + 1;
+
+class Resolver:
+    def __init__(self, libs={}):
+        self.world = Scope(None, None, {}, dict(libs), set());
+        self.scopes = {};
+
+    def scope(self, node, outer=None):
+        if id(node) in self.scopes:
+            return self.scopes[id(node)];
+        scope = Scope(node, outer or self.world, {}, {}, labels_of(node.body));
+        if isinstance(node, (FuncDecl, ProcDecl)):
+            for name in arg_names(node):
+                scope.names[name] = Binding('arg', name, node, scope);
+        if isinstance(node, FuncDecl):
+            scope.names[node.resvar.id] = Binding('res', node.resvar.id, node, scope);
+        for decl in node.decls:
+            if isinstance(decl, VarDecl):
+                for x in decl.names:
+                    scope.names[x.id] = Binding('var', x.id, decl, scope);
+            elif isinstance(decl, ConstDecl):
+                for x, _ in decl.binds:
+                    scope.names[x.id] = Binding('const', x.id, decl, scope);
+            elif isinstance(decl, TypeDecl):
+                for x, _ in decl.types:
+                    scope.names[x.id] = Binding('type', x.id, decl, scope);
+            elif isinstance(decl, (FuncDecl, ProcDecl)):
+                scope.names[decl.name.id] = Binding('func', decl.name.id, decl, scope);
+            elif isinstance(decl, Library):
+                scope.libs[decl.name.id] = decl;
+        self.scopes[id(node)] = scope;
+        return scope
+
+    def lookup(self, name, scope):
+        while scope is not None:
+            if name in scope.names:
+                return scope.names[name];
+            scope = scope.outer;
+        return None
+
+    def library(self, ids, scope):
+        while scope is not None and ids[0] not in scope.libs:
+            scope = scope.outer;
+        if scope is None:
+            return None;
+        for name in ids:
+            if name not in scope.libs:
+                return None;
+            scope = self.scope(scope.libs[name], scope);
+        return scope
+
+    def resolve(self, x, scope):
+        if isinstance(x, ID):
+            return self.lookup(x.id, scope);
+        lib = self.library(x.ids[:-1], scope);
+        return lib and lib.names.get(x.ids[-1]);
+
+    # the scope whose body holds the label
+    def label(self, x, scope):
+        if isinstance(x, IDInLib):
+            lib = self.library(x.ids[:-1], scope);
+            return lib if lib is not None and x.ids[-1] in lib.labels else None;
+        while scope is not None and x.id not in scope.labels:
+            scope = scope.outer;
+        return scope
+
+# estimated image size in virtual machine bytes, an instruction is an opcode
+# and two operands, and most syntax nodes lower to about one instruction
+INSN_BYTES = 3;
+FRAME_INSNS = 8;
+
+def code_size(node):
+    if isinstance(node, (Expr, Statement, LValue, Type)):
+        return sum(code_size(x) for x in children(node));
+    if isinstance(node, (FuncDecl, ProcDecl)):
+        return FRAME_INSNS * INSN_BYTES + code_size(node.body) + \
+            sum(code_size(d) for d in node.decls);
+    if isinstance(node, (VarDecl, TypeDecl)):
+        return 0;
+    if isinstance(node, ConstDecl):
+        return sum(const_size(val) for _, val in node.binds);
+    if isinstance(node, StrLit):
+        return INSN_BYTES + len(node.val) + 1;
+    return INSN_BYTES + sum(code_size(x) for x in children(node));
+
+def const_size(val):
+    if isinstance(val.expr, StrLit):
+        return len(val.expr.val) + 1;
+    return 1;
+
+def unit_size(unit, lookup):
+    size = code_size(unit.body);
+    for decl in unit.decls:
+        if isinstance(decl, VarDecl):
+            size += len(decl.names) * type_size(decl.type, lookup);
+        elif not isinstance(decl, Library):
+            size += code_size(decl);
+    return size
+
+# whole program reachability from the program body, following references to
+# functions, procedures, constants and variables, and GOTO into libraries
+def reachable(program, libs):
+    res = Resolver({name: iface.unit for name, iface in libs.items()});
+    reach = set(); work = [];
+    def mark(key, node, scope):
+        if key not in reach:
+            reach.add(key);
+            work.append((node, scope));
+    def use(b):
+        if b is None or b.kind in ('arg', 'res', 'type'):
+            return;
+        if not b.scope.unitp() and b.kind == 'var':
+            return;
+        if b.kind == 'func':
+            mark(b.key(), b.decl.body, res.scope(b.decl, b.scope));
+        elif b.kind == 'const':
+            val = next(v for i, v in b.decl.binds if i.id == b.name);
+            mark(b.key(), val, b.scope);
+        else:
+            reach.add(b.key());
+    def visit(x, scope):
+        if isinstance(x, Type):
+            return;
+        if isinstance(x, RecordAccessExpr):
+            return visit(x.rcd, scope);
+        if isinstance(x, GoToSttmt):
+            target = res.label(x.id, scope);
+            if target is not None and isinstance(target.owner, Library):
+                mark((id(target.owner), None), target.owner.body, target);
+            return;
+        if isinstance(x, (ID, IDInLib)):
+            return use(res.resolve(x, scope));
+        for y in children(x):
+            visit(y, scope);
+    work.append((program.body, res.scope(program)));
+    while work:
+        visit(*work.pop());
+    return reach
+
+def prune(unit, reach):
+    decls = [];
+    for decl in unit.decls:
+        if isinstance(decl, (FuncDecl, ProcDecl)):
+            if (id(decl), decl.name.id) in reach:
+                decls.append(prune(decl, reach));
+        elif isinstance(decl, ConstDecl):
+            binds = [(i, v) for i, v in decl.binds if (id(decl), i.id) in reach];
+            if binds:
+                decls.append(replace(decl, binds=binds));
+        elif isinstance(decl, VarDecl) and isinstance(unit, (Program, Library)):
+            names = [i for i in decl.names if (id(decl), i.id) in reach];
+            if names:
+                decls.append(replace(decl, names=names));
+        elif isinstance(decl, Library):
+            lib = prune(decl, reach);
+            if lib is not None:
+                decls.append(lib);
+        else:
+            decls.append(decl);
+    if not isinstance(unit, Library):
+        return replace(unit, decls=decls);
+    body = unit.body;
+    if (id(unit), None) not in reach:
+        if all(isinstance(d, TypeDecl) for d in decls):
+            return None;
+        body = Statement(body.line, VoidSttmt(body.line));
+    return replace(unit, decls=decls, body=body)
+
+# returns the pruned program and libraries, and reports bytes saved per library
+def shake(program, libs, report=None):
+    reach = reachable(program.unit, libs);
+    def saved(name, iface, unit, outer=None):
+        if report is None:
+            return;
+        lookup = type_lookup(iface.layouts, {**libs, **iface.libs}, outer);
+        before = unit_size(iface.unit, lookup);
+        after = 0 if unit is None else unit_size(unit, lookup);
+        report(f"shake: {name}: {before - after} of {before} bytes saved");
+        for sub, subface in iface.libs.items():
+            subunit = None;
+            if unit is not None:
+                subunit = next((d for d in unit.decls
+                                if isinstance(d, Library) and d.name.id == sub), None);
+            saved(f"{name}.{sub}", subface, subunit, lookup);
+    tree = prune(program.unit, reach);
+    saved(program.name, program, tree);
+    units = {};
+    for name, iface in libs.items():
+        units[name] = prune(iface.unit, reach);
+        saved(name, iface, units[name]);
+    return tree, units
+
+def lib_path(scope):
+    path = [];
+    while isinstance(scope.owner, Library):
+        path.insert(0, scope.owner.name.id);
+        scope = scope.outer;
+    return path
+
+# the unit and the libraries in it, with their scopes
+def units_in(unit, scope, res, acc):
+    acc.append((unit, scope));
+    for decl in unit.decls:
+        if isinstance(decl, Library):
+            units_in(decl, res.scope(decl, scope), res, acc);
+    return acc
+
+# every FUNCTION and PROCEDURE of the units, with their scopes
+def functions(unit, scope, res, acc):
+    for decl in unit.decls:
+        if isinstance(decl, (FuncDecl, ProcDecl)):
+            inner = res.scope(decl, scope);
+            acc.append((decl, inner));
+            functions(decl, inner, res, acc);
+        elif isinstance(decl, Library):
+            functions(decl, res.scope(decl, scope), res, acc);
+    return acc
+
+def references(node, scope, res):
+    refs = [];
+    def visit(x):
+        if isinstance(x, Type):
+            return;
+        if isinstance(x, RecordAccessExpr):
+            return visit(x.rcd);
+        if isinstance(x, (ID, IDInLib)):
+            b = res.resolve(x, scope);
+            if b is not None:
+                refs.append(b);
+            return;
+        for y in children(x):
+            visit(y);
+    visit(node);
+    return refs
+
+# strongly connected components, callees before callers
+def components(nodes, edges):
+    index = {}; low = {}; stack = []; onstack = set(); sccs = [];
+    def connect(v):
+        index[v] = low[v] = len(index);
+        stack.append(v); onstack.add(v);
+        for w in edges[v]:
+            if w not in index:
+                connect(w);
+                low[v] = min(low[v], low[w]);
+            elif w in onstack:
+                low[v] = min(low[v], index[w]);
+        if low[v] == index[v]:
+            scc = [];
+            while True:
+                w = stack.pop(); onstack.discard(w);
+                scc.append(w);
+                if w == v:
+                    break;
+            sccs.append(scc);
+    for v in nodes:
+        if v not in index:
+            connect(v);
+    return sccs
+
+# the PROGRAM or LIBRARY file a scope is in
+def file_of(scope):
+    while scope.outer is not None and scope.outer.owner is not None:
+        scope = scope.outer;
+    return scope.owner
+
+# x with every line at line, code inlined from another file has the lines
+# of the call in the line table
+def moved(x, line):
+    return replace(x, **{f.name: line if f.name == 'line' else
+                         transform(getattr(x, f.name), lambda y: moved(y, line))
+                         for f in fields(x)})
+
+class NoInline(Exception):
+    pass
+
+# statement level calls, `f(x)' or `y := f(x)', can be inlined
+def call_site(sttmt):
+    x = sttmt.statement;
+    if isinstance(x, ExprSttmt) and isinstance(x.expr.expr, CallExpr):
+        return x.expr.expr, None;
+    if isinstance(x, AssignmentSttmt) and len(x.expr.names) == 1 and \
+       isinstance(getattr(x.expr.vals[0], 'expr', None), CallExpr):
+        return x.expr.vals[0].expr, x.expr.names[0];
+    return None, None
+
+INLINE_LIMIT = 48;
+HOT_INLINE = 4;  # a hot call, by the profile, may be this many times bigger
+
+# inlines small non recursive calls, a call costs about a frame setup and
+# a move per argument, a callee called once may be four times bigger, and
+# so may a callee at a hot line of the profile
+def inline(program, libs, limit=INLINE_LIMIT, report=None, profile=None):
+    units = {name: iface.unit for name, iface in libs.items()};
+    res = Resolver(units);
+    top = []; funcs = [];
+    for unit in [program.unit] + list(units.values()):
+        units_in(unit, res.scope(unit), res, top);
+        functions(unit, res.scope(unit), res, funcs);
+    scopes = {id(f): scope for f, scope in funcs};
+    decls = {id(f): f for f, _ in funcs};
+    edges = {}; uses = {};
+    for f, scope in funcs:
+        edges[id(f)] = [];
+        for b in references(f.body, scope, res):
+            if b.kind == 'func':
+                edges[id(f)].append(id(b.decl));
+    for unit, scope in top + funcs:
+        for b in references(unit.body, scope, res):
+            if b.kind == 'func':
+                uses[id(b.decl)] = uses.get(id(b.decl), 0) + 1;
+    sccs = components(list(edges), edges);
+    recursive = set();
+    for scc in sccs:
+        if len(scc) > 1 or scc[0] in edges[scc[0]]:
+            recursive.update(scc);
+    bodies = {}; fresh = {}; count = 0;
+    def current(f):
+        body = bodies.get(id(f), f.body);
+        return replace(f, decls=f.decls + fresh.get(id(f), []), body=body);
+    def relocate(x, b, site):
+        if b is not None and b.scope.unitp() and isinstance(b.scope.owner, Library):
+            y = IDInLib(x.line, lib_path(b.scope) + [b.name]);
+            at = res.resolve(y, site);
+            if at is not None and at.key() == b.key():
+                return y;
+        raise NoInline(f"{x.id if isinstance(x, ID) else '.'.join(x.ids)} "
+                       f"is not visible at the call site");
+    def inline_call(f, site, g, call, target):
+        nonlocal count
+        whole = current(g);
+        for d in whole.decls:
+            if not isinstance(d, (VarDecl, ConstDecl)):
+                raise NoInline("has nested declarations");
+        if any(isinstance(x, (LabelSttmt, GoToSttmt)) for x in descendants(whole.body)):
+            raise NoInline("has labels or GOTO");
+        params = [] if g.arglist is None else g.arglist.arglist;
+        if len(call.args) != sum(len(d.names) for d in params):
+            raise NoInline("argument count mismatch");
+        gscope = res.scope(whole, scopes[id(g)].outer);
+        count += 1;
+        names = {name: f"{g.name.id}__{count}__{name}"
+                 for name, b in gscope.names.items() if b.scope is gscope};
+        def rename(x):
+            if isinstance(x, VarDecl):
+                return replace(x, type=transform(x.type, rename));
+            if isinstance(x, RecordAccessExpr):
+                return replace(x, rcd=transform(x.rcd, rename));
+            if not isinstance(x, (ID, IDInLib)):
+                return None;
+            b = res.resolve(x, gscope);
+            if b is not None and b.scope is gscope:
+                return ID(x.line, names[b.name]);
+            at = res.resolve(x, site);
+            if (b is None and at is None) or \
+               (b is not None and at is not None and at.key() == b.key()):
+                return x;
+            return relocate(x, b, site);
+        news = [];
+        for d in params:
+            news.append(VarDecl(d.line, [ID(i.line, names[i.id]) for i in d.names],
+                                transform(d.type, rename)));
+        if isinstance(g, FuncDecl):
+            news.append(VarDecl(g.line, [ID(g.resvar.line, names[g.resvar.id])],
+                                transform(g.resvartype, rename)));
+        for d in whole.decls:
+            if isinstance(d, VarDecl):
+                news.append(VarDecl(d.line, [ID(i.line, names[i.id]) for i in d.names],
+                                    transform(d.type, rename)));
+            else:
+                news.append(ConstDecl(d.line, [(ID(i.line, names[i.id]), transform(v, rename))
+                                               for i, v in d.binds]));
+        line = call.line;
+        sttmts = [];
+        if call.args:
+            argnames = [LValue(line, Expr(line, ID(line, names[i.id])))
+                        for d in params for i in d.names];
+            sttmts.append(Statement(line, AssignmentSttmt(
+                line, Assignment(line, argnames, call.args))));
+        body = transform(whole.body, rename);
+        if file_of(gscope) is not file_of(site):
+            body = transform(body, lambda x: moved(x, line));
+        sttmts.append(body);
+        if target is not None and isinstance(g, FuncDecl):
+            res_ = Expr(line, ID(line, names[g.resvar.id]));
+            sttmts.append(Statement(line, AssignmentSttmt(
+                line, Assignment(line, [target], [res_]))));
+        fresh.setdefault(id(f), []).extend(news);
+        return Statement(line, BeginSttmt(line, sttmts));
+    def rewrite(f, site):
+        def visit(x):
+            if not isinstance(x, Statement):
+                return None;
+            call, target = call_site(x);
+            if call is None:
+                return None;
+            b = res.resolve(call.func.expr, site) \
+                if isinstance(call.func.expr, (ID, IDInLib)) else None;
+            if b is None or b.kind != 'func':
+                return None;
+            g = b.decl;
+            size = code_size(current(g).body);
+            hot = profile is not None and profile.hot(file_of(site).name.id, call.line);
+            most = limit * HOT_INLINE if hot else limit;
+            why = None;
+            if id(g) in recursive:
+                why = "recursive";
+            elif size > most and not (uses.get(id(g)) == 1 and size <= 4 * limit):
+                why = f"too big, {size} > {most} bytes";
+            if why is None:
+                try:
+                    y = inline_call(f, site, g, call, target);
+                except NoInline as e:
+                    why = str(e);
+            if report is not None:
+                what = "inlined" if why is None else f"not inlined, {why}";
+                what += ", hot" if hot else "";
+                report(f"inline: {f.name.id} @ {call.line}: {g.name.id}: {what}");
+            return None if why is not None else y;
+        bodies[id(f)] = transform(bodies.get(id(f), f.body), visit);
+    for scc in sccs:
+        for v in scc:
+            rewrite(decls[v], scopes[v]);
+    for unit, scope in top:
+        rewrite(unit, scope);
+    def assemble(unit):
+        ds = [];
+        for d in unit.decls:
+            ds.append(assemble(d) if isinstance(d, (FuncDecl, ProcDecl, Library)) else d);
+        return replace(unit, decls=ds + fresh.get(id(unit), []),
+                       body=bodies.get(id(unit), unit.body));
+    news = {};
+    for name, unit in units.items():
+        news[name] = interface(assemble(unit), news);
+    return interface(assemble(program.unit), news), news
+
+def root_of(x):
+    while True:
+        if isinstance(x, (Expr, LValue)):
+            x = x.expr;
+        elif isinstance(x, ArrAccessExpr):
+            x = x.base;
+        elif isinstance(x, RecordAccessExpr):
+            x = x.rcd;
+        else:
+            return x if isinstance(x, (ID, IDInLib)) else None;
+
+# the lvalues a node assigns to or takes the address of
+def written(x):
+    if isinstance(x, Assignment):
+        return x.names;
+    if isinstance(x, (IterateAsForClause, IterateByForClause)):
+        return [x.var];
+    if isinstance(x, RefExpr):
+        return [x.expr];
+    return [];
+
+# calls fn(x, binding, site, call) for every name used in a function and its
+# nested declarations, call is the CallExpr when x is called directly, and
+# calls fw(binding, x) for every name the node x assigns to or references
+# with `@'
+def scan(f, scope, res, fn, fw=None):
+    def visit(x, site):
+        if isinstance(x, RecordAccessExpr):
+            return visit(x.rcd, site);
+        if isinstance(x, GoToSttmt):
+            return;
+        if isinstance(x, Type):
+            t = x.type;
+            if isinstance(t, (ID, IDInLib)):
+                return fn(t, res.resolve(t, site), site, None);
+            if isinstance(t, Record):
+                return visit([d.type for d in t.types], site);
+            return visit(t.type, site);
+        if fw is not None:
+            for lv in written(x):
+                if (r := root_of(lv)) is not None and (b := res.resolve(r, site)):
+                    fw(b, x);
+        if isinstance(x, CallExpr) and isinstance(x.func.expr, (ID, IDInLib)):
+            fn(x.func.expr, res.resolve(x.func.expr, site), site, x);
+            return visit(x.args, site);
+        if isinstance(x, (ID, IDInLib)):
+            return fn(x, res.resolve(x, site), site, None);
+        for y in syntax_in(x) if isinstance(x, list) else children(x):
+            visit(y, site);
+    for d in f.decls:
+        if isinstance(d, (FuncDecl, ProcDecl)):
+            scan(d, res.scope(d, scope), res, fn, fw);
+        elif isinstance(d, VarDecl):
+            visit(d.type, scope);
+        elif isinstance(d, ConstDecl):
+            visit([v for _, v in d.binds], scope);
+        elif isinstance(d, TypeDecl):
+            visit([t for _, t in d.types], scope);
+    if f.arglist is not None:
+        visit([d.type for d in f.arglist.arglist], scope);
+    if isinstance(f, FuncDecl):
+        visit(f.resvartype, scope);
+    visit(f.body, scope);
+
+def type_of(b):
+    if b.kind == 'res':
+        return b.decl.resvartype;
+    if b.kind == 'arg':
+        return next(d.type for d in b.decl.arglist.arglist
+                    if any(x.id == b.name for x in d.names));
+    return b.decl.type;
+
+LIFT_ARGS = 4;
+
+# lifts nested functions to the unit level, a function that captures no
+# variable of the functions around it just moves, one that reads a few of
+# them, fitting in the argument registers with its own arguments, gets them
+# as extra arguments, in both cases the static chain is no longer needed
+def lift(program, libs, report=None):
+    units = {name: iface.unit for name, iface in libs.items()};
+    res = Resolver(units);
+    top = []; funcs = [];
+    for unit in [program.unit] + list(units.values()):
+        units_in(unit, res.scope(unit), res, top);
+        functions(unit, res.scope(unit), res, funcs);
+    def enclosing(scope):
+        encl = [];
+        scope = scope.outer;
+        while isinstance(scope.owner, (FuncDecl, ProcDecl)):
+            encl.append(id(scope));
+            scope = scope.outer;
+        return encl, scope;
+    nested = {}; sites = {}; valuep = set();
+    for g, scope in funcs:
+        encl, unit = enclosing(scope);
+        if not encl:
+            continue;
+        info = nested[id(g)] = {'decl': g, 'scope': scope, 'unit': unit,
+                                'free': {}, 'calls': set(), 'writes': set(),
+                                'why': None};
+        def use(x, b, site, call, info=info, encl=encl, g=g):
+            if b is None or id(b.scope) not in encl:
+                return;
+            if b.kind == 'func':
+                info['calls'].add(id(b.decl));
+            elif b.kind in ('const', 'type'):
+                info['why'] = f"uses {b.name} of {b.scope.owner.name.id}";
+            else:
+                info['free'][b.key()] = b;
+        def write(b, x, info=info, encl=encl):
+            if id(b.scope) in encl:
+                info['writes'].add(b.key());
+        scan(g, scope, res, use, write);
+        def jump(x, site=scope, info=info, encl=encl):
+            for y in descendants(x):
+                if isinstance(y, GoToSttmt):
+                    target = res.label(y.id, site);
+                    if target is not None and id(target) in encl:
+                        info['why'] = f"jumps out to {target.owner.name.id}";
+        jump(g.body);
+    def site_of(x, b, site, call):
+        if b is not None and b.kind == 'func' and id(b.decl) in nested:
+            if call is None:
+                valuep.add(id(b.decl));
+            else:
+                sites.setdefault(id(b.decl), []).append(site);
+    for f, scope in funcs:
+        if not isinstance(scope.outer.owner, (FuncDecl, ProcDecl)):
+            scan(f, scope, res, site_of);
+    changed = True;
+    while changed:
+        changed = False;
+        for info in nested.values():
+            encl, _ = enclosing(info['scope']);
+            for h in info['calls']:
+                for k, b in nested[h]['free'].items() if h in nested else ():
+                    if k not in info['free'] and id(b.scope) in encl:
+                        info['free'][k] = b; changed = True;
+                for k in nested[h]['writes'] if h in nested else ():
+                    if k not in info['writes']:
+                        info['writes'].add(k); changed = True;
+    # the variables whose address @ takes in a function or the functions
+    # nested in it, a copy passed in an argument would miss the writes to it
+    scopes = {id(f): scope for f, scope in funcs}; refs = {};
+    def taken_in(f):
+        if id(f) not in refs:
+            keys = refs[id(f)] = set();
+            def ref(b, x):
+                if isinstance(x, RefExpr):
+                    keys.add(b.key());
+            scan(f, scopes[id(f)], res, lambda *_: None, ref);
+        return refs[id(f)]
+    def check(info):
+        g = info['decl']; free = info['free'];
+        if info['why'] is not None:
+            return info['why'];
+        for k, b in free.items():
+            if k in info['writes']:
+                return f"assigns {b.name} of {b.scope.owner.name.id}";
+            if k in taken_in(b.scope.owner):
+                return f"{b.scope.owner.name.id} takes @{b.name}";
+        if not free:
+            return None;
+        if len(arg_names(g)) + len(free) > LIFT_ARGS:
+            return f"captures {len(free)} variables";
+        if id(g) in valuep:
+            return "used as a value";
+        for site in sites.get(id(g), []):
+            for b in free.values():
+                at = res.lookup(b.name, site);
+                if at is None or at.key() != b.key():
+                    return f"{b.name} is shadowed at a call site";
+        for b in free.values():
+            for t in descendants(type_of(b)):
+                if isinstance(t, Type) and isinstance(t.type, (ID, IDInLib)):
+                    here = res.resolve(t.type, b.scope);
+                    there = res.resolve(t.type, info['unit']);
+                    if (here and here.key()) != (there and there.key()):
+                        return f"the type of {b.name} is local";
+        return None;
+    changed = True;
+    while changed:
+        changed = False;
+        for info in nested.values():
+            if info['why'] is None and (why := check(info)) is not None:
+                info['why'] = why; changed = True;
+            if info['why'] is None:
+                for h in info['calls']:
+                    if h in nested and nested[h]['why'] is not None:
+                        info['why'] = f"calls {nested[h]['decl'].name.id}, which is kept";
+                        changed = True;
+                        break;
+    names = {};
+    for info in nested.values():
+        if info['why'] is not None:
+            continue;
+        path = []; scope = info['scope'];
+        while isinstance(scope.owner, (FuncDecl, ProcDecl)):
+            path.insert(0, scope.owner.name.id);
+            scope = scope.outer;
+        name = '__'.join(path); n = 0;
+        while name in info['unit'].names or name in names.values():
+            n += 1;
+            name = f"{'__'.join(path)}__{n}";
+        names[id(info['decl'])] = name;
+    if report is not None:
+        for info in nested.values():
+            g = info['decl'];
+            if info['why'] is not None:
+                report(f"lift: {g.name.id} @ {g.line}: kept, {info['why']}");
+            elif info['free']:
+                extra = ', '.join(b.name for b in info['free'].values());
+                report(f"lift: {g.name.id} @ {g.line}: lifted to {names[id(g)]} with {extra}");
+            else:
+                report(f"lift: {g.name.id} @ {g.line}: closed, lifted to {names[id(g)]}");
+    def rewrite(node, site):
+        def fn(x):
+            if isinstance(x, (RecordAccessExpr, GoToSttmt)):
+                return replace(x, rcd=transform(x.rcd, fn)) \
+                    if isinstance(x, RecordAccessExpr) else x;
+            if isinstance(x, CallExpr) and isinstance(x.func.expr, ID):
+                b = res.lookup(x.func.expr.id, site);
+                if b is not None and b.kind == 'func' and id(b.decl) in names:
+                    func = Expr(x.func.line, ID(x.func.expr.line, names[id(b.decl)]));
+                    extra = [Expr(x.line, ID(x.line, c.name))
+                             for c in nested[id(b.decl)]['free'].values()];
+                    return CallExpr(x.line, func, transform(x.args, fn) + extra);
+            if isinstance(x, ID):
+                b = res.lookup(x.id, site);
+                if b is not None and b.kind == 'func' and id(b.decl) in names:
+                    return ID(x.line, names[id(b.decl)]);
+            return None;
+        return transform(node, fn);
+    def rebuild(f, scope, hoisted):
+        decls = [];
+        for d in f.decls:
+            if isinstance(d, (FuncDecl, ProcDecl)):
+                nd = rebuild(d, res.scope(d, scope), hoisted);
+                (hoisted if id(d) in names else decls).append(nd);
+            elif isinstance(d, ConstDecl):
+                decls.append(rewrite(d, scope));
+            else:
+                decls.append(d);
+        new = replace(f, decls=decls, body=rewrite(f.body, scope));
+        if id(f) in names:
+            extra = [VarDecl(f.line, [ID(f.line, b.name)], type_of(b))
+                     for b in nested[id(f)]['free'].values()];
+            args = f.arglist.arglist if f.arglist is not None else [];
+            arglist = ArgList(f.line, args + extra) if extra else f.arglist;
+            new = replace(new, name=ID(f.name.line, names[id(f)]), arglist=arglist);
+        return new
+    def rebuild_unit(unit, scope):
+        decls = [];
+        for d in unit.decls:
+            if isinstance(d, (FuncDecl, ProcDecl)):
+                hoisted = [];
+                nd = rebuild(d, res.scope(d, scope), hoisted);
+                decls.extend(hoisted);
+                decls.append(nd);
+            elif isinstance(d, Library):
+                decls.append(rebuild_unit(d, res.scope(d, scope)));
+            elif isinstance(d, ConstDecl):
+                decls.append(rewrite(d, scope));
+            else:
+                decls.append(d);
+        return replace(unit, decls=decls, body=rewrite(unit.body, scope));
+    news = {};
+    for name, unit in units.items():
+        news[name] = interface(rebuild_unit(unit, res.scope(unit)), news);
+    return interface(rebuild_unit(program.unit, res.scope(program.unit)), news), news
+
+# calls fn(binding, ctx, site, x) for every name used in a function and its
+# nested declarations, and fn(binding, ('ref', ctx), site, x) for every `@'
+# of a name, the context ctx is 'deref', 'field' or 'index' when only what
+# the name points to or a part of it is used, ('arg', callee, n) when it is
+# the nth argument of a direct call, 'target' when it is assigned to as a
+# whole, and 'value' otherwise
+def contexts(f, scope, res, fn):
+    def visit(x, ctx, site):
+        if isinstance(x, list):
+            for y in x:
+                visit(y, ctx, site);
+        elif isinstance(x, (Expr, LValue)):
+            visit(x.expr, ctx, site);
+        elif isinstance(x, DerefExpr):
+            visit(x.expr, 'deref', site);
+        elif isinstance(x, RecordAccessExpr):
+            visit(x.rcd, 'field', site);
+        elif isinstance(x, ArrAccessExpr):
+            visit(x.base, 'index', site);
+            visit(x.idx, 'value', site);
+        elif isinstance(x, RefExpr):
+            if (r := root_of(x.expr)) is not None and (b := res.resolve(r, site)):
+                fn(b, ('ref', ctx), site, x);
+            visit(x.expr, 'ref', site);
+        elif isinstance(x, CallExpr):
+            b = None;
+            if isinstance(x.func.expr, (ID, IDInLib)):
+                b = res.resolve(x.func.expr, site);
+            if b is not None and b.kind == 'func':
+                fn(b, 'call', site, x);
+                for n, y in enumerate(x.args):
+                    visit(y, ('arg', b.decl, n), site);
+            else:
+                visit(x.func, 'value', site);
+                visit(x.args, 'value', site);
+        elif isinstance(x, Assignment):
+            visit(x.names, 'target', site);
+            visit(x.vals, 'value', site);
+        elif isinstance(x, (IterateAsForClause, IterateByForClause)):
+            visit(x.var, 'target', site);
+            visit(x.expr, 'value', site);
+        elif isinstance(x, (ID, IDInLib)):
+            if (b := res.resolve(x, site)) is not None:
+                fn(b, ctx, site, x);
+        elif isinstance(x, (GoToSttmt, Type)):
+            pass;
+        elif isinstance(x, Syntax):
+            for y in children(x):
+                visit(y, 'value', site);
+    for d in f.decls:
+        if isinstance(d, (FuncDecl, ProcDecl)):
+            contexts(d, res.scope(d, scope), res, fn);
+        elif isinstance(d, ConstDecl):
+            visit([v for _, v in d.binds], 'value', scope);
+    visit(f.body, 'value', scope);
+
+def record_of(type, scope, res):
+    for _ in range(16):
+        if not isinstance(type.type, (ID, IDInLib)):
+            break;
+        b = res.resolve(type.type, scope);
+        if b is None or b.kind != 'type':
+            return None, None;
+        type = next(t for x, t in b.decl.types if x.id == b.name);
+        scope = b.scope;
+    return (type.type, scope) if isinstance(type.type, Record) else (None, None)
+
+LOCAL_CTXS = ('deref', 'field', 'index');
+
+def kept(keeps, g, n):
+    return n >= len(arg_names(g)) or (id(g), n) in keeps
+
+# an address used in ctx outlives the statement using it, unless it is only
+# dereferenced, or passed to an argument the callee doesn't keep
+def escaping(ctx, keeps):
+    return not (ctx in LOCAL_CTXS or (isinstance(ctx, tuple) and
+                                      ctx[0] == 'arg' and not kept(keeps, ctx[1], ctx[2])))
+
+# the uses of the names in each function, and which arguments each callee
+# keeps, optimistic until proven otherwise
+def arguments(funcs, res):
+    events = {id(f): [] for f, _ in funcs};
+    for f, scope in funcs:
+        contexts(f, scope, res, lambda b, ctx, site, x, f=f: events[id(f)].append((b, ctx, x)));
+    keeps = set(); changed = True;
+    while changed:
+        changed = False;
+        for f, _ in funcs:
+            params = arg_names(f);
+            for b, ctx, x in events[id(f)]:
+                if b.kind != 'arg' or b.decl is not f or (id(f), params.index(b.name)) in keeps:
+                    continue;
+                if ctx in LOCAL_CTXS + ('target',) or \
+                   (isinstance(ctx, tuple) and ctx[0] == 'arg' and not kept(keeps, ctx[1], ctx[2])):
+                    continue;
+                keeps.add((id(f), params.index(b.name)));
+                changed = True;
+    return events, keeps
+
+# the keys of the locals whose address @ takes and never lets escape, a
+# callee only uses such an address while it runs, so backend.Gen still
+# renames the local in SSA and shares its words with other slots
+def unescaped(program, units, res):
+    funcs = []; local = {};
+    for unit in [program] + [u for u in units.values() if u is not None]:
+        functions(unit, res.scope(unit), res, funcs);
+    events, keeps = arguments(funcs, res);
+    for f, scope in funcs:
+        for b, ctx, x in events[id(f)]:
+            if b.scope is scope and b.kind in ('var', 'arg', 'res') and \
+               isinstance(ctx, tuple) and ctx[0] == 'ref':
+                local[b.key()] = local.get(b.key(), True) and not escaping(ctx[1], keeps);
+    return {k for k, v in local.items() if v}
+
+# escape analysis of the `@' of locals: an address only dereferenced on the
+# spot, or only passed to arguments the callee doesn't keep, doesn't escape,
+# see unescaped, and a RECORD local only used by fields is replaced by a
+# local per field
+def escape(program, libs, report=None):
+    units = {name: iface.unit for name, iface in libs.items()};
+    def unref(x):
+        if isinstance(x, DerefExpr) and isinstance(x.expr.expr, RefExpr):
+            return transform(x.expr.expr.expr.expr, unref);
+        return None;
+    prog = transform(program.unit, unref);
+    units = {name: transform(unit, unref) for name, unit in units.items()};
+    res = Resolver(units);
+    funcs = [];
+    for unit in [prog] + list(units.values()):
+        functions(unit, res.scope(unit), res, funcs);
+    events, keeps = arguments(funcs, res);
+    splits = {};
+    for f, scope in funcs:
+        if report is None and not f.decls:
+            continue;
+        refs = {}; whole = set();
+        for b, ctx, x in events[id(f)]:
+            if b.scope is not scope or b.kind not in ('var', 'arg', 'res'):
+                continue;
+            if isinstance(ctx, tuple) and ctx[0] == 'ref':
+                refs.setdefault(b.name, []).append((x.line, escaping(ctx[1], keeps)));
+            elif ctx != 'field':
+                whole.add(b.name);
+        for b in scope.names.values():
+            if b.kind != 'var' or b.name in whole:
+                continue;
+            rcd, rscope = record_of(b.decl.type, scope, res);
+            if rcd is None:
+                continue;
+            fields = [(x.id, d.type) for d in rcd.types for x in d.names];
+            def same(t):
+                for y in descendants(t):
+                    if isinstance(y, Type) and isinstance(y.type, (ID, IDInLib)):
+                        here = res.resolve(y.type, rscope);
+                        there = res.resolve(y.type, scope);
+                        if (here and here.key()) != (there and there.key()):
+                            return False;
+                return True;
+            if all(same(t) for _, t in fields):
+                splits[b.key()] = (b, {x: f"{b.name}__{x}" for x, _ in fields}, fields);
+        if report is None:
+            continue;
+        for name, uses in refs.items():
+            out = [line for line, escapes in uses if escapes];
+            if out:
+                where = ', '.join(str(line) for line in out);
+                report(f"escape: {f.name.id}: @{name} escapes @ {where}");
+            else:
+                report(f"escape: {f.name.id}: @{name} doesn't escape");
+        for key, (b, names, _) in splits.items():
+            if b.scope is scope:
+                report(f"escape: {f.name.id}: {b.name} is replaced by "
+                       f"{', '.join(names.values())}");
+    def rewrite(f, scope):
+        def fn(x, site):
+            if isinstance(x, RecordAccessExpr) and isinstance(x.rcd.expr, ID):
+                b = res.lookup(x.rcd.expr.id, site);
+                if b is not None and b.key() in splits and x.id.id in splits[b.key()][1]:
+                    return ID(x.line, splits[b.key()][1][x.id.id]);
+            if isinstance(x, RecordAccessExpr):
+                return replace(x, rcd=transform(x.rcd, lambda y: fn(y, site)));
+            return None;
+        decls = [];
+        for d in f.decls:
+            if isinstance(d, (FuncDecl, ProcDecl)):
+                d = rewrite(d, res.scope(d, scope));
+            elif isinstance(d, VarDecl) and isinstance(f, (FuncDecl, ProcDecl)):
+                keep = [];
+                for x in d.names:
+                    if (id(d), x.id) not in splits:
+                        keep.append(x);
+                        continue;
+                    _, names, fields = splits[(id(d), x.id)];
+                    for name, type in fields:
+                        decls.append(VarDecl(d.line, [ID(x.line, names[name])], type));
+                if not keep:
+                    continue;
+                d = replace(d, names=keep);
+            decls.append(d);
+        return replace(f, decls=decls, body=transform(f.body, lambda y: fn(y, scope)));
+    def rebuild(unit, scope):
+        decls = [];
+        for d in unit.decls:
+            if isinstance(d, (FuncDecl, ProcDecl)):
+                d = rewrite(d, res.scope(d, scope));
+            elif isinstance(d, Library):
+                d = rebuild(d, res.scope(d, scope));
+            decls.append(d);
+        return replace(unit, decls=decls);
+    news = {};
+    for name, unit in units.items():
+        news[name] = interface(rebuild(unit, res.scope(unit)), news);
+    return interface(rebuild(prog, res.scope(prog)), news), news
@@ -0,0 +1,263 @@
+#! /usr/bin/env python
+
+# profile guided optimization, the counts of runs of vm-prof -c at the source
+# lines of each function and the blocks of its three address code, see
+# PROFILES in README
+
+from __future__ import annotations
+import hashlib
+import re
+from dataclasses import fields, replace
+from complr import Syntax, FuncDecl, ProcDecl, Library, die
+from backend import Slot, Frame, CType
+from ssa import ENDS, BRANCHES, QUIET
+from opt import descendants
+
+HOT = 100;  # a line is hot with a hundredth of the count of the hottest
+LABEL = re.compile(r'L[0-9]+');
+
+def relative(x, base):
+    if isinstance(x, list):
+        return [relative(y, base) for y in x];
+    if isinstance(x, tuple):
+        return tuple(relative(y, base) for y in x);
+    if not isinstance(x, Syntax):
+        return x;
+    return replace(x, **{f.name: x.line - base if f.name == 'line' else
+                         relative(getattr(x, f.name), base) for f in fields(x)})
+
+def digest(x):
+    return hashlib.sha1(str(x).encode()).hexdigest()[:16]
+
+# (first line, last line, name, digest, base) of the functions of a unit,
+# their lines and digests are relative to base, the line of the declaration
+def spans(unit, acc):
+    for d in unit.decls:
+        if isinstance(d, (FuncDecl, ProcDecl)):
+            last = max(x.line for x in descendants(d));
+            acc.append((d.line, last, d.name.id, digest(relative(d, d.line)), d.line));
+            spans(d, acc);
+        elif isinstance(d, Library):
+            spans(d, acc);
+    return acc
+
+# a profile is a count per key, (kind, unit, function, digest, n), where n is
+# a line of a function for 'line', and a block of its code for 'block'
+def read(path):
+    counts = {};
+    with open(path) as f:
+        for text in f:
+            xs = text.split();
+            if len(xs) != 6 or xs[0] not in ('line', 'block') or \
+               not all(x.lstrip('-').isdigit() for x in xs[4:]):
+                die(f"{path}: bad profile line: {text.strip()}");
+            counts[tuple(xs[:4]) + (int(xs[4]),)] = int(xs[5]);
+    return counts
+
+class Profile:
+    def __init__(self, trees, counts={}):
+        self.owners = {}; self.cache = {}; self.counts = counts;
+        for name, tree in trees.items():
+            rest = replace(tree, decls=[d for d in tree.decls
+                                        if not isinstance(d, (FuncDecl, ProcDecl, Library))]);
+            base = tree.body.line;
+            self.owners[name] = ((name, digest(relative(rest, base)), base), spans(tree, []));
+        self.known = {k[:4] for k in counts};
+        self.names = {k[:3]: k[3] for k in counts};
+        self.hottest = max((n for k, n in counts.items() if k[0] == 'line'), default=0);
+
+    # the key of a source line, in the innermost function around it, or in
+    # the body of its unit
+    def key(self, unit, line):
+        if unit not in self.owners:
+            return None;
+        if (unit, line) not in self.cache:
+            body, funcs = self.owners[unit]; best = None;
+            for s in funcs:
+                if s[0] <= line <= s[1] and (best is None or s[0] >= best[0]):
+                    best = s;
+            name, d, base = body if best is None else best[2:];
+            self.cache[unit, line] = ('line', unit, name, d, line - base);
+        return self.cache[unit, line]
+
+    # the count of a line, None when its function has no counts
+    def line(self, unit, line):
+        k = self.key(unit, line);
+        if k is None or k[:4] not in self.known:
+            return None;
+        return self.counts.get(k, 0)
+
+    def hot(self, unit, line):
+        n = self.line(unit, line);
+        return bool(n) and n * HOT >= self.hottest
+
+    def blocks(self, unit, name, d, n):
+        if ('block', unit, name, d) not in self.known:
+            return None;
+        return [self.counts.get(('block', unit, name, d, b), 0) for b in range(n)]
+
+    # a function with counts for other code
+    def stale(self, kind, unit, name, d):
+        return self.names.get((kind, unit, name), d) != d
+
+# code with labels and slots numbered in order of appearance, and frames by
+# name, the same for the same code of a function in any image
+def canon(x, names):
+    if isinstance(x, (list, tuple)):
+        return [canon(y, names) for y in x];
+    if isinstance(x, Slot):
+        return ('slot', names.setdefault(id(x), len(names)), x.type.kind, x.disp);
+    if isinstance(x, str) and LABEL.fullmatch(x):
+        return ('label', names.setdefault(x, len(names)));
+    if isinstance(x, Frame):
+        return ('frame', x.name);
+    if isinstance(x, CType):
+        return (x.kind, x.size);
+    if hasattr(x, '__dataclass_fields__'):
+        return [type(x).__name__] + [canon(getattr(x, f.name), names) for f in fields(x)];
+    return x
+
+# the blocks of code, split as ssa.Function.build splits them
+def split(code):
+    blocks = [[]];
+    for insn in code:
+        if insn[0] == 'label' and any(x[0] not in QUIET for x in blocks[-1]):
+            blocks.append([]);
+        blocks[-1].append(insn);
+        if insn[0] in ENDS + BRANCHES:
+            blocks.append([]);
+    return [b for b in blocks if b]
+
+# the labels and lines a block starts with
+def head(block):
+    n = next((n for n, x in enumerate(block) if x[0] not in QUIET), len(block));
+    return block[:n]
+
+def last_of(block):
+    return next((n for n in reversed(range(len(block))) if block[n][0] not in QUIET), None)
+
+def invert(insn, label):
+    if insn[0] == 'bcmp':
+        return ('bcmp', not insn[1]) + insn[2:-1] + (label,);
+    return ('bf' if insn[0] == 'bt' else 'bt', insn[1], label)
+
+class Layout:
+    def __init__(self, gen, f, targets):
+        self.f = f; self.targets = targets;
+        self.digest = digest(canon([x for x in f.code if x[0] != 'line'], {}));
+        self.blocks = split(f.code); self.labels = []; self.lines = [];
+        line = None;
+        for b in self.blocks:
+            label = next((x[1] for x in b if x[0] == 'label'), None);
+            if label is None:
+                label = gen.new_label(); b.insert(0, ('label', label));
+            self.labels.append(label); self.lines.append(line);
+            line = next((x[1] for x in reversed(b) if x[0] == 'line'), line);
+        self.block = {x[1]: n for n, b in enumerate(self.blocks) for x in b if x[0] == 'label'};
+
+    def exits(self, b):
+        n = last_of(self.blocks[b]);
+        after = [b + 1] if b + 1 < len(self.blocks) else [];
+        insn = self.blocks[b][n] if n is not None else ('nop',);
+        if insn[0] == 'jmp':
+            return [self.block[insn[1]]];
+        if insn[0] in BRANCHES:
+            return after + [self.block[insn[-1]]];
+        if insn[0] == 'jtab':
+            return [self.block[insn[4]]] + [self.block[x] for x in self.targets[insn[2]]];
+        if insn[0] in ('leave', 'stop'):
+            return [];
+        return after
+
+    # the count of each edge, what a block runs goes out of it and into it,
+    # an edge left unknown counts the smaller of its ends
+    def edges(self, counts):
+        n = len(self.blocks);
+        succ = [list(dict.fromkeys(self.exits(b))) for b in range(n)];
+        pred = [[] for _ in range(n)];
+        for b in range(n):
+            for s in succ[b]:
+                pred[s].append(b);
+        w = {};
+        changed = True;
+        while changed:
+            changed = False;
+            for b in range(n):
+                for xs, total, edge in ((succ[b], counts[b], lambda x: (b, x)),
+                                        (pred[b] if b else [], counts[b], lambda x: (x, b))):
+                    unknown = [x for x in xs if edge(x) not in w];
+                    if len(unknown) == 1:
+                        known = sum(w[edge(x)] for x in xs if edge(x) in w);
+                        w[edge(unknown[0])] = max(total - known, 0); changed = True;
+        return {(b, s): w.get((b, s), min(counts[b], counts[s])) for b in range(n) for s in succ[b]}
+
+    # Pettis and Hansen, the edges saving the most jumps first join the
+    # chain ending in their source to the chain starting at their target, the
+    # chain of the entry goes first, then the chains that ran and the chains
+    # that never ran, in the order of the code, a branch costs the same
+    # taken or not, so an edge out of one saves the jumps of its other edge
+    def order(self, counts):
+        n = len(self.blocks);
+        chain = [[b] for b in range(n)]; of = list(range(n));
+        w = self.edges(counts); saves = {}; out = [[] for _ in range(n)];
+        for (a, b), k in w.items():
+            out[a].append(k);
+        for (a, b), k in w.items():
+            last = last_of(self.blocks[a]);
+            if last is not None and self.blocks[a][last][0] == 'jtab':
+                continue;
+            saves[a, b] = k if len(out[a]) == 1 else min(out[a]);
+        for (a, b), k in sorted(saves.items(), key=lambda x: (-x[1], x[0])):
+            if k == 0 or b == 0 or of[a] == of[b] or chain[of[a]][-1] != a or chain[of[b]][0] != b:
+                continue;
+            x = chain[of[b]]; chain[of[a]].extend(x);
+            for y in x:
+                of[y] = of[a];
+        heads = sorted({of[b] for b in range(n)},
+                       key=lambda c: (c != of[0], not any(counts[b] for b in chain[c]), chain[c][0]));
+        return [b for c in heads for b in chain[c]]
+
+    # the blocks in seq, a block that no longer falls through to the block
+    # after it in the code inverts its branch or jumps there
+    def code(self, seq):
+        out = [];
+        for k, b in enumerate(seq):
+            xs = list(self.blocks[b]);
+            next_ = seq[k + 1] if k + 1 < len(seq) else None;
+            start = head(xs);
+            if k > 0 and seq[k - 1] != b - 1 and self.lines[b] is not None and \
+               not any(x[0] == 'line' for x in start):
+                xs.insert(len(start), ('line', self.lines[b]));
+            n = last_of(xs);
+            insn = xs[n] if n is not None else None;
+            if insn is not None and insn[0] == 'jmp' and self.block[insn[1]] == next_:
+                del xs[n];
+            elif (insn is None or insn[0] not in ENDS) and b + 1 < len(seq) and next_ != b + 1:
+                if insn is not None and insn[0] in BRANCHES and self.block[insn[-1]] == next_:
+                    xs[n] = invert(insn, self.labels[b + 1]);
+                else:
+                    xs.append(('jmp', self.labels[b + 1]));
+            out.extend(xs);
+        return out
+
+# lays out the blocks of each frame with counts in the profile, and returns
+# the blocks of all of them, (unit, function, digest, labels), for the probes
+def order(gen, profile, report=None):
+    targets = {label: [r.label for r in words] for label, words in gen.data
+               if words and all(hasattr(r, 'label') for r in words)};
+    probes = [];
+    for f in list(gen.frames.values()) + [gen.main]:
+        layout = Layout(gen, f, targets);
+        probes.append((f.unit, f.name, layout.digest, layout.labels));
+        counts = profile.blocks(f.unit, f.name, layout.digest, len(layout.blocks));
+        if counts is None:
+            if report is not None and profile.stale('block', f.unit, f.name, layout.digest):
+                report(f"pgo: {f.name}: stale profile ignored");
+            f.code = [x for b in layout.blocks for x in b];
+            continue;
+        seq = layout.order(counts);
+        f.code = layout.code(seq);
+        moved = sum(1 for k in range(1, len(seq)) if seq[k] != seq[k - 1] + 1);
+        if report is not None and moved:
+            report(f"pgo: {f.name}: {moved} of {len(seq)} blocks moved");
+    return probes
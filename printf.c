@@ -5,6 +5,7 @@
 #include "reinterpret_cast.h"
 #include "utf64.h"
 #include "thread_local.h"
+#include "file-io.h"
 
 #define SSSIZ 256 /* small string size */
 
@@ -15,7 +16,7 @@ thread_local uint64_t ch;
 
 static int vm_print_buf() {
   buf[bufcnt] = '\0';
-  return printf("%s", buf);
+  return fprintf(vm_out, "%s", buf);
 }
 
 static int put() {
@@ -40,6 +41,7 @@ static int put_ch() {
     fprintf(stderr, "vm: String Conversion Error!\n");
     return ret;
   }
+  smallstrbuf[ret] = '\0';
   return put();
 }
 
@@ -0,0 +1,189 @@
+#! /usr/bin/env python
+
+# the hot spots of a profile of vm-prof, by the line table complr.py -g
+# writes next to the image, see LINE TABLES in README, and the profiles of
+# complr.py -P from the counts of vm-prof -c, see PROFILES in README
+
+import sys
+from bisect import bisect_right
+from getopt import getopt, GetoptError
+
+USAGE = """\
+Usage:\t{0} [-f] [-n count] image.lines [profile]
+\t{0} -P output image.probes [profile]
+-f\twrite folded stacks, for flamegraph.pl, instead of the hot spots
+-n\tlist count functions and lines, the default is 20
+-P\tadd the counts of vm-prof -c at the probes of the image to output
+profile\tthe samples or counts of vm-prof, the default is vm.prof"""
+
+def uleb(data, at):
+    n = 0; shift = 0;
+    while True:
+        b = data[at]; at += 1;
+        n |= (b & 127) << shift; shift += 7;
+        if not b & 128:
+            return n, at
+
+def sleb(data, at):
+    n = 0; shift = 0;
+    while True:
+        b = data[at]; at += 1;
+        n |= (b & 127) << shift; shift += 7;
+        if not b & 128:
+            return (n - (1 << shift) if b & 64 else n), at
+
+# the rows of a line table, (pc, file, line, function) by pc
+def read_lines(path):
+    with open(path, 'rb') as f:
+        data = f.read();
+    if data[:4] != b'SLL1':
+        raise ValueError(f"{path}: not a line table");
+    at = 4; tables = [];
+    for _ in range(2):
+        n, at = uleb(data, at);
+        xs = [];
+        for _ in range(n):
+            k, at = uleb(data, at);
+            xs.append(data[at:at + k].decode()); at += k;
+        tables.append(xs);
+    files, funcs = tables;
+    pc, name, line, func = 1024, 0, 0, 0;
+    rows = [];
+    while True:
+        op = data[at]; at += 1;
+        if op == 0:
+            return rows
+        if op == 1:
+            name, at = uleb(data, at);
+        elif op == 2:
+            func, at = uleb(data, at);
+        elif op == 3:
+            d, at = uleb(data, at);
+            k, at = sleb(data, at);
+            pc += d; line += k;
+            rows.append((pc, files[name], line, funcs[func]));
+        else:
+            raise ValueError(f"{path}: bad op {op}");
+
+class Symbols:
+    def __init__(self, rows):
+        self.rows = rows; self.pcs = [r[0] for r in rows];
+
+    # the file, line and function of pc, '?' outside the table
+    def find(self, pc):
+        k = bisect_right(self.pcs, pc) - 1;
+        return self.rows[k][1:] if k >= 0 else ('?', 0, '?')
+
+# the stacks of a profile, the running function first, a return address is
+# looked up a word before it, in the call it returns from
+def read_stacks(path, symbols):
+    stacks = [];
+    with open(path) as f:
+        for text in f:
+            pcs = [int(x) for x in text.split()];
+            if pcs:
+                stacks.append([symbols.find(pc) for pc in pcs[:1]] +
+                              [symbols.find(pc - 1) for pc in pcs[1:]]);
+    return stacks
+
+def count(xs, x):
+    xs[x] = xs.get(x, 0) + 1;
+
+def report(stacks, n, out):
+    total = len(stacks) or 1;
+    funcs = {}; inside = {}; lines = {};
+    for stack in stacks:
+        count(funcs, stack[0][2]);
+        count(lines, stack[0]);
+        for name in {func for _, _, func in stack}:
+            count(inside, name);
+    print(f"{len(stacks)} samples", file=out);
+    print(f"{'self':>7} {'total':>7}  function", file=out);
+    for name in sorted(inside, key=lambda x: (-funcs.get(x, 0), -inside[x], x))[:n]:
+        print(f"{100 * funcs.get(name, 0) / total:6.1f}% {100 * inside[name] / total:6.1f}%  {name}",
+              file=out);
+    print(f"{'self':>7}  line", file=out);
+    for (path, line, name) in sorted(lines, key=lambda x: (-lines[x], x))[:n]:
+        print(f"{100 * lines[path, line, name] / total:6.1f}%  {path}:{line} {name}", file=out);
+
+def folded(stacks, out):
+    folds = {};
+    for stack in stacks:
+        count(folds, ';'.join(func for _, _, func in reversed(stack)));
+    for fold, k in sorted(folds.items()):
+        print(f"{fold} {k}", file=out);
+
+# the counts at the probes, of a line the most of any of its probes, added
+# to the counts in output of the same code, replacing those of other code
+def merge(output, probes, counts):
+    at = {};
+    with open(counts) as f:
+        for text in f:
+            pc, n = text.split();
+            at[int(pc)] = int(n);
+    new = {};
+    with open(probes) as f:
+        for text in f:
+            pc, *key = text.split();
+            key = tuple(key[:4]) + (int(key[4]),);
+            new[key] = max(new.get(key, 0), at.get(int(pc), 0));
+    digests = {k[:3]: k[3] for k in new};
+    old = {};
+    try:
+        with open(output) as f:
+            for text in f:
+                *key, n = text.split();
+                old[tuple(key[:4]) + (int(key[4]),)] = int(n);
+    except FileNotFoundError:
+        pass;
+    for k, n in old.items():
+        if digests.get(k[:3], k[3]) == k[3]:
+            new[k] = new.get(k, 0) + n;
+    with open(output, 'w') as f:
+        for k in sorted(new):
+            f.write(' '.join(map(str, k + (new[k],))) + '\n');
+
+def main(argv):
+    try:
+        opts, args = getopt(argv[1:], 'hfn:P:');
+    except GetoptError as e:
+        print(f"{argv[0]}: {e}", file=sys.stderr);
+        return 1;
+    fold = False; n = 20; output = None;
+    for opt, arg in opts:
+        if opt == '-h':
+            print(USAGE.format(argv[0]), file=sys.stderr);
+            return 0;
+        if opt == '-f':
+            fold = True;
+        if opt == '-n':
+            if not arg.isdigit():
+                print(f"{argv[0]}: bad count {arg}", file=sys.stderr);
+                return 1;
+            n = int(arg);
+        if opt == '-P':
+            output = arg;
+    if len(args) not in (1, 2):
+        print(USAGE.format(argv[0]), file=sys.stderr);
+        return 1;
+    if output is not None:
+        try:
+            merge(output, args[0], args[1] if len(args) > 1 else 'vm.prof');
+        except (OSError, ValueError, IndexError) as e:
+            print(f"{argv[0]}: {e}", file=sys.stderr);
+            return 1;
+        return 0;
+    try:
+        symbols = Symbols(read_lines(args[0]));
+        stacks = read_stacks(args[1] if len(args) > 1 else 'vm.prof', symbols);
+    except (OSError, ValueError, IndexError) as e:
+        print(f"{argv[0]}: {e}", file=sys.stderr);
+        return 1;
+    if fold:
+        folded(stacks, sys.stdout);
+    else:
+        report(stacks, n, sys.stdout);
+    return 0;
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
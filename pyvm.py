@@ -0,0 +1,509 @@
+#! /usr/bin/env python
+
+# the virtual machine of vm.c and its c calls in python, slow but with no
+# undefined behaviour, counting the dispatches of every pc, for differential
+# tests against vm and the op mixes of runs, see PYTHON VM in README
+
+import io
+import math
+import mmap
+import operator
+import struct
+import sys
+from array import array
+from getopt import getopt, GetoptError
+from backend import OPCODES
+
+IMAGE_BASE = 1024;
+WORDS = 64 * 1024 * 1024;  # the memory of vm without -b
+FD_COUNT = 2048;
+M = (1 << 64) - 1;
+SIGN = 1 << 63;
+NAMES = sorted(OPCODES, key=OPCODES.get);
+NAN = math.inf - math.inf;  # the nan of the hardware, -nan on x86
+
+USAGE = """\
+Usage:\t{0} [-b words] [-c counts] [-m] image
+-b\tthe words of memory, the default is {1}
+-c\twrite the dispatches of every pc to counts, as vm-prof -c writes them
+-m\twrite the dispatches of every opcode to stderr, the op mix of the run
+image\tthe image of complr.py, - for stdin"""
+
+# the operands of the instructions, u for a register, f for a float
+# register and i for an immediate, the others compare or compute on two
+# registers of the file of their first letter, and branch after with BT or BF
+KINDS = {'ULD': 'uu', 'FLD': 'fu', 'UST': 'uu', 'FST': 'uf', 'UIMM': 'ui', 'FIMM': 'fi',
+         'UMOV': 'uu', 'FMOV': 'ff', 'U2F': 'fu', 'I2F': 'fu', 'F2U': 'uf', 'F2I': 'uf',
+         'BT': 'i', 'BF': 'i', 'CALL': 'uu', 'STOP': 'u', 'UADDI': 'uui', 'ULDO': 'uui',
+         'FLDO': 'fui', 'USTO': 'uiu', 'FSTO': 'uif', 'ULDA': 'ui', 'FLDA': 'fi', 'USTA': 'iu',
+         'FSTA': 'if'};
+TESTS = {'EQ': operator.eq, 'GT': operator.gt, 'LT': operator.lt};
+
+def kinds(name):
+    if name in KINDS:
+        return KINDS[name];
+    r = 'f' if name[0] == 'F' else 'u';
+    return r + r + ('i' if name.endswith(('BT', 'BF')) else '')
+
+def signed(w):
+    return w - (1 << 64) if w & SIGN else w
+
+def real(w):
+    return struct.unpack('<d', struct.pack('<Q', w))[0]
+
+# the conversions of x86, cvttsd2si gives the sign bit for nan and what is
+# out of range, and gcc converts from 2^63 up with it after subtracting 2^63
+def trunc(f):
+    if f != f or not -2.0 ** 63 <= f < 2.0 ** 63:
+        return SIGN;
+    return int(f) & M
+
+def f2u(f):
+    return trunc(f) if not f >= 2.0 ** 63 else trunc(f - 2.0 ** 63) ^ SIGN
+
+def fdiv(p, q):
+    try:
+        return p / q
+    except ZeroDivisionError:
+        if p != p or q != q:
+            return p + q;
+        return NAN if p == 0 else math.copysign(math.inf, p) * math.copysign(1.0, q)
+
+def idiv(p, q):
+    t = abs(p) // abs(q);
+    return -t if (p < 0) != (q < 0) else t
+
+# the utf-8 of a codepoint as c64tomb writes it, None past 0x10ffff
+def utf8(c):
+    return chr(c).encode('utf-8', 'surrogatepass') if c <= 0x10ffff else None
+
+# a program of vm faulting, the signal that would end vm
+class Fault(Exception):
+    pass
+
+class Halt(Exception):
+    def __init__(self, status):
+        self.status = status;
+
+# a machine with the memory of vm, each run maps it anew, so it starts zero,
+# an instruction is decoded at its first dispatch to a closure that runs it
+# and returns the next pc, a store to the words of decoded code drops them
+class VM:
+    def __init__(self, words=WORDS, stdin=None):
+        self.words = words; self.stdin = stdin; self.counts = None;
+        self.calls = {1: self.printf, 2: self.fopen, 3: self.fclose, 4: self.fseek,
+                      5: self.writetxt, 6: self.writebytes, 7: self.readtxt, 8: self.readbytes,
+                      9: lambda: self.words, 10: lambda: self.imglen};
+
+    # the status of the program, the register of its STOP, and with capture
+    # the bytes it wrote to stdout, None without, with count the dispatches
+    # of every pc of the image are in counts after
+    def run(self, image, capture=False, count=False):
+        words = array('Q', image.words() if hasattr(image, 'words') else image);
+        if IMAGE_BASE + len(words) > self.words:
+            raise MemoryError("vm: address space is full");
+        self.bytes = memoryview(mmap.mmap(-1, 8 * self.words));
+        self.mem = self.bytes.cast('Q'); self.fmem = self.bytes.cast('d');
+        self.bytes[8 * IMAGE_BASE:8 * (IMAGE_BASE + len(words))] = words.tobytes();
+        for n in self.calls:
+            self.mem[n] = n;
+        self.imglen = len(words); self.end = IMAGE_BASE + len(words);
+        self.u = [0] * 8; self.x = [0.0] * 8; self.u[0] = IMAGE_BASE;
+        self.ops = [None] * self.end; self.code = bytearray(self.end);
+        out = io.BytesIO() if capture else sys.stdout.buffer;
+        self.fds = [None] * FD_COUNT;
+        self.fds[:3] = [self.stdin or sys.stdin.buffer, out, sys.stderr.buffer];
+        sys.stdout.flush();
+        try:
+            status = self.execute(count);
+        finally:
+            for f in self.fds[3:]:
+                if f is not None:
+                    f.close();
+            out.flush();
+        return status, out.getvalue() if capture else None
+
+    def execute(self, count):
+        ops = self.ops; decode = self.decode; pc = self.u[0];
+        counts = self.counts = [0] * len(ops) if count else None;
+        try:
+            if counts is None:
+                while True:
+                    pc = (ops[pc] or decode(pc))();
+            while True:
+                counts[pc] += 1;
+                pc = (ops[pc] or decode(pc))();
+        except Halt as e:
+            self.u[0] = pc;
+            return e.status
+        except IndexError:
+            if pc >= len(ops):
+                raise Fault(f"segmentation fault, pc {pc} outside the image") from None;
+            raise Fault(f"segmentation fault at pc {pc}") from None;
+
+    # the dispatches of each opcode, by the code in memory after the run
+    def mix(self):
+        ops = {};
+        for pc, n in enumerate(self.counts or []):
+            if n:
+                name = NAMES[self.mem[pc]];
+                ops[name] = ops.get(name, 0) + n;
+        return ops
+
+    def forget(self, lo, hi):
+        for k in range(max(lo - 3, 0), min(hi, self.end)):
+            self.ops[k] = None;
+
+    def decode(self, pc):
+        mem = self.mem; fmem = self.fmem; u = self.u; x = self.x;
+        end = self.end; code = self.code; forget = self.forget;
+        op = mem[pc];
+        if op >= len(NAMES):
+            raise Fault(f"illegal instruction {op} at pc {pc}");
+        name = NAMES[op]; ks = kinds(name); n = 1 + len(ks);
+        a, b, c = (list(mem[pc + 1:pc + n]) + [0, 0])[:3];
+        for k, w in zip(ks, (a, b, c)):
+            if k != 'i' and w > 7:
+                raise Fault(f"illegal register {w} at pc {pc}");
+        nxt = pc + n;
+        # what doesn't read r0 when it is an operand
+        own = name in ('CALL', 'UIMM') or name == 'UMOV' and a == 0 and b != 0;
+        if name == 'ULD':
+            def h():
+                u[a] = mem[u[b]]; return nxt
+        elif name == 'FLD':
+            def h():
+                x[a] = fmem[u[b]]; return nxt
+        elif name == 'UMOV' and a == 0 and b != 0:
+            h = lambda: (u[b] + 3) & M;
+        elif name in ('UMOV', 'FMOV'):
+            r = x if name == 'FMOV' else u;
+            def h():
+                r[a] = r[b]; return nxt
+        elif name in ('U2F', 'I2F', 'F2U', 'F2I'):
+            r = x if ks[0] == 'f' else u; src = x if ks[1] == 'f' else u;
+            f = {'U2F': float, 'I2F': lambda w: float(signed(w)), 'F2U': f2u, 'F2I': trunc}[name];
+            def h():
+                r[a] = f(src[b]); return nxt
+        elif name in ('UST', 'FST', 'USTO', 'FSTO', 'USTA', 'FSTA'):
+            dst = fmem if ks[-1] == 'f' else mem; src = x if ks[-1] == 'f' else u;
+            if len(ks) == 3:
+                def h():
+                    k = (u[a] + b) & M; dst[k] = src[c];
+                    if k < end and code[k]:
+                        forget(k, k + 1);
+                    return nxt
+            elif ks[0] == 'u':
+                def h():
+                    k = u[a]; dst[k] = src[b];
+                    if k < end and code[k]:
+                        forget(k, k + 1);
+                    return nxt
+            else:
+                def h():
+                    dst[a] = src[b];
+                    if a < end and code[a]:
+                        forget(a, a + 1);
+                    return nxt
+        elif name == 'UIMM':
+            if a == 0:
+                to = (b + 3) & M; h = lambda: to;
+            else:
+                def h():
+                    u[a] = b; return nxt
+        elif name == 'FIMM':
+            f = real(b);
+            def h():
+                x[a] = f; return nxt
+        elif name in ('BT', 'BF'):
+            to = (pc + signed(a)) & M; no = pc + 2;
+            if name == 'BF':
+                to, no = no, to;
+            h = lambda: to if u[4] else no;
+        elif name == 'UADDI':
+            def h():
+                u[a] = (u[b] + c) & M; return nxt
+        elif name == 'UADD':
+            def h():
+                u[a] = (u[a] + u[b]) & M; return nxt
+        elif name == 'USUB':
+            def h():
+                u[a] = (u[a] - u[b]) & M; return nxt
+        elif name in ('FADD', 'FSUB', 'FMUL', 'FDIV'):
+            f = {'FADD': operator.add, 'FSUB': operator.sub, 'FMUL': operator.mul,
+                 'FDIV': fdiv}[name];
+            def h():
+                x[a] = f(x[a], x[b]); return nxt
+        elif name in ('UMUL', 'IMUL'):
+            s = signed if name == 'IMUL' else int;
+            def h():
+                p = s(u[a]) * s(u[b]); u[a] = p & M; u[3] = (p >> 64) & M; return nxt
+        elif name in ('UDIV', 'IDIV'):
+            s = signed if name == 'IDIV' else int;
+            def h():
+                p = s(u[a]); q = s(u[b]);
+                if q == 0 or (p == -SIGN and q == -1):
+                    raise Fault(f"floating point exception at pc {pc}");
+                t = idiv(p, q); u[a] = t & M; u[3] = (p - t * q) & M; return nxt
+        elif name in ('ULDO', 'FLDO'):
+            r = x if ks[0] == 'f' else u; src = fmem if ks[0] == 'f' else mem;
+            def h():
+                r[a] = src[(u[b] + c) & M]; return nxt
+        elif name in ('ULDA', 'FLDA'):
+            r = x if ks[0] == 'f' else u; src = fmem if ks[0] == 'f' else mem;
+            def h():
+                r[a] = src[b]; return nxt
+        elif name == 'CALL':
+            calls = self.calls;
+            def h():
+                f = calls.get(u[b] if b else pc);
+                if f is None:
+                    raise Fault(f"segmentation fault, no c call at {u[b] if b else pc}, pc {pc}");
+                u[0] = nxt; u[a] = f();
+                return u[0]
+        elif name == 'STOP':
+            def h():
+                raise Halt(u[a]);
+        else:
+            test = TESTS[name[1:3]]; r = x if ks[0] == 'f' else u;
+            yes = no = nxt;
+            if len(ks) == 3:
+                yes = (pc + signed(c)) & M;
+                if name.endswith('BF'):
+                    yes, no = no, yes;
+            if name[0] == 'I':
+                def h():
+                    if test(r[a] ^ SIGN, r[b] ^ SIGN):
+                        u[4] = 1; return yes
+                    u[4] = 0; return no
+            else:
+                def h():
+                    if test(r[a], r[b]):
+                        u[4] = 1; return yes
+                    u[4] = 0; return no
+        if not own and any(k == 'u' and w == 0 for k, w in zip(ks, (a, b, c))):
+            h = self.synced(h, pc, n);
+        self.ops[pc] = h; k = min(nxt, end); code[pc:k] = b'\1' * (k - pc);
+        return h
+
+    # an instruction on r0, the pc, sees its own pc there, and one writing r0
+    # goes on after what it wrote, as vm adds its length to the pc after it
+    def synced(self, h, pc, n):
+        u = self.u;
+        def s():
+            u[0] = pc; to = h();
+            return to if u[0] == pc else (u[0] + n) & M
+        return s
+
+    # the n words at p, faulting past the memory as vm would
+    def span(self, p, n):
+        if p + n > self.words:
+            raise Fault(f"segmentation fault, c call on {n} words at {p}");
+        return self.mem[p:p + n]
+
+    def string(self, p):
+        s = bytearray();
+        while self.mem[p]:
+            c = utf8(self.mem[p]);
+            if c is None:
+                return None;
+            s += c; p += 1;
+        return s.decode('utf-8', 'surrogateescape')
+
+    def file(self, fd):
+        fd = signed(fd);
+        return self.fds[fd] if 0 <= fd < FD_COUNT else None
+
+    # see printf.c, the arguments after r4 to r7 and x0 to x7 are on the
+    # stack, each conversion but %% takes the next word of the stack
+    def printf(self):
+        u = self.u; mem = self.mem; p = u[3];
+        nint = 4; nflo = 0; narg = 1; out = bytearray();
+        while mem[p]:
+            ch = mem[p]; p += 1;
+            if ch == ord('%'):
+                ch = mem[p]; p += 1;
+                if ch == 0:
+                    break;
+                if ch == ord('f'):
+                    f = self.x[nflo] if nflo <= 7 else self.fmem[(u[1] - narg + 8) & M];
+                    nflo += 1; narg += 1;
+                    out += b'-nan' if f != f and math.copysign(1.0, f) < 0 else b'%f' % f;
+                    continue;
+                if ch < 128 and chr(ch) in 'sdcux':
+                    w = u[nint] if nint <= 7 else mem[(u[1] - narg + 3) & M];
+                    nint += 1; narg += 1;
+                    if ch == ord('s'):
+                        while mem[w]:
+                            c = utf8(mem[w]);
+                            if c is None:
+                                return self.bad_char();
+                            out += c; w += 1;
+                        continue;
+                    if ch != ord('c'):
+                        out += b'%d' % signed(w) if ch == ord('d') else b'%d' % w if ch == ord('u') \
+                            else b'%x' % w;
+                        continue;
+                    ch = w;
+            c = utf8(ch);
+            if c is None:
+                return self.bad_char();
+            out += c;
+        self.fds[1].write(out);
+        return len(out)
+
+    # what printf wrote is lost, as printf.c leaves it in its buffer
+    def bad_char(self):
+        print("vm: String Conversion Error!", file=sys.stderr);
+        return M
+
+    # see file-io.c, fclose leaves the file in its fd, so no fopen reuses it,
+    # and the fds before 3 belong to the caller and stay open
+    def fopen(self):
+        name = self.string(self.u[3]); mode = self.string(self.u[4]);
+        if name is None or mode is None:
+            return M;
+        try:
+            f = open(name, mode.replace('b', '') + 'b');
+        except (OSError, ValueError):
+            return M;
+        for fd in range(FD_COUNT):
+            if self.fds[fd] is None:
+                self.fds[fd] = f;
+                return fd;
+        f.close();
+        return M
+
+    def fclose(self):
+        fd = signed(self.u[3]); f = self.file(fd);
+        if f is None:
+            return M;
+        if fd > 2:
+            f.close();
+        return 0
+
+    def fseek(self):
+        f = self.file(self.u[3]); whence = self.u[5];
+        if f is None or whence > 2:
+            return M;
+        try:
+            f.seek(signed(self.u[4]), whence);
+        except (OSError, ValueError):
+            return M;
+        return 0
+
+    def writetxt(self):
+        f = self.file(self.u[3]); n = self.u[5];
+        if f is None:
+            return 0;
+        out = bytearray(); status = n;
+        for w in self.span(self.u[4], n):
+            c = utf8(w);
+            if c is None:
+                status = M;
+                break;
+            out += c;
+        try:
+            f.write(out);
+        except (OSError, ValueError):
+            return 0;
+        return status
+
+    def writebytes(self):
+        f = self.file(self.u[3]); p = self.u[4]; n = self.u[5];
+        if f is None:
+            return M;
+        self.span(p, n);
+        try:
+            f.write(self.bytes[8 * p:8 * (p + n)]);
+        except (OSError, ValueError):
+            return 0;
+        return n
+
+    # vm_mblen takes a lead byte for a character of one byte, so a character
+    # past ascii reads as its lead byte without the top bit, a byte 0xff is
+    # EOF to file-io.c, skipped before a character and ending the read after
+    def readtxt(self):
+        f = self.file(self.u[3]); p = self.u[4]; n = self.u[5];
+        if f is None:
+            return M;
+        dst = self.span(p, n); k = 0;
+        eof = lambda c: c == b'' or c[0] == 0xff;
+        try:
+            while k < n:
+                c = f.read(1);
+                while not eof(c) and c[0] & 0xc0 == 0x80:
+                    c = f.read(1);
+                if eof(c):
+                    c = f.read(1);
+                    if eof(c):
+                        break;
+                if c[0] & 0xc0 != 0x80:
+                    dst[k] = c[0] & 0x7f; k += 1;
+        except (OSError, ValueError):
+            pass;
+        self.forget(p, p + k);
+        return k
+
+    def readbytes(self):
+        f = self.file(self.u[3]); p = self.u[4]; n = self.u[5];
+        if f is None:
+            return M;
+        self.span(p, n);
+        try:
+            data = f.read(8 * n);
+        except (OSError, ValueError):
+            return 0;
+        self.bytes[8 * p:8 * p + len(data)] = data;
+        self.forget(p, p + (len(data) + 7) // 8);
+        return len(data) // 8
+
+def main(argv):
+    try:
+        opts, args = getopt(argv[1:], 'hb:c:m');
+    except GetoptError as e:
+        print(f"{argv[0]}: {e}", file=sys.stderr);
+        return 1;
+    words = WORDS; counts = None; ops = False;
+    for opt, arg in opts:
+        if opt == '-h':
+            print(USAGE.format(argv[0], WORDS), file=sys.stderr);
+            return 0;
+        if opt == '-b':
+            if not arg.isdigit():
+                print(f"{argv[0]}: bad number {arg}", file=sys.stderr);
+                return 1;
+            words = int(arg);
+        if opt == '-c':
+            counts = arg;
+        if opt == '-m':
+            ops = True;
+    if len(args) != 1:
+        print(USAGE.format(argv[0], WORDS), file=sys.stderr);
+        return 1;
+    try:
+        if args[0] == '-':
+            data = sys.stdin.buffer.read();
+        else:
+            with open(args[0], 'rb') as f:
+                data = f.read();
+        image = array('Q', data[:len(data) - len(data) % 8]);
+        vm = VM(words);
+        status, _ = vm.run(image, count=counts is not None or ops);
+    except (OSError, MemoryError, Fault) as e:
+        print(f"{argv[0]}: {e}", file=sys.stderr);
+        return 1;
+    if counts is not None:
+        with open(counts, 'w') as f:
+            for pc, n in enumerate(vm.counts):
+                if n:
+                    f.write(f"{pc} {n}\n");
+    if ops:
+        mix = vm.mix(); total = sum(mix.values());
+        print(f"{total} dispatches", file=sys.stderr);
+        for name, n in sorted(mix.items(), key=lambda x: (-x[1], x[0])):
+            print(f"{name:6} {n:12} {100 * n / total:5.1f}%", file=sys.stderr);
+    return status & 255
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
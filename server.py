@@ -0,0 +1,87 @@
+#! /usr/bin/env python
+
+# the compile server, it keeps parsed sources and library interfaces warm,
+# see load_source and compile_sources in complr.py
+
+import asyncio
+import io
+import json
+import os
+import signal
+import socket
+import sys
+import traceback
+from getopt import getopt, GetoptError
+import complr
+from complrc import socket_path
+
+def compile_request(req, cache):
+    # stdout is bytes for images, it travels latin-1 decoded in the json reply
+    out, err = io.TextIOWrapper(io.BytesIO(), 'utf-8'), io.StringIO();
+    try:
+        status = complr.run(req['argv'], req['cwd'], out, err, cache);
+    except Exception:
+        traceback.print_exc(file=err);
+        status = 70;
+    out.flush();
+    stdout = out.buffer.getvalue().decode('latin-1');
+    return {'status': status, 'stdout': stdout, 'stderr': err.getvalue()};
+
+async def handle(reader, writer, cache):
+    loop = asyncio.get_running_loop();
+    try:
+        line = await reader.readline();
+        if line:
+            req = json.loads(line);
+            res = await loop.run_in_executor(None, compile_request, req, cache);
+            writer.write(json.dumps(res).encode() + b'\n');
+            await writer.drain();
+    except (ValueError, KeyError, ConnectionError) as e:
+        print(f"server: bad request: {e}", file=sys.stderr);
+    finally:
+        writer.close();
+
+def alivep(path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path);
+            return True;
+        except OSError:
+            return False;
+
+async def serve(path):
+    cache = {};
+    server = await asyncio.start_unix_server(
+        lambda r, w: handle(r, w, cache), path
+    );
+    os.chmod(path, 0o600);
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, server.close);
+    async with server:
+        try:
+            await server.serve_forever();
+        except asyncio.CancelledError:
+            pass;
+
+def main(argv):
+    try:
+        opts, args = getopt(argv[2:], 's:');
+    except GetoptError as e:
+        print(f"{argv[0]}: {e}", file=sys.stderr);
+        return 1;
+    path = socket_path();
+    for opt, arg in opts:
+        if opt == '-s':
+            path = arg;
+    if os.path.exists(path):
+        if alivep(path):
+            print(f"{argv[0]}: a server is listening on {path}", file=sys.stderr);
+            return 1;
+        os.unlink(path);
+    try:
+        asyncio.run(serve(path));
+    except KeyboardInterrupt:
+        pass;
+    finally:
+        if os.path.exists(path):
+            os.unlink(path);
+    return 0;
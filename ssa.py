@@ -0,0 +1,640 @@
+#! /usr/bin/env python
+
+# basic block SSA form of the three address code of backend.Gen, kept in typed
+# arrays, with its dominator tree and the passes run over it before Select
+
+from __future__ import annotations
+import math
+from array import array
+from backend import Slot, Imm, Mem, INT, UINT, REAL, BOOL
+
+OPS = (
+    'nop', 'phi', 'enter', 'leave', 'label', 'jmp', 'bt', 'bf', 'bcmp', 'jtab',
+    'stop', 'mov', 'sym', 'addr', 'load', 'store', 'bin', 'divc', 'cmp', 'conv',
+    'copy', 'call', 'icall', 'ccall', 'pmove', 'line'
+);
+OP = {op: n for n, op in enumerate(OPS)};
+KINDS = ('int', 'uint', 'real', 'bool', 'proc', 'ptr', 'array', 'record', 'vector');
+ENDS = ('jmp', 'jtab', 'leave', 'stop');
+BRANCHES = ('bt', 'bf', 'bcmp');
+# ops without effect, line marks the source line of what follows
+QUIET = ('nop', 'label', 'phi', 'line');
+# ops whose only effect is their definition, UDIV and IDIV trap on zero
+PURE = ('phi', 'mov', 'sym', 'addr', 'load', 'bin', 'divc', 'cmp', 'conv');
+CALLS = ('call', 'icall', 'ccall');
+M = (1 << 64) - 1;
+
+def s64(x):
+    return x - (1 << 64) if x >> 63 else x
+
+def get(x, path):
+    for k in path:
+        x = x.addr if k == 'addr' else x[k];
+    return x
+
+def put(x, path, v):
+    if not path:
+        return v;
+    k = path[0];
+    if k == 'addr':
+        return Mem(put(x.addr, path[1:], v), x.type);
+    y = list(x); y[k] = put(x[k], path[1:], v);
+    return tuple(y) if isinstance(x, tuple) else y
+
+# the paths of the operands insn defines and reads, a pinned read must stay
+# in its variable, enter and leave define and read the frame's own slots
+def operands(insn):
+    op = insn[0]; defs = []; uses = []; pinned = [];
+    if op in ('mov', 'sym', 'addr', 'load', 'bin', 'divc', 'cmp', 'conv') + CALLS and \
+       insn[1] is not None:
+        defs.append((1,));
+    if op in ('mov', 'load', 'divc'):
+        uses = [(2,)];
+    elif op == 'conv':
+        uses = [(3,)];
+    elif op == 'bin':
+        uses = [(3,), (4,)];
+    elif op in ('cmp', 'bcmp'):
+        uses = [(4,), (5,)];
+    elif op in ('store', 'copy'):
+        uses = [(1,), (2,)];
+    elif op in ('bt', 'bf', 'jtab', 'stop'):
+        uses = [(1,)];
+    elif op in CALLS:
+        uses = [(2,)] if op == 'icall' else [];
+        uses += [(3, i, 0) for i in range(len(insn[3]))];
+        if op == 'call' and insn[4] is not None:
+            pinned.append((4,));
+    elif op == 'pmove':
+        for i, (p, v) in enumerate(insn[1]):
+            if isinstance(p, Mem):
+                pinned.append((1, i, 0, 'addr'));
+            else:
+                defs.append((1, i, 0));
+            uses.append((1, i, 1));
+    elif op == 'enter':
+        f = insn[1];
+        defs = [None] * (len(f.params) + (f.resptr is not None));
+    elif op == 'leave':
+        f = insn[1];
+        pinned = [None] if f.resptr is not None or f.result is not None else [];
+    return defs, uses, pinned
+
+def frame_slots(insn):
+    f = insn[1];
+    if insn[0] == 'enter':
+        return f.params + ([f.resptr] if f.resptr is not None else []);
+    return [x for x in (f.resptr if f.resptr is not None else f.result,) if x is not None]
+
+def slots_in(x):
+    if isinstance(x, Slot):
+        yield x;
+    elif isinstance(x, Mem):
+        yield from slots_in(x.addr);
+    elif isinstance(x, (list, tuple)):
+        for y in x:
+            yield from slots_in(y);
+
+# the scalar slots of each frame that only its own code reads and writes,
+# and whose address is never taken, or, for the unescaped slots of
+# backend.Gen, only taken to pass it to calls, each one reads the slot and
+# writes it
+def variables(frames, unescaped=()):
+    taken = set(); foreign = set(); seen = {};
+    for f in frames:
+        seen[id(f)] = []; ptrs = {}; used = set();
+        for insn in f.code:
+            if insn[0] == 'addr':
+                taken.add(insn[2].root()[0]);
+                ptrs.setdefault(id(insn[1]), set()).add(insn[2].root()[0]);
+            xs = frame_slots(insn) if insn[0] in ('enter', 'leave') else slots_in(insn[1:]);
+            for s in xs:
+                r = s.root()[0];
+                if r.owner is not f:
+                    foreign.add(r);
+                elif r is s:
+                    seen[id(f)].append(s);
+        for insn in f.code:
+            if insn[0] == 'addr':
+                continue;
+            if insn[0] in CALLS:
+                xs = slots_in([insn[1:3], insn[4:]] + [a for a, _ in insn[3] if not isinstance(a, Slot)]);
+            else:
+                xs = frame_slots(insn) if insn[0] in ('enter', 'leave') else slots_in(insn[1:]);
+            for s in xs:
+                used |= ptrs.get(id(s), set());
+        taken -= {s for ss in ptrs.values() for s in ss if s in unescaped and s not in used};
+    return {id(f): list({id(s): s for s in seen[id(f)]
+                         if s.type.scalarp() and s not in taken and s not in foreign}.values())
+            for f in frames}
+
+# the VM result of an operation on constants, None when it traps or the C
+# conversion is undefined
+def evaluate(op, a, b, kind=None):
+    if op[0] == 'F' and op not in ('F2I', 'F2U'):
+        x, y = float(a), float(b);
+        if op == 'FDIV':
+            return x / y if y != 0 else None;
+        return {'FADD': x + y, 'FSUB': x - y, 'FMUL': x * y}[op];
+    if op in ('I2F', 'U2F'):
+        return float(s64(int(a) & M) if op == 'I2F' else int(a) & M);
+    if op in ('F2I', 'F2U'):
+        x = float(a);
+        if not math.isfinite(x) or not (-2 ** 63 <= x < 2 ** 63 if op == 'F2I' else -1 < x < 2 ** 64):
+            return None;
+        return int(x) & M;
+    x, y = int(a) & M, int(b) & M;
+    if op in ('UADD', 'USUB', 'UMUL'):
+        return {'UADD': x + y, 'USUB': x - y, 'UMUL': x * y}[op] & M;
+    if op == 'IMUL':
+        return s64(x) * s64(y) & M;
+    if op == 'UDIV':
+        return x // y if y else None;
+    if op == 'IDIV':
+        x, y = s64(x), s64(y);
+        if y == 0 or x == -2 ** 63 and y == -1:
+            return None;
+        return (abs(x) // abs(y) * (1 if (x < 0) == (y < 0) else -1)) & M;
+    return None
+
+def compare(op, kind, a, b):
+    if kind == 'F':
+        x, y = float(a), float(b);
+    elif kind == 'I':
+        x, y = s64(int(a) & M), s64(int(b) & M);
+    else:
+        x, y = int(a) & M, int(b) & M;
+    return {'EQ': x == y, 'NE': x != y, 'LT': x < y, 'GE': x >= y,
+            'GT': x > y, 'LE': x <= y}[op]
+
+class Function:
+    def __init__(self, frame, vars, targets):
+        self.frame = frame; self.vars = vars; self.targets = targets;
+        self.var = {id(s): n for n, s in enumerate(vars)};
+        self.through = {};
+        for insn in frame.code:
+            if insn[0] == 'addr' and id(insn[2]) in self.var:
+                self.through.setdefault(id(insn[1]), []).append(insn[2]);
+        # instructions, their operands are indexes into defs and uses
+        self.op = array('B'); self.insns = [];
+        self.def0 = array('I'); self.ndef = array('H');
+        self.use0 = array('I'); self.nuse = array('H');
+        self.paths = [];
+        # operands, a value number or -1, with the variable it renames, -1
+        # for an operand kept as it is, and the constant replacing it
+        self.defs = array('i'); self.defvar = array('i');
+        self.uses = array('i'); self.usevar = array('i'); self.pinned = array('B');
+        self.objs = []; self.consts = {};
+        # values, the variable and the instruction defining them, -1 for the
+        # value a variable has on entry, and their types
+        self.vvar = array('i'); self.vdef = array('i'); self.vkind = array('B');
+        self.undef = {};
+        # blocks, their instructions are first[b] to first[b + 1]
+        self.first = array('I'); self.succ = []; self.pred = [];
+        self.idom = array('i');
+        self.build(frame.code);
+
+    # construction
+
+    def build(self, code):
+        blocks = [[]];
+        for insn in code:
+            if insn[0] == 'label' and any(x[0] not in QUIET for x in blocks[-1]):
+                blocks.append([]);
+            blocks[-1].append(insn);
+            if insn[0] in ENDS + BRANCHES:
+                blocks.append([]);
+        self.labels = {x[1]: b for b, xs in enumerate(blocks) for x in xs if x[0] == 'label'};
+        n = len(blocks);
+        self.succ = [self.exits(b, next((x for x in reversed(xs) if x[0] not in QUIET), None), n)
+                     for b, xs in enumerate(blocks)];
+        self.pred = self.preds();
+        self.dominators();
+        phis = self.phis(blocks);
+        for b, xs in enumerate(blocks):
+            self.first.append(len(self.op));
+            for v in phis[b]:
+                self.add(('phi', None), [], [], [], [v], [v] * len(self.pred[b]),
+                         [None] * len(self.pred[b]));
+            for insn in xs:
+                defs, uses, pinned = operands(insn);
+                if insn[0] in ('enter', 'leave'):
+                    objs = frame_slots(insn);
+                    dvars = [self.var.get(id(s), -1) for s in objs] if defs else [];
+                    uvars = [self.var.get(id(s), -1) for s in objs] if pinned else [];
+                    self.add(insn, [], [], [None] * len(uvars), dvars, uvars,
+                             objs if pinned else []);
+                    continue;
+                xs = self.passed(insn);
+                objs = [get(insn, p) for p in uses + pinned] + xs;
+                dvars = [self.var.get(id(get(insn, p)), -1) for p in defs] + [self.var[id(x)] for x in xs];
+                uvars = [self.var.get(id(x), -1) for x in objs];
+                self.add(insn, defs + [None] * len(xs), uses, pinned + [None] * len(xs),
+                         dvars, uvars, objs);
+        self.first.append(len(self.op));
+        self.rename();
+
+    def add(self, insn, defs, uses, pinned, dvars, uvars, objs=[]):
+        self.op.append(OP[insn[0]]); self.insns.append(insn);
+        self.paths.append((defs, uses + pinned));
+        self.def0.append(len(self.defs)); self.ndef.append(len(dvars));
+        self.use0.append(len(self.uses)); self.nuse.append(len(uvars));
+        for v in dvars:
+            self.defs.append(-1); self.defvar.append(v);
+        for k, v in enumerate(uvars):
+            self.uses.append(-1); self.usevar.append(v);
+            self.pinned.append(k >= len(uses));
+        self.objs.extend(objs);
+
+    # the variables whose address a call is passed, it reads and writes them
+    def passed(self, insn):
+        if insn[0] not in CALLS:
+            return [];
+        return list({id(s): s for a, _ in insn[3] for s in self.through.get(id(a), [])}.values())
+
+    def exits(self, b, last, n):
+        after = [b + 1] if b + 1 < n else [];
+        if last is None:
+            return after;
+        op = last[0];
+        if op == 'jmp':
+            return [self.labels[last[1]]];
+        if op in BRANCHES:
+            return after + [self.labels[last[-1]]];
+        if op == 'jtab':
+            return [self.labels[last[4]]] + [self.labels[x] for x in self.targets[last[2]]];
+        if op in ('leave', 'stop'):
+            return [];
+        return after
+
+    def preds(self):
+        pred = [[] for _ in self.succ];
+        for b in self.order():
+            for s in self.succ[b]:
+                pred[s].append(b);
+        return pred
+
+    # reverse postorder of the blocks reachable from the entry
+    def order(self):
+        seen = bytearray(len(self.succ)); post = []; stack = [(0, iter(self.succ[0]))];
+        seen[0] = 1;
+        while stack:
+            b, it = stack[-1];
+            for s in it:
+                if not seen[s]:
+                    seen[s] = 1; stack.append((s, iter(self.succ[s])));
+                    break;
+            else:
+                stack.pop(); post.append(b);
+        return post[::-1]
+
+    # Cooper, Harvey and Kennedy, intersecting the dominators of the
+    # predecessors in reverse postorder until nothing changes
+    def dominators(self):
+        rpo = self.order(); index = {b: i for i, b in enumerate(rpo)};
+        idom = array('i', [-1] * len(self.succ)); idom[0] = 0;
+        changed = True;
+        while changed:
+            changed = False;
+            for b in rpo[1:]:
+                new = -1;
+                for p in self.pred[b]:
+                    if idom[p] < 0:
+                        continue;
+                    if new < 0:
+                        new = p;
+                        continue;
+                    x, y = p, new;
+                    while x != y:
+                        while index[x] > index[y]:
+                            x = idom[x];
+                        while index[y] > index[x]:
+                            y = idom[y];
+                    new = x;
+                if idom[b] != new:
+                    idom[b] = new; changed = True;
+        self.idom = idom; self.rpo = rpo;
+        self.children = [[] for _ in self.succ];
+        for b in rpo[1:]:
+            self.children[idom[b]].append(b);
+
+    def frontiers(self):
+        df = [set() for _ in self.succ];
+        for b in self.rpo:
+            if len(self.pred[b]) < 2:
+                continue;
+            for p in self.pred[b]:
+                x = p;
+                while x != self.idom[b]:
+                    df[x].add(b); x = self.idom[x];
+        return df
+
+    # phis for the variables read in a block before it writes them, at the
+    # iterated dominance frontier of their writes
+    def phis(self, blocks):
+        sites = [set() for _ in self.vars]; live = set();
+        for b in self.rpo:
+            written = set();
+            for insn in blocks[b]:
+                defs, uses, pinned = operands(insn);
+                if insn[0] in ('enter', 'leave'):
+                    objs = frame_slots(insn);
+                    rs, ws = (objs if pinned else []), (objs if defs else []);
+                else:
+                    rs = [get(insn, p) for p in uses + pinned] + self.passed(insn);
+                    ws = [get(insn, p) for p in defs] + self.passed(insn);
+                for s in rs:
+                    if id(s) in self.var and self.var[id(s)] not in written:
+                        live.add(self.var[id(s)]);
+                for s in ws:
+                    if id(s) in self.var:
+                        written.add(self.var[id(s)]); sites[self.var[id(s)]].add(b);
+        df = self.frontiers(); phis = [[] for _ in blocks];
+        for v in sorted(live):
+            work = list(sites[v]); placed = set();
+            while work:
+                for y in df[work.pop()]:
+                    if y not in placed:
+                        placed.add(y); phis[y].append(v);
+                        if y not in sites[v]:
+                            work.append(y);
+        return phis
+
+    def value(self, var, insn):
+        self.vvar.append(var); self.vdef.append(insn);
+        self.vkind.append(KINDS.index(self.vars[var].type.kind));
+        return len(self.vvar) - 1
+
+    def rename(self):
+        stacks = [[] for _ in self.vars];
+        def top(v):
+            if stacks[v]:
+                return stacks[v][-1];
+            if v not in self.undef:
+                self.undef[v] = self.value(v, -1);
+            return self.undef[v];
+        work = [(0, False)];
+        while work:
+            b, done = work.pop();
+            if done:
+                for i in reversed(range(self.first[b], self.first[b + 1])):
+                    for k in range(self.def0[i], self.def0[i] + self.ndef[i]):
+                        if self.defvar[k] >= 0:
+                            stacks[self.defvar[k]].pop();
+                continue;
+            for i in range(self.first[b], self.first[b + 1]):
+                if self.op[i] != OP['phi']:
+                    for k in range(self.use0[i], self.use0[i] + self.nuse[i]):
+                        if self.usevar[k] >= 0:
+                            self.uses[k] = top(self.usevar[k]);
+                for k in range(self.def0[i], self.def0[i] + self.ndef[i]):
+                    if self.defvar[k] >= 0:
+                        self.defs[k] = self.value(self.defvar[k], i);
+                        stacks[self.defvar[k]].append(self.defs[k]);
+            for s in self.succ[b]:
+                for i in range(self.first[s], self.first[s + 1]):
+                    if self.op[i] != OP['phi']:
+                        break;
+                    for n, p in enumerate(self.pred[s]):
+                        if p == b:
+                            self.uses[self.use0[i] + n] = top(self.usevar[self.use0[i]]);
+            work.append((b, True));
+            work.extend((c, False) for c in reversed(self.children[b]));
+
+    # editing
+
+    def replace(self, i, insn):
+        self.op[i] = OP[insn[0]]; self.insns[i] = insn;
+        self.ndef[i] = 0; self.nuse[i] = 0; self.paths[i] = ([], []);
+
+    def kill(self, i):
+        self.replace(i, ('nop',));
+
+    # a value read by something else than pure instructions defining
+    # variables, or by a pure instruction defining a live value, is live
+    def live(self):
+        live = bytearray(len(self.vvar)); work = [];
+        def mark(k):
+            v = self.uses[k];
+            if v >= 0 and k not in self.consts and not live[v]:
+                live[v] = 1; work.append(v);
+        for i in range(len(self.op)):
+            op = OPS[self.op[i]];
+            if op in PURE and not (op == 'bin' and self.insns[i][2] in ('UDIV', 'IDIV')) and \
+               all(self.defvar[k] >= 0 for k in range(self.def0[i], self.def0[i] + self.ndef[i])):
+                continue;
+            for n, k in enumerate(range(self.use0[i], self.use0[i] + self.nuse[i])):
+                if op != 'pmove' or self.pinned[k] or self.defvar_of_move(i, n) < 0:
+                    mark(k);
+        while work:
+            v = work.pop(); i = self.vdef[v];
+            if i < 0:
+                continue;
+            op = OPS[self.op[i]];
+            if op == 'pmove':
+                n = self.move_of(i, v);
+                mark(self.use0[i] + n);
+            elif op in PURE:
+                for k in range(self.use0[i], self.use0[i] + self.nuse[i]):
+                    mark(k);
+        return live
+
+    # the variable the move of a use of a pmove writes, -1 for memory
+    def defvar_of_move(self, i, n):
+        m = self.paths[i][1][n][1];
+        for k, p in zip(range(self.def0[i], self.def0[i] + self.ndef[i]), self.paths[i][0]):
+            if p[1] == m:
+                return self.defvar[k];
+        return -1
+
+    def move_of(self, i, v):
+        for k, p in zip(range(self.def0[i], self.def0[i] + self.ndef[i]), self.paths[i][0]):
+            if self.defs[k] == v:
+                return next(n for n, u in enumerate(self.paths[i][1]) if u[1] == p[1]);
+
+    def blocks(self):
+        n = len(self.first) - 1;
+        self.succ = [];
+        for b in range(n):
+            last = None;
+            for i in range(self.first[b], self.first[b + 1]):
+                if OPS[self.op[i]] not in QUIET:
+                    last = self.insns[i];
+            self.succ.append(self.exits(b, last, n));
+        self.pred = self.preds();
+
+    # back to three address code over the frame slots, a value is the slot it
+    # renames again
+    def code(self):
+        out = [];
+        for i in range(len(self.op)):
+            op = OPS[self.op[i]];
+            if op in ('nop', 'phi'):
+                continue;
+            insn = self.insns[i];
+            for k, p in zip(range(self.use0[i], self.use0[i] + self.nuse[i]), self.paths[i][1]):
+                if k in self.consts and (op != 'pmove' or insn[1][p[1]] is not None):
+                    insn = put(insn, p, self.consts[k]);
+            if op == 'pmove':
+                insn = ('pmove', [m for m in insn[1] if m is not None]);
+                if not insn[1]:
+                    continue;
+            out.append(insn);
+        return out
+
+# passes, each one linear in the instructions, taking the function and the
+# counts to report
+
+# constants through the SSA edges, from moves of constants to the operands
+# reading them, folding what has only constant operands, branches included
+def propagate(fn, stats):
+    users = [[] for _ in fn.vvar];
+    for i in range(len(fn.op)):
+        for k in range(fn.use0[i], fn.use0[i] + fn.nuse[i]):
+            if fn.uses[k] >= 0:
+                users[fn.uses[k]].append((i, k));
+    known = {};
+    def const(k):
+        if k in fn.consts:
+            return fn.consts[k];
+        if fn.uses[k] >= 0:
+            return known.get(fn.uses[k]);
+        return fn.objs[k] if isinstance(fn.objs[k], Imm) else None;
+    def imm(val, v):
+        return Imm(val, fn.vars[fn.vvar[v]].type);
+    work = list(range(len(fn.op)));
+    while work:
+        i = work.pop(); op = OPS[fn.op[i]]; insn = fn.insns[i];
+        ks = range(fn.use0[i], fn.use0[i] + fn.nuse[i]);
+        cs = [const(k) for k in ks];
+        if op in ('nop', 'label', 'line', 'enter', 'leave') or None in cs and op != 'phi':
+            continue;
+        d = fn.defs[fn.def0[i]] if fn.ndef[i] and op != 'pmove' else -1;
+        val = None;
+        if op == 'phi':
+            if cs and None not in cs and all(c.val == cs[0].val and c.type.realp() == cs[0].type.realp()
+                                               for c in cs):
+                val = cs[0].val;
+        elif op == 'mov':
+            val = cs[0].val;
+        elif op == 'bin':
+            val = evaluate(insn[2], cs[0].val, cs[1].val);
+        elif op == 'divc':
+            c = insn[3];
+            val = evaluate('IDIV' if fn.vars[fn.vvar[d]].type.kind == 'int' else 'UDIV',
+                           cs[0].val, c) if d >= 0 else None;
+        elif op == 'cmp':
+            val = int(compare(insn[2], insn[3], cs[0].val, cs[1].val));
+        elif op == 'conv':
+            val = evaluate(insn[2], cs[0].val, None);
+        elif op in BRANCHES + ('jtab',):
+            if op == 'bcmp':
+                taken = compare(insn[2], insn[3], cs[0].val, cs[1].val) == insn[1];
+                label = insn[6];
+            elif op == 'jtab':
+                n = int(cs[0].val) & M;
+                taken = True;
+                label = fn.targets[insn[2]][n] if n < insn[3] else insn[4];
+            else:
+                taken = bool(cs[0].val) == (op == 'bt');
+                label = insn[2];
+            fn.replace(i, ('jmp', label) if taken else ('nop',));
+            stats['branches'] = stats.get('branches', 0) + 1;
+            continue;
+        if val is None or d < 0 or d in known:
+            continue;
+        known[d] = imm(val, d);
+        for j, k in users[d]:
+            if OPS[fn.op[j]] == 'nop' or not fn.use0[j] <= k < fn.use0[j] + fn.nuse[j]:
+                continue;
+            if not fn.pinned[k] and OPS[fn.op[j]] != 'phi':
+                fn.consts[k] = known[d];
+                stats['constants'] = stats.get('constants', 0) + 1;
+            work.append(j);
+
+# blocks no longer reachable, their labels stay for the jump tables
+def unreachable(fn, stats):
+    fn.blocks();
+    reach = set(fn.order());
+    for b in range(len(fn.first) - 1):
+        if b in reach:
+            continue;
+        dead = False;
+        for i in range(fn.first[b], fn.first[b + 1]):
+            if OPS[fn.op[i]] not in ('nop', 'label'):
+                fn.kill(i); dead = True;
+        stats['blocks'] = stats.get('blocks', 0) + dead;
+
+# definitions nothing live reads, calls keep running without their result
+def dead(fn, stats):
+    live = fn.live();
+    for i in range(len(fn.op)):
+        op = OPS[fn.op[i]];
+        ks = range(fn.def0[i], fn.def0[i] + fn.ndef[i]);
+        if op in PURE and not (op == 'bin' and fn.insns[i][2] in ('UDIV', 'IDIV')):
+            if fn.ndef[i] and all(fn.defs[k] >= 0 and not live[fn.defs[k]] for k in ks):
+                if op != 'phi':
+                    stats['dead'] = stats.get('dead', 0) + 1;
+                fn.kill(i);
+        elif op in CALLS and fn.insns[i][1] is not None and fn.defs[fn.def0[i]] >= 0 and \
+             not live[fn.defs[fn.def0[i]]]:
+            fn.insns[i] = put(fn.insns[i], (1,), None);
+            stats['dead'] = stats.get('dead', 0) + 1;
+        elif op == 'pmove':
+            for k, p in zip(ks, fn.paths[i][0]):
+                if fn.defs[k] >= 0 and not live[fn.defs[k]] and fn.insns[i][1][p[1]] is not None:
+                    fn.insns[i] = put(fn.insns[i], p[:2], None);
+                    stats['dead'] = stats.get('dead', 0) + 1;
+
+# jumps to jumps go to the final target, and jumps to the next instruction
+# are dropped
+def jumps(fn, stats):
+    where = {};
+    for i in range(len(fn.op)):
+        if OPS[fn.op[i]] == 'label':
+            where[fn.insns[i][1]] = i;
+    def final(label):
+        seen = set();
+        while label not in seen:
+            seen.add(label); i = where[label];
+            while i < len(fn.op) and OPS[fn.op[i]] in QUIET:
+                i += 1;
+            if i == len(fn.op) or OPS[fn.op[i]] != 'jmp':
+                break;
+            label = fn.insns[i][1];
+        return label
+    for i in range(len(fn.op)):
+        op = OPS[fn.op[i]];
+        if op not in ('jmp',) + BRANCHES:
+            continue;
+        insn = fn.insns[i]; label = final(insn[-1]);
+        if label != insn[-1]:
+            fn.insns[i] = insn[:-1] + (label,);
+            stats['jumps'] = stats.get('jumps', 0) + 1;
+        j = i + 1;
+        while j < len(fn.op) and OPS[fn.op[j]] in QUIET and \
+              not (OPS[fn.op[j]] == 'label' and fn.insns[j][1] == label):
+            j += 1;
+        if op == 'jmp' and j < len(fn.op) and OPS[fn.op[j]] == 'label':
+            fn.kill(i);
+            stats['jumps'] = stats.get('jumps', 0) + 1;
+
+PASSES = (propagate, unreachable, dead, jumps);
+STATS = {
+    'constants': 'operands made constant', 'branches': 'branches folded',
+    'blocks': 'blocks removed', 'dead': 'definitions removed',
+    'jumps': 'jumps threaded or removed'
+};
+
+def optimize(gen, report=None, passes=PASSES, frames=None):
+    frames = frames or list(gen.frames.values()) + [gen.main];
+    vars = variables(frames, gen.unescaped);
+    targets = {label: [r.label for r in words] for label, words in gen.data
+               if words and all(hasattr(r, 'label') for r in words)};
+    for f in frames:
+        fn = Function(f, vars[id(f)], targets); stats = {};
+        for p in passes:
+            p(fn, stats);
+        f.code = fn.code();
+        if report is not None and any(stats.values()):
+            report(f"ssa: {f.name}: " + ", ".join(f"{n} {STATS[what]}" for what, n in stats.items() if n));
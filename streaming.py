@@ -0,0 +1,188 @@
+#! /usr/bin/env python
+
+# compiles a PROGRAM a top level declaration at a time, for sources too large
+# to keep as one syntax tree, see complr.py -t and STREAMING in README
+
+from __future__ import annotations
+import os
+import struct
+from dataclasses import replace
+from complr import *
+from opt import descendants, functions, labels_of, arg_names
+from backend import Gen, Select, Image, Ref, IMAGE_BASE, STACK_GAP, STACK_SIZE, OPCODES, \
+    NOCODE, layout, pool, align, taken
+
+# the top level declarations of the unit in path, each passed to keep as it
+# is parsed, and the unit without them
+def read_decls(path, keep):
+    with open(path, encoding='utf-8') as f:
+        try:
+            return parse_toplevel(f.read, keep)
+        except CompileError as e:
+            die(f"{path}: {e}");
+
+# a function without its body and nested functions, enough to call it
+def stub(decl):
+    body = Statement(decl.body.line, VoidSttmt(decl.body.line));
+    return replace(decl, decls=[d for d in decl.decls if isinstance(d, TypeDecl)], body=body)
+
+# the strings of Gen, those it added since the last group in new
+class Strings(dict):
+    def __init__(self):
+        super().__init__(); self.new = {};
+
+    def __setitem__(self, s, label):
+        super().__setitem__(s, label); self.new[s] = label;
+
+# the words of an image written in order, a reference to a label not yet
+# written is patched when the image is closed
+class Writer:
+    def __init__(self, f):
+        self.f = f; self.pc = IMAGE_BASE; self.fixups = [];
+        self.image = Image([], [], {}, IMAGE_BASE);
+
+    def operand(self, x, pc):
+        if isinstance(x, Ref) and x.label not in self.image.addrs:
+            self.fixups.append((self.pc + len(self.words) - IMAGE_BASE, x, pc));
+            return 0;
+        return self.image.operand(x, pc)
+
+    # code and the data after it, as assemble() lays them out, the labels of
+    # both are forgotten after, but for those in keep
+    def write(self, code, data=[], aliases={}, keep=()):
+        addrs = self.image.addrs; pc = self.pc; new = [];
+        for insn in code:
+            if insn[0] == 'label':
+                addrs[insn[1]] = pc; new.append(insn[1]);
+            elif insn[0] not in NOCODE:
+                pc += len(insn);
+        for label, words in data:
+            addrs[label] = pc; pc += len(words); new.append(label);
+        for label, (base, off) in aliases.items():
+            addrs[label] = addrs[base] + off; new.append(label);
+        self.words = [];
+        for insn in code:
+            if insn[0] not in NOCODE:
+                at = self.pc + len(self.words);
+                self.words.append(OPCODES[insn[0]]);
+                self.words.extend(self.operand(x, at) for x in insn[1:]);
+        for label, words in data:
+            self.words.extend(self.operand(x, None) for x in words);
+        self.f.write(struct.pack(f"<{len(self.words)}Q", *[w & 0xffffffffffffffff for w in self.words]));
+        self.pc = pc;
+        for label in new:
+            if label not in keep:
+                del addrs[label];
+
+    def close(self):
+        addrs = self.image.addrs;
+        addrs['stack'] = align(self.pc + STACK_GAP, 1024) + STACK_SIZE - 1;
+        for at, ref, pc in sorted(self.fixups, key=lambda x: x[0]):
+            if ref.label not in addrs:
+                die(f"{ref.label}: undefined in the image");
+            self.f.seek(8 * at);
+            self.f.write(struct.pack('<Q', self.image.operand(ref, pc) & 0xffffffffffffffff));
+
+class Stream:
+    def __init__(self, gen, out, report, level, fuse):
+        self.gen = gen; self.report = report; self.level = level; self.fuse = fuse;
+        self.writer = Writer(out); self.base = gen.taken;
+        gen.strings = Strings();
+
+    # lowers, optimizes and writes the frames, then forgets them
+    def emit(self, frames, nodes=()):
+        gen = self.gen; report = self.report;
+        gen.taken = self.base | taken(nodes);
+        for f in frames:
+            gen.function(f, f.decl.body);
+        if self.level > 0:
+            import ssa
+            ssa.optimize(gen, report, frames=frames);
+        for f in frames:
+            layout(f);
+        if self.level > 0:
+            import coloring
+            coloring.color(gen, report, frames);
+        sel = Select(gen, self.fuse);
+        for f in frames:
+            sel.function(f);
+        strings, aliases = pool(gen.strings.new);
+        keep = set(gen.strings.new.values()) | {f.label for f in frames if f.depth == 0};
+        self.writer.write(sel.code, gen.data + strings, aliases, keep);
+        gen.strings.new = {}; gen.data = []; gen.writes = {};
+        for name, removed, checks in gen.bounds if report is not None else []:
+            report(f"bounds: {name}: {removed} of {checks} checks removed");
+        gen.bounds = [];
+        for f in frames:
+            f.code = [];
+        for node in nodes:
+            self.forget(node);
+
+    # the entry, the globals and the library functions, then each function
+    # of the program as the second reading parses it, and its body last
+    def run(self, path, program, stubs):
+        gen = self.gen; scope = gen.res.scope(program); name = program.name.id;
+        self.writer.write(Select(gen, self.fuse).entry(), gen.data, keep={x for x, _ in gen.data});
+        gen.data = [];
+        ids = {id(f) for f in stubs.values()};
+        self.emit([f for f in gen.frames.values() if id(f) not in ids]);
+        def define(d):
+            if not isinstance(d, (FuncDecl, ProcDecl)):
+                return;
+            if d.name.id not in stubs:
+                die(f"{path}: {d.name.id} changed while compiling @ {d.line}");
+            frames = [];
+            for decl, inner in functions(replace(program, decls=[d]), scope, gen.res, []):
+                gen.frame(decl, inner);
+                frames.append(gen.frames[id(decl)]); frames[-1].unit = name;
+            frames[0].label = stubs[d.name.id].label;
+            self.emit(frames, [d]);
+        body = read_decls(path, define).body;
+        gen.main.decl = replace(program, body=body);
+        self.emit([gen.main], [body]);
+        self.writer.close();
+
+    # drops what gen keeps by the ids of the nodes of a declaration, so a
+    # later declaration reusing an id can't find it
+    def forget(self, node):
+        gen = self.gen;
+        for x in descendants(node):
+            gen.types.pop(id(x), None); gen.res.scopes.pop(id(x), None);
+            gen.frames.pop(id(x), None);
+            if isinstance(x, VarDecl):
+                names = [y.id for y in x.names];
+            elif isinstance(x, (FuncDecl, ProcDecl)):
+                names = arg_names(x) + ([x.resvar.id] if isinstance(x, FuncDecl) else []);
+            else:
+                continue;
+            for name in names:
+                gen.slots.pop((id(x), name), None);
+
+# compiles the PROGRAM at the end of paths, after the LIBRARY files before it,
+# to the image file output, reading the PROGRAM twice, first for the calls
+# of its functions, then for their code
+def compile(paths, output, report=None, checked=False, level=1, fuse=True, cache=None):
+    *libpaths, path = paths;
+    libs = {};
+    if libpaths:
+        unit, libs = compile_sources(libpaths, cache);
+        libs[unit.name] = unit;
+    decls = [];
+    def declare(d):
+        decls.append(stub(d) if isinstance(d, (FuncDecl, ProcDecl)) else d);
+    program = read_decls(path, declare);
+    if not isinstance(program, Program):
+        die(f"{path}: no PROGRAM to compile");
+    labels = labels_of(program.body); line = program.body.line;
+    program = replace(program, decls=decls, body=Statement(line, VoidSttmt(line)));
+    interface(program, libs);
+    units = {name: iface.unit for name, iface in libs.items()};
+    gen = Gen(program, units, checked);
+    gen.res.scope(program).labels = labels;
+    stubs = {d.name.id: gen.frames[id(d)] for d in decls if isinstance(d, (FuncDecl, ProcDecl))};
+    try:
+        with open(output, 'wb') as out:
+            Stream(gen, out, report, level, fuse).run(path, program, stubs);
+    except BaseException:
+        os.remove(output);
+        raise;
@@ -3,15 +3,19 @@
 
 #include "vm.h"
 
+#ifndef DISPATCH_HOOK
+# define DISPATCH_HOOK
+#endif
+
 #ifdef __GNUC__
 # define SWITCH_WITH { void *__switch_labels__[] = {
-# define BEGIN_SWITCH(x) }; goto *__switch_labels__[x];
+# define BEGIN_SWITCH(x) }; DISPATCH_HOOK goto *__switch_labels__[x];
 # define CASE(x) __LABEL__ ## x
-# define BREAK goto *__switch_labels__[uregs[PC]];
+# define BREAK DISPATCH_HOOK goto *__switch_labels__[mem[uregs[PC]]];
 # define END_SWITCH };
 #else
 # define SWITCH_WITH
-# define BEGIN_SWITCH(x) switch(x) {
+# define BEGIN_SWITCH(x) DISPATCH_HOOK switch(x) {
 # define CASE(x) x
 # define BREAK break
 # define END_SWITCH };
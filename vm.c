@@ -2,11 +2,71 @@
 #include <stddef.h>
 #include <getopt.h>
 #include <stdint.h>
+#include <inttypes.h>
 #include <string.h>
 #include <stdlib.h>
 #include <errno.h>
 #include <stdio.h>
 #include <sys/mman.h>
+
+// build with -DCOUNT_DISPATCHES to count the dispatches of a run
+#ifdef COUNT_DISPATCHES
+static uint64_t dispatches;
+# define COUNT_DISPATCH dispatches++;
+#else
+# define COUNT_DISPATCH
+#endif
+
+// build with -DPROFILE to sample the pc and the return addresses of the
+// frames every millisecond of cpu time, a line of them per sample, for
+// prof.py, a sample is taken at the next dispatch after the timer, or with
+// -c to count the dispatches of every pc, a `pc count' line per pc run
+#ifdef PROFILE
+# include <signal.h>
+# include <sys/time.h>
+static volatile sig_atomic_t sample_due;
+static FILE *profile;
+static uint64_t *counts;
+static size_t countlen;
+
+static void on_sigprof(int sig) {
+  (void)sig;
+  sample_due = 1;
+}
+
+// r2 is the frame of the running function, its saved r2 at r2+1 and its
+// return address minus 3 at r2+2, frames are higher up the stack
+static void sample(uint64_t *uregs, uint64_t *mem, size_t memlen, size_t imglen) {
+  sample_due = 0;
+  fprintf(profile, "%" PRIu64, uregs[PC]);
+  for (uint64_t r2 = uregs[FRAME]; r2 + 2 < memlen;) {
+    uint64_t ret = mem[r2 + 2] + 3, next = mem[r2 + 1];
+    if (ret <= 1024 || ret > 1024 + imglen)
+      break;
+    fprintf(profile, " %" PRIu64, ret);
+    if (next <= r2)
+      break;
+    r2 = next;
+  }
+  fputc('\n', profile);
+}
+
+static void write_counts(void) {
+  for (size_t i = 0; i < countlen; i++)
+    if (counts[i])
+      fprintf(profile, "%zu %" PRIu64 "\n", i, counts[i]);
+  fflush(profile);
+}
+
+# define SAMPLE \
+  if (counts) { if (pc < countlen) counts[pc]++; } \
+  else if (sample_due) sample(uregs, mem, memlen, machine->imglen);
+#else
+# define SAMPLE
+#endif
+
+#define DISPATCH_HOOK COUNT_DISPATCH SAMPLE
+
 #include "switch.h"
 #include "reinterpret_cast.h"
 #include "utf64.h"
@@ -44,11 +104,12 @@ uint64_t execute(struct machine *machine) {
 
 #define op1 mem[pc+1]
 #define op2 mem[pc+2]
+#define op3 mem[pc+3]
 
   for (;;) {
     SWITCH_WITH
 #include "opcode.h"
-    BEGIN_SWITCH(pc)
+    BEGIN_SWITCH(mem[pc])
     CASE(ULD):
       uregs[op1] = mem[uregs[op2]];
       pc += 3;
@@ -218,7 +279,114 @@ uint64_t execute(struct machine *machine) {
       BREAK;
     }
     CASE(STOP):
+#ifdef COUNT_DISPATCHES
+      fprintf(stderr, "vm: %" PRIu64 " dispatches\n", dispatches);
+#endif
+#ifdef PROFILE
+      if (counts)
+        write_counts();
+#endif
       return uregs[op1];
+    CASE(UADDI):
+      uregs[op1] = uregs[op2] + op3;
+      pc += 4;
+      BREAK;
+    CASE(ULDO):
+      uregs[op1] = mem[uregs[op2] + op3];
+      pc += 4;
+      BREAK;
+    CASE(FLDO):
+      fregs[op1] = rc_u2f(mem[uregs[op2] + op3]);
+      pc += 4;
+      BREAK;
+    CASE(USTO):
+      mem[uregs[op1] + op2] = uregs[op3];
+      pc += 4;
+      BREAK;
+    CASE(FSTO):
+      mem[uregs[op1] + op2] = rc_f2u(fregs[op3]);
+      pc += 4;
+      BREAK;
+    CASE(ULDA):
+      uregs[op1] = mem[op2];
+      pc += 3;
+      BREAK;
+    CASE(FLDA):
+      fregs[op1] = rc_u2f(mem[op2]);
+      pc += 3;
+      BREAK;
+    CASE(USTA):
+      mem[op1] = uregs[op2];
+      pc += 3;
+      BREAK;
+    CASE(FSTA):
+      mem[op1] = rc_f2u(fregs[op2]);
+      pc += 3;
+      BREAK;
+    CASE(UEQBT):
+      cond = uregs[op1] == uregs[op2];
+      pc += cond ? rc_u2i(op3) : 4;
+      BREAK;
+    CASE(UEQBF):
+      cond = uregs[op1] == uregs[op2];
+      pc += !cond ? rc_u2i(op3) : 4;
+      BREAK;
+    CASE(FEQBT):
+      cond = fregs[op1] == fregs[op2];
+      pc += cond ? rc_u2i(op3) : 4;
+      BREAK;
+    CASE(FEQBF):
+      cond = fregs[op1] == fregs[op2];
+      pc += !cond ? rc_u2i(op3) : 4;
+      BREAK;
+    CASE(UGTBT):
+      cond = uregs[op1] > uregs[op2];
+      pc += cond ? rc_u2i(op3) : 4;
+      BREAK;
+    CASE(UGTBF):
+      cond = uregs[op1] > uregs[op2];
+      pc += !cond ? rc_u2i(op3) : 4;
+      BREAK;
+    CASE(IGTBT):
+      cond = rc_u2i(uregs[op1]) > rc_u2i(uregs[op2]);
+      pc += cond ? rc_u2i(op3) : 4;
+      BREAK;
+    CASE(IGTBF):
+      cond = rc_u2i(uregs[op1]) > rc_u2i(uregs[op2]);
+      pc += !cond ? rc_u2i(op3) : 4;
+      BREAK;
+    CASE(FGTBT):
+      cond = fregs[op1] > fregs[op2];
+      pc += cond ? rc_u2i(op3) : 4;
+      BREAK;
+    CASE(FGTBF):
+      cond = fregs[op1] > fregs[op2];
+      pc += !cond ? rc_u2i(op3) : 4;
+      BREAK;
+    CASE(ULTBT):
+      cond = uregs[op1] < uregs[op2];
+      pc += cond ? rc_u2i(op3) : 4;
+      BREAK;
+    CASE(ULTBF):
+      cond = uregs[op1] < uregs[op2];
+      pc += !cond ? rc_u2i(op3) : 4;
+      BREAK;
+    CASE(ILTBT):
+      cond = rc_u2i(uregs[op1]) < rc_u2i(uregs[op2]);
+      pc += cond ? rc_u2i(op3) : 4;
+      BREAK;
+    CASE(ILTBF):
+      cond = rc_u2i(uregs[op1]) < rc_u2i(uregs[op2]);
+      pc += !cond ? rc_u2i(op3) : 4;
+      BREAK;
+    CASE(FLTBT):
+      cond = fregs[op1] < fregs[op2];
+      pc += cond ? rc_u2i(op3) : 4;
+      BREAK;
+    CASE(FLTBF):
+      cond = fregs[op1] < fregs[op2];
+      pc += !cond ? rc_u2i(op3) : 4;
+      BREAK;
     END_SWITCH
   }
 }
@@ -283,14 +451,28 @@ void chunk_free(void *chunk, size_t x) {
 void usage(const char *prog) {
   fprintf(stderr,
     "Usage:\t%s [-b bytes | --bytes bytes] file\n"
-    "-b --bytes\tspecify bytes number of the vm, the vm use 64 bit byte\n",
-    prog
+    "-b --bytes\tspecify bytes number of the vm, the vm use 64 bit byte\n"
+#ifdef PROFILE
+    "-p --profile\twrite the samples to file instead of vm.prof\n"
+    "-c --count\tcount the dispatches of every pc instead of sampling\n"
+#endif
+    , prog
   );
   exit(0);
 }
 
+#ifdef PROFILE
+# define PROFILE_OPTS "cp:"
+#else
+# define PROFILE_OPTS ""
+#endif
+
 static struct option opts[] = {
   {"bytes", required_argument, NULL, 'b'},
+#ifdef PROFILE
+  {"profile", required_argument, NULL, 'p'},
+  {"count",   no_argument,       NULL, 'c'},
+#endif
   {NULL,    0,                 NULL, 0},
 };
 
@@ -302,13 +484,31 @@ uint64_t vm_imgsiz(struct machine *vm) {
   return vm->imglen;
 }
 
+// the c calls at mem[1] to mem[10], see C CALL in README
+void vm_ccalls(struct machine *machine) {
+  machine->mem[ 1] = (uint64_t)vm_printf;
+  machine->mem[ 2] = (uint64_t)vm_fopen;
+  machine->mem[ 3] = (uint64_t)vm_fclose;
+  machine->mem[ 4] = (uint64_t)vm_fseek;
+  machine->mem[ 5] = (uint64_t)vm_writetxt;
+  machine->mem[ 6] = (uint64_t)vm_writebytes;
+  machine->mem[ 7] = (uint64_t)vm_readtxt;
+  machine->mem[ 8] = (uint64_t)vm_readbytes;
+  machine->mem[ 9] = (uint64_t)vm_bytes;
+  machine->mem[10] = (uint64_t)vm_imgsiz;
+}
+
 int main(int argc, char *argv[]) {
   size_t bytes = 64 * 1024 * 1024;
-  char ch;
+  int ch;
 
   char *prog = argv[0];
+#ifdef PROFILE
+  char *pname = "vm.prof";
+  int counting = 0;
+#endif
 
-  while ((ch = getopt_long(argc, argv, "m:", opts, NULL)) != -1) {
+  while ((ch = getopt_long(argc, argv, "b:" PROFILE_OPTS, opts, NULL)) != -1) {
     switch (ch) {
     case 'b':
       errno = 0;
@@ -318,6 +518,14 @@ int main(int argc, char *argv[]) {
         exit(errno);
       }
       break;
+#ifdef PROFILE
+    case 'p':
+      pname = optarg;
+      break;
+    case 'c':
+      counting = 1;
+      break;
+#endif
     default:
       usage(prog);
     }
@@ -331,7 +539,7 @@ int main(int argc, char *argv[]) {
   char *fname = argv[optind];
 
   FILE *f;
-  if (strcmp(fname, "-"))
+  if (!strcmp(fname, "-"))
     f = stdin;
   else
     f = fopen(fname, "r");
@@ -343,30 +551,21 @@ int main(int argc, char *argv[]) {
   struct machine machine;
   memset(&machine, 0, sizeof(machine));
   machine.memlen = bytes;
-  machine.mem = chunk_alloc(bytes);
+  machine.mem = chunk_alloc(sizeof(uint64_t) * bytes);
   if (machine.mem == NULL) {
     perror(prog);
     exit(errno);
   }
   memset(machine.mem, 0, sizeof(int64_t) * bytes);
 
-  machine.mem[ 1] = (uint64_t)vm_printf;
-  machine.mem[ 2] = (uint64_t)vm_fopen;
-  machine.mem[ 3] = (uint64_t)vm_fclose;
-  machine.mem[ 4] = (uint64_t)vm_fseek;
-  machine.mem[ 5] = (uint64_t)vm_writetxt;
-  machine.mem[ 6] = (uint64_t)vm_writebytes;
-  machine.mem[ 7] = (uint64_t)vm_readtxt;
-  machine.mem[ 8] = (uint64_t)vm_readbytes;
-  machine.mem[ 9] = (uint64_t)vm_bytes;
-  machine.mem[10] = (uint64_t)vm_imgsiz;
+  vm_ccalls(&machine);
 
   size_t sret = fread(machine.mem + 1024, sizeof(int64_t), bytes - 1024, f);
   if (ferror(f)) {
     perror(prog);
     exit(errno);
   }
-  if (feof(f)) {
+  if (!feof(f)) {
     fprintf(stderr, "vm: address space is full\n");
     exit(errno);
   }
@@ -374,5 +573,28 @@ int main(int argc, char *argv[]) {
   machine.imglen = sret;
 
   machine.uregs[PC] = 1024;
+#ifdef PROFILE
+  profile = fopen(pname, "w");
+  if (profile == NULL) {
+    perror(pname);
+    exit(errno);
+  }
+  if (counting) {
+    countlen = 1024 + machine.imglen;
+    counts = calloc(countlen, sizeof(uint64_t));
+    if (counts == NULL) {
+      perror(prog);
+      exit(errno);
+    }
+    return execute(&machine);
+  }
+  struct sigaction sa;
+  memset(&sa, 0, sizeof(sa));
+  sa.sa_handler = on_sigprof;
+  sa.sa_flags = SA_RESTART;
+  sigaction(SIGPROF, &sa, NULL);
+  struct itimerval tv = {{0, 1000}, {0, 1000}};
+  setitimer(ITIMER_PROF, &tv, NULL);
+#endif
   return execute(&machine);
 }
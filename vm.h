@@ -42,4 +42,9 @@ struct machine {
   size_t    imglen;
 };
 
+void *chunk_alloc(size_t x);
+void chunk_free(void *chunk, size_t x);
+uint64_t execute(struct machine *machine);
+void vm_ccalls(struct machine *machine);
+
 #endif /* VM_H_ */
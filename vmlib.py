@@ -0,0 +1,132 @@
+#! /usr/bin/env python
+
+# compiles and runs programs in process, on the virtual machine of libvm.so,
+# built by `make libvm.so', see README
+
+import ctypes
+import mmap
+import os
+import sys
+from array import array
+from getopt import getopt, GetoptError
+
+IMAGE_BASE = 1024;
+WORDS = 64 * 1024 * 1024;  # the memory of vm without -b
+
+USAGE = """\
+Usage:\t{0} [-b words] [-n times] file...
+-b\tthe words of memory, the default is {1}
+-n\trun the program times times, on the same memory
+file\ta PROGRAM and the LIBRARY files it uses, libraries in dependency order"""
+
+class Machine(ctypes.Structure):
+    _fields_ = [('uregs', ctypes.c_uint64 * 8), ('fregs', ctypes.c_double * 8),
+                ('mem', ctypes.c_void_p), ('memlen', ctypes.c_size_t),
+                ('imglen', ctypes.c_size_t)];
+
+def load(path=None):
+    lib = ctypes.CDLL(path or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'libvm.so'));
+    lib.chunk_alloc.restype = ctypes.c_void_p; lib.chunk_alloc.argtypes = [ctypes.c_size_t];
+    lib.chunk_free.argtypes = [ctypes.c_void_p, ctypes.c_size_t];
+    lib.execute.restype = ctypes.c_uint64; lib.execute.argtypes = [ctypes.POINTER(Machine)];
+    lib.vm_ccalls.argtypes = [ctypes.POINTER(Machine)];
+    lib.vm_captured.restype = ctypes.c_void_p;
+    lib.vm_captured.argtypes = [ctypes.POINTER(ctypes.c_size_t)];
+    lib.madvise.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int];
+    lib.fflush.argtypes = [ctypes.c_void_p];
+    return lib
+
+# the image of the sources, as complr.py compiles it without -g
+def compile(paths, report=None, checked=False, level=1, fuse=True, limit=None, counts=None,
+            cache=None):
+    import complr
+    import backend
+    tree, units, profile = complr.optimize(paths, cache, report, level, limit, False, counts);
+    if not isinstance(tree, complr.Program):
+        complr.die(f"{paths[-1]}: no PROGRAM to compile");
+    return backend.generate(tree, units, report, checked, level, fuse, profile)
+
+# a machine on memory mapped as vm maps it, between guard pages, each run
+# writes the image into it and gives the pages it dirtied back, so the next
+# run finds them zero, a program that faults takes the process with it
+class VM:
+    def __init__(self, words=WORDS, lib=None):
+        self.lib = lib or load(); self.words = words;
+        self.mem = self.lib.chunk_alloc(8 * words);
+        if not self.mem:
+            raise MemoryError(f"vm: can't map {words} words");
+
+    def close(self):
+        if self.mem:
+            self.lib.chunk_free(self.mem, 8 * self.words);
+            self.mem = None;
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close();
+
+    # the status of the program, the register of its STOP, and with capture
+    # the bytes it wrote to stdout, None without
+    def run(self, image, capture=False):
+        words = array('Q', image.words() if hasattr(image, 'words') else image);
+        if IMAGE_BASE + len(words) > self.words:
+            raise MemoryError("vm: address space is full");
+        self.lib.madvise(self.mem, 8 * self.words, mmap.MADV_DONTNEED);
+        ctypes.memmove(self.mem + 8 * IMAGE_BASE, words.buffer_info()[0], 8 * len(words));
+        machine = Machine(mem=self.mem, memlen=self.words, imglen=len(words));
+        machine.uregs[0] = IMAGE_BASE;
+        self.lib.vm_file_io_close();
+        self.lib.vm_file_io_init();
+        self.lib.vm_ccalls(ctypes.byref(machine));
+        if not capture:
+            sys.stdout.flush();
+            status = self.lib.execute(ctypes.byref(machine));
+            self.lib.fflush(None);
+            return status, None
+        if self.lib.vm_capture() != 0:
+            raise OSError("vm: can't capture stdout");
+        try:
+            status = self.lib.execute(ctypes.byref(machine));
+            n = ctypes.c_size_t();
+            at = self.lib.vm_captured(ctypes.byref(n));
+            return status, ctypes.string_at(at, n.value) if n.value else b''
+        finally:
+            self.lib.vm_uncapture();
+
+def main(argv):
+    import complr
+    try:
+        opts, args = getopt(argv[1:], 'hb:n:');
+    except GetoptError as e:
+        print(f"{argv[0]}: {e}", file=sys.stderr);
+        return 1;
+    words = WORDS; times = 1; status = 0;
+    for opt, arg in opts:
+        if opt == '-h':
+            print(USAGE.format(argv[0], WORDS), file=sys.stderr);
+            return 0;
+        if opt in ('-b', '-n'):
+            if not arg.isdigit():
+                print(f"{argv[0]}: bad number {arg}", file=sys.stderr);
+                return 1;
+            if opt == '-b':
+                words = int(arg);
+            else:
+                times = int(arg);
+    if args == []:
+        print(USAGE.format(argv[0], WORDS), file=sys.stderr);
+        return 1;
+    try:
+        image = compile(args);
+        with VM(words) as vm:
+            for _ in range(times):
+                status, _ = vm.run(image);
+    except (complr.CompileError, OSError, UnicodeDecodeError, MemoryError) as e:
+        print(f"{argv[0]}: {e}", file=sys.stderr);
+        return 1;
+    return status & 255
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))